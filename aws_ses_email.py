@@ -5,14 +5,19 @@
 #
 
 import optparse
-import jinja2
 import time
 import os
 import sys
-import boto.ses
+import json
+import stat
+import errno
+import fcntl
 import random
+import threading
+import Queue
 import logging
 import logging.handlers
+import instrumentation
 
 
 __version__ = 0.1
@@ -31,6 +36,19 @@ OPTIONS = {
     "to": "To email address",
     "from_address": "From email address",
     "reply_to": "reply-to email address",
+    "spool_dir": "Queue the rendered email in this directory, to be sent" \
+        " by aws_ses_spool_sender.py, instead of sending it. Default: send" \
+        " immediately",
+    "region_stats_file": "File with per region latency & error rate" \
+        " averages, used to prefer fast & healthy regions. Default:" \
+        " /var/tmp/aws_ses_email_region_stats.json",
+    "hedge_after": "Seconds after which the email is also sent using a" \
+        " second region, if the first has not finished. May deliver" \
+        " duplicate emails. Default: disabled",
+    "profile": "Write a cProfile dump & JSON phase timing report of this" \
+        " run in profile_dir",
+    "profile_dir": "Directory for profiles. Default:" \
+        " /var/tmp/nrpe_plugin_profiles",
     # Shinken data
     "attempt_no": "Host/service check attempt number",
     "duration": "Duration of current state",
@@ -53,6 +71,30 @@ OPTIONS = {
     "state_type": "Hard or Soft state",
 }
 USAGE = "%s [options]"  % os.path.basename(__file__)
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'templates')
+# Compiled templates are cached here, across runs. None: jinja2's per user
+# directory in the temp dir, created 0700 & checked to be owned by the user.
+# A directory set here must be private to the user as well, as cached
+# bytecode is loaded & run
+TEMPLATE_CACHE_DIR = None
+template_environment = None
+# Options not passed to templates
+NON_TEMPLATE_OPTIONS = ['aws_region', 'aws_access_key_id',
+                        'aws_secret_access_key', 'spool_dir',
+                        'region_stats_file', 'hedge_after', 'profile',
+                        'profile_dir']
+# Options without value
+FLAG_OPTIONS = ['profile']
+# Region selection using exponentially weighted moving averages (EWMA) of
+# send latency & error rate. Stats older than max age are ignored
+REGION_STATS_FILE = '/var/tmp/aws_ses_email_region_stats.json'
+REGION_STATS_ALPHA = 0.3
+REGION_STATS_MAX_AGE = 3600
+ERROR_RATE_PENALTY = 10
+# SES errors about the email itself, like an invalid address or rejected
+# content. Other regions & retries fail the same way
+PERMANENT_ERRORS = ['MessageRejected', 'InvalidParameterValue']
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -61,12 +103,20 @@ handler = logging.handlers.SysLogHandler(address='/dev/log')
 logger.addHandler(handler)
 
 
+class PermanentSendError(Exception):
+    """Email rejected by SES or invalid, sending it again won't help"""
+
+
 def parse_options(options, description=None, usage=None, version=None):
     parser = optparse.OptionParser(description=description, usage=usage,
                                    version=version)
     for keyname, description in options.items():
         longopt = '--%s' % keyname
-        parser.add_option(longopt, dest=keyname, help=description)
+        if keyname in FLAG_OPTIONS:
+            parser.add_option(longopt, dest=keyname, action='store_true',
+                              help=description)
+        else:
+            parser.add_option(longopt, dest=keyname, help=description)
     option_args, _ = parser.parse_args()
     arguments = {}
     for keyname in options.keys():
@@ -74,30 +124,114 @@ def parse_options(options, description=None, usage=None, version=None):
     return arguments
 
 
+def validate_arguments(arguments):
+    hedge_after = arguments.get('hedge_after')
+    if hedge_after:
+        try:
+            arguments['hedge_after'] = float(hedge_after)
+            if arguments['hedge_after'] <= 0:
+                raise ValueError()
+        except ValueError:
+            raise ValueError("Invalid hedge_after: %s. Possible value:"
+                             " Positive number of seconds" % hedge_after)
+
+
+@instrumentation.timed
 def generate_subject_and_body(arguments):
     data = arguments.copy()
-    # Remove credentials before rendering template
-    data.pop('aws_region')
-    data.pop('aws_access_key_id')
-    data.pop('aws_secret_access_key')
+    # Remove credentials & other settings before rendering template
+    for keyname in NON_TEMPLATE_OPTIONS:
+        data.pop(keyname, None)
     manipulate_data(data)
-    # Load Template
-    abs_path = os.path.abspath(__file__)
-    abs_path_dir = os.path.sep.join(abs_path.split(os.path.sep)[:-1])
-    template_file = "%s/templates/%s.j2" % (abs_path_dir, arguments.get('notification_for', None))
-    with open(template_file, 'r') as f:
-        # The first line is subject
-        subject_template = f.readline().strip()
-        # Rest is body
-        body_template = f.read().strip()
-    # Render Template
-    template = jinja2.Template(subject_template)
+    # Load & render Template
+    environment = get_template_environment()
+    notification_for = arguments.get('notification_for', None)
+    template = environment.get_template("%s:subject" % notification_for)
     subject = template.render(**data)
-    template = jinja2.Template(body_template)
+    template = environment.get_template("%s:body" % notification_for)
     body = template.render(**data)
     return (subject, body)
 
 
+def check_private_dir(path):
+    """
+    Create path 0700 if missing. Raises OSError unless it is a directory
+    owned by this user & accessible by nobody else
+    """
+    try:
+        os.mkdir(path, 0700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    dir_stat = os.lstat(path)
+    if not stat.S_ISDIR(dir_stat.st_mode) or \
+            dir_stat.st_uid != os.getuid() or \
+            stat.S_IMODE(dir_stat.st_mode) != 0700:
+        raise OSError(errno.EPERM, "%s must be a directory owned by uid %s"
+                      " with mode 0700" % (path, os.getuid()))
+
+
+def get_template_environment():
+    """
+    jinja2 environment loading templates/<name>.j2 as two templates:
+    '<name>:subject' (the first line) & '<name>:body' (the rest). Compiled
+    templates are cached on disk in a directory private to the user, keyed by
+    template file mtime. jinja2 is imported here, only when a template is rendered
+    """
+    global template_environment
+    if template_environment is not None:
+        return template_environment
+    with instrumentation.phase('import'):
+        import jinja2
+
+    class SubjectBodyLoader(jinja2.BaseLoader):
+        def get_source(self, environment, template):
+            name, _, part = template.rpartition(':')
+            path = os.path.join(TEMPLATE_DIR, "%s.j2" % name)
+            try:
+                mtime = os.path.getmtime(path)
+                with open(path, 'r') as f:
+                    # The first line is subject
+                    subject_template = f.readline().strip()
+                    # Rest is body
+                    body_template = f.read().strip()
+            except (IOError, OSError):
+                raise jinja2.TemplateNotFound(template)
+            if part == 'subject':
+                source = subject_template
+            else:
+                source = body_template
+            return (source.decode('utf-8'), path,
+                    lambda: os.path.getmtime(path) == mtime)
+
+    class MtimeBytecodeCache(jinja2.FileSystemBytecodeCache):
+        def get_cache_key(self, name, filename=None):
+            name = "%s:%s" % (name, os.path.getmtime(filename))
+            return jinja2.FileSystemBytecodeCache.get_cache_key(
+                self, name, filename)
+
+        def dump_bytecode(self, bucket):
+            # Atomic replace, concurrent notifications share the cache
+            path = self._get_cache_filename(bucket)
+            temp_path = "%s.%s.tmp" % (path, os.getpid())
+            with open(temp_path, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.rename(temp_path, path)
+
+    bytecode_cache = None
+    try:
+        if TEMPLATE_CACHE_DIR is None:
+            bytecode_cache = MtimeBytecodeCache()
+        else:
+            check_private_dir(TEMPLATE_CACHE_DIR)
+            bytecode_cache = MtimeBytecodeCache(TEMPLATE_CACHE_DIR)
+    except (OSError, RuntimeError) as e:
+        logger.warning("AWS_SES_EMAIL: Template cache disabled: %s" % e)
+    template_environment = jinja2.Environment(loader=SubjectBodyLoader(),
+                                              bytecode_cache=bytecode_cache)
+    return template_environment
+
+
 def manipulate_data(data):
     if data.get("to", None):
         data["name"] = data["to"].split('@')[0].title()
@@ -122,12 +256,79 @@ def manipulate_data(data):
             data[k] = '-'
 
 
-def select_region(aws_region, blacklist = []):
+def load_region_stats(stats_file):
+    try:
+        with open(stats_file, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def update_region_stats(stats, region, elapsed, failed, now):
+    entry = stats.get(region)
+    error = 1.0 if failed else 0.0
+    if not entry or now - entry['updated'] > REGION_STATS_MAX_AGE:
+        stats[region] = {'latency': elapsed, 'error_rate': error,
+                         'updated': now}
+        return
+    alpha = REGION_STATS_ALPHA
+    # Failures often return early, only successful sends measure latency
+    if not failed:
+        entry['latency'] = alpha * elapsed + (1 - alpha) * entry['latency']
+    entry['error_rate'] = alpha * error + (1 - alpha) * entry['error_rate']
+    entry['updated'] = now
+
+
+def save_region_stats(stats_file, samples):
+    """
+    Merge send samples ({region: (seconds, failed)}) into the stats file.
+    Locked & re-read, as concurrent notifications update it too
+    """
+    if not samples:
+        return
+    now = time.time()
+    try:
+        with open('%s.lock' % stats_file, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                stats = load_region_stats(stats_file)
+                for region, (elapsed, failed) in samples.items():
+                    update_region_stats(stats, region, elapsed, failed, now)
+                temp_file = "%s.%s.tmp" % (stats_file, os.getpid())
+                with open(temp_file, 'w') as f:
+                    json.dump(stats, f)
+                os.rename(temp_file, stats_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    except (IOError, OSError) as e:
+        logger.warning("AWS_SES_EMAIL: Region stats not saved: %s" % e)
+
+
+def region_weight(entry, now):
+    if not entry or now - entry['updated'] > REGION_STATS_MAX_AGE:
+        return None
+    score = max(entry['latency'], 0.001) * \
+        (1 + ERROR_RATE_PENALTY * entry['error_rate'])
+    return 1.0 / (score * score)
+
+
+def region_names(aws_region):
+    """Region names of the comma separated aws_region, us-east-1 if none"""
     if not aws_region:
         aws_region = 'us-east-1'
     region_list = [i.strip() for i in aws_region.split(',') if i.strip()]
     if not region_list:
         region_list = ['us-east-1']
+    return region_list
+
+
+def select_region(aws_region, blacklist = [], stats=None):
+    """
+    Select a region randomly. With stats, regions are weighted by their
+    latency & error rate; regions without recent stats get the best weight,
+    so they are measured again
+    """
+    region_list = region_names(aws_region)
     for region in blacklist:
         try:
             while True:
@@ -136,50 +337,166 @@ def select_region(aws_region, blacklist = []):
             pass
     if not region_list:
         return None
-    return region_list[random.randint(0, len(region_list) - 1)]
+    if not stats:
+        return region_list[random.randint(0, len(region_list) - 1)]
+    now = time.time()
+    weights = [region_weight(stats.get(region), now) for region in region_list]
+    best_weight = max(weights) or 1.0
+    weights = [w if w is not None else best_weight for w in weights]
+    point = random.uniform(0, sum(weights))
+    for region, weight in zip(region_list, weights):
+        point -= weight
+        if point <= 0:
+            return region
+    return region_list[-1]
+
 
+@instrumentation.timed
+def spool_email(arguments, subject, body):
+    """
+    Write the rendered email to the spool directory. Written under a
+    temporary name & renamed, so the sender never reads a partial file.
+    Credentials are not spooled
+    """
+    spool_dir = arguments['spool_dir']
+    message = {
+        'created': time.time(),
+        'to': arguments.get('to') or '',
+        'from_address': arguments.get('from_address') or '',
+        'reply_to': arguments.get('reply_to') or '',
+        'subject': subject,
+        'body': body,
+    }
+    filename = "%.6f_%s_%s.msg" % (message['created'], os.getpid(),
+                                   random.randint(0, 999999))
+    temp_path = os.path.join(spool_dir, ".%s.tmp" % filename)
+    with open(temp_path, 'w') as f:
+        json.dump(message, f)
+    os.rename(temp_path, os.path.join(spool_dir, filename))
 
-def send_email(arguments, subject, body):
+
+@instrumentation.timed
+def send_email(arguments, subject, body, connections=None):
+    """
+    Send email using SES, failing over to other regions on exceptions.
+    Raises PermanentSendError without failing over if SES rejects the email
+    itself, see PERMANENT_ERRORS. With hedge_after (validated by
+    validate_arguments), the email is also sent using a second region if
+    the first has not finished in time; the first success wins. Without it,
+    regions are tried one after another in this thread. Send latency &
+    errors of every region tried are saved in the region stats file.
+    Connections are reused from the connections dict (region: connection),
+    if passed
+    """
+    with instrumentation.phase('import'):
+        import boto.ses
     aws_region = arguments.get('aws_region')
-    failed_regions = []
-    while True:
-        selected_region = select_region(aws_region, blacklist=failed_regions)
-        if not selected_region:
-            raise Exception("Cannot send email. All regions failed")
-        aws_access_key_id = arguments.get('aws_access_key_id', None)
-        aws_secret_access_key = arguments.get('aws_secret_access_key', None)
-        if (not aws_access_key_id) or (not aws_secret_access_key):
-            raise Exception("AWS credentials not passed in arguments")
-        from_address = arguments.get('from_address', None)
-        if not from_address:
-            raise Exception("Source email address not defined")
-        to_addresses = [add for add in arguments.get('to', '').split(',') if add.strip()]
-        if not to_addresses:
-            raise Exception("No destination specified")
-        reply_addresses = arguments.get('reply_to', None)
-        if not reply_addresses:
-            reply_addresses = None
+    aws_access_key_id = arguments.get('aws_access_key_id', None)
+    aws_secret_access_key = arguments.get('aws_secret_access_key', None)
+    if (not aws_access_key_id) or (not aws_secret_access_key):
+        raise Exception("AWS credentials not passed in arguments")
+    from_address = arguments.get('from_address', None)
+    if not from_address:
+        raise Exception("Source email address not defined")
+    to_addresses = [add for add in arguments.get('to', '').split(',') if add.strip()]
+    if not to_addresses:
+        raise PermanentSendError("No destination specified")
+    reply_addresses = arguments.get('reply_to', None)
+    if not reply_addresses:
+        reply_addresses = None
+    hedge_after = arguments.get('hedge_after', None)
+    if connections is None:
+        connections = {}
+    stats_file = arguments.get('region_stats_file', None) or REGION_STATS_FILE
+    stats = load_region_stats(stats_file)
+    results = Queue.Queue()
+
+    def attempt(region):
+        start_time = time.time()
         try:
-            conn = boto.ses.connect_to_region(
-                selected_region,
-                aws_access_key_id=aws_access_key_id,
-                aws_secret_access_key=aws_secret_access_key,
-            )
+            conn = connections.get(region)
+            if conn is None:
+                conn = boto.ses.connect_to_region(
+                    region,
+                    aws_access_key_id=aws_access_key_id,
+                    aws_secret_access_key=aws_secret_access_key,
+                )
+                connections[region] = conn
             conn.send_email(from_address, subject, body, to_addresses, 
                             reply_addresses=reply_addresses)
+            error = None
         except Exception as e:
+            connections.pop(region, None)
+            error = e
+        results.put((region, time.time() - start_time, error))
+
+    max_in_flight = 2 if hedge_after else 1
+    failed_regions = []
+    in_flight = {}
+    samples = {}
+    try:
+        while True:
+            if len(in_flight) < max_in_flight:
+                selected_region = select_region(
+                    aws_region, blacklist=failed_regions + in_flight.keys(),
+                    stats=stats)
+                if selected_region:
+                    in_flight[selected_region] = time.time()
+                    if hedge_after:
+                        thread = threading.Thread(target=attempt,
+                                                  args=(selected_region,))
+                        thread.daemon = True
+                        thread.start()
+                    else:
+                        attempt(selected_region)
+                elif not in_flight:
+                    raise Exception("Cannot send email. All regions failed")
+            timeout = None
+            # Hedge only if a region is left to hedge with
+            if hedge_after and len(in_flight) < max_in_flight and \
+                    [r for r in region_names(aws_region)
+                     if r not in failed_regions and r not in in_flight]:
+                timeout = hedge_after
+            try:
+                region, elapsed, error = results.get(timeout=timeout)
+            except Queue.Empty:
+                logger.info("AWS_SES_EMAIL: No response in %ss, hedging using"
+                            " another AWS SES region" % hedge_after)
+                continue
+            del in_flight[region]
+            # A rejected email is no fault of the region
+            permanent = getattr(error, 'error_code', None) in PERMANENT_ERRORS
+            samples[region] = (elapsed, error is not None and not permanent)
+            if error is None:
+                break
+            if permanent:
+                raise PermanentSendError("Email rejected using region '%s':"
+                                         " %s" % (region, error))
             logger.warning("AWS_SES_EMAIL: Email failed using region '%s',"
                 " trying another AWS SES region. Exception: %s"
-                % (selected_region, e.message))
-            failed_regions.append(selected_region)
-            continue
-        break
+                % (region, error))
+            failed_regions.append(region)
+    finally:
+        # Regions still in flight were at least this slow
+        now = time.time()
+        for region, start_time in in_flight.items():
+            samples[region] = (now - start_time, False)
+        save_region_stats(stats_file, samples)
 
 
 def run():
     try:
         arguments = parse_options(OPTIONS, DESCRIPTION, USAGE, VERSION)
+        validate_arguments(arguments)
+        if arguments['profile']:
+            instrumentation.start_profile('aws_ses_email',
+                                          arguments['profile_dir'])
         subject, body = generate_subject_and_body(arguments)
+        if arguments.get('spool_dir'):
+            spool_email(arguments, subject, body)
+            logger.info("AWS_SES_EMAIL: Email to '%s' spooled. Subject: %s"
+                        % (arguments.get('to', '-'), subject))
+            return
         send_email(arguments, subject, body)
         logger.info("AWS_SES_EMAIL: Email sent to '%s'. Subject: %s"
                     % (arguments.get('to', '-'), subject))
@@ -188,6 +505,11 @@ def run():
                         % (e.message, arguments))
         print e.message
         sys.exit(1)
+    finally:
+        # No perfdata for notifications, phase timings are logged instead
+        logger.debug("AWS_SES_EMAIL: Phase timings: %s"
+                     % instrumentation.perf_data())
+        instrumentation.stop_profile()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+#
+# Description: Long running sender for emails spooled by aws_ses_email.py
+# (--spool_dir). Sends them using pooled Amazon SES connections within a send
+# rate budget, merging bursts to the same recipient into one digest email.
+# Emails failing again & again, or rejected by SES, are moved to the failed/
+# directory in the spool directory.
+# Author: Rohit Gupta - @rohit01
+#
+
+import optparse
+import fcntl
+import json
+import time
+import tempfile
+import os
+import sys
+import logging
+import aws_ses_email
+
+
+__version__ = 0.1
+VERSION = """Version: %s, Author: Rohit Gupta - @rohit01""" % __version__
+DESCRIPTION = """Sends emails spooled by aws_ses_email.py using Amazon SES"""
+OPTIONS = {
+    # Credentials
+    "aws_region": "Comma separated AWS region names for using SES service." \
+        " Used for loadbalancer(random) and failover. Default: us-east-1",
+    "aws_access_key_id": "AWS access key",
+    "aws_secret_access_key": "AWS secret key",
+    # Spool settings
+    "spool_dir": "Spool directory, as passed to aws_ses_email.py",
+    "max_rate": "Max emails sent per second. Default: 5",
+    "coalesce_window": "Seconds to wait after the first email to a" \
+        " recipient, merging all emails received meanwhile into one digest." \
+        " Default: 10",
+    "max_digest": "Max emails merged into one digest. Default: 50",
+    "poll_interval": "Seconds between spool directory scans. Default: 1",
+    "max_attempts": "Attempts to send an email before it is moved to the" \
+        " failed directory. Default: 5",
+    "retry_interval": "Seconds to wait before sending a failed email again," \
+        " doubled after every attempt. Default: 30",
+}
+DEFAULTS = {
+    "max_rate": 5,
+    "coalesce_window": 10,
+    "max_digest": 50,
+    "poll_interval": 1,
+    "max_attempts": 5,
+    "retry_interval": 30,
+}
+USAGE = "%s --spool_dir=<value> [options]"  % os.path.basename(__file__)
+# Dead letter directory, in the spool directory
+FAILED_DIR = 'failed'
+SPOOL_KEYS = ['created', 'to', 'from_address', 'reply_to', 'subject', 'body']
+
+logger = aws_ses_email.logger
+
+
+def parse_options(options, description=None, usage=None, version=None,
+        defaults=None):
+    parser = optparse.OptionParser(description=description, usage=usage,
+                                   version=version)
+    for keyname, description in options.items():
+        longopt = '--%s' % keyname
+        parser.add_option(longopt, dest=keyname, help=description)
+    option_args, _ = parser.parse_args()
+    arguments = {}
+    for keyname in options.keys():
+        arguments[keyname] = eval("option_args.%s" % keyname)
+    if defaults:
+        for k, v in arguments.items():
+            if (not v) and (k in defaults):
+                arguments[k] = defaults[k]
+    return arguments
+
+
+def validate_arguments(arguments):
+    if not arguments['spool_dir']:
+        print "Mandatory option --spool_dir is missing"
+        sys.exit(1)
+    for key in 'max_rate', 'coalesce_window', 'poll_interval', \
+            'retry_interval':
+        try:
+            arguments[key] = float(arguments[key])
+            if arguments[key] <= 0 and key != 'coalesce_window':
+                raise ValueError()
+        except ValueError:
+            print "Option --%s invalid. Value %s must be a positive number" \
+                % (key, arguments[key])
+            sys.exit(1)
+    for key in 'max_digest', 'max_attempts':
+        try:
+            arguments[key] = int(arguments[key])
+            if arguments[key] < 1:
+                raise ValueError()
+        except ValueError:
+            print "Option --%s invalid. Value %s must be a positive integer" \
+                % (key, arguments[key])
+            sys.exit(1)
+
+
+class RateLimiter(object):
+    """
+    Token bucket allowing bursts of up to one second worth of sends, at
+    least one send for rates below one per second
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self.tokens = self.capacity
+        self.last_time = time.time()
+
+    def acquire(self):
+        while True:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens +
+                              (now - self.last_time) * self.rate)
+            self.last_time = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+def read_spool(spool_dir):
+    """
+    Read spooled emails, oldest first. Invalid spool files are moved to the
+    failed directory.
+    Returns a list of tuples: (file path, email)
+    """
+    spooled = []
+    for filename in sorted(os.listdir(spool_dir)):
+        if not filename.endswith('.msg'):
+            continue
+        path = os.path.join(spool_dir, filename)
+        try:
+            with open(path, 'r') as f:
+                email = json.load(f)
+        except IOError as e:
+            logger.warning("AWS_SES_SPOOL_SENDER: Skipping unreadable spool"
+                           " file %s: %s" % (path, e))
+            continue
+        except ValueError as e:
+            move_to_failed(spool_dir, path, "Invalid spool file: %s" % e)
+            continue
+        if not isinstance(email, dict) or \
+                [k for k in SPOOL_KEYS if k not in email]:
+            move_to_failed(spool_dir, path, "Invalid spool file: fields"
+                           " missing")
+            continue
+        spooled.append((path, email))
+    return spooled
+
+
+def move_to_failed(spool_dir, path, reason):
+    """Move a spool file to the failed directory, never to be sent again"""
+    failed_dir = os.path.join(spool_dir, FAILED_DIR)
+    if not os.path.isdir(failed_dir):
+        os.mkdir(failed_dir)
+    os.rename(path, os.path.join(failed_dir, os.path.basename(path)))
+    logger.critical("AWS_SES_SPOOL_SENDER: Spool file %s moved to %s. %s"
+                    % (path, failed_dir, reason))
+
+
+def record_failure(arguments, path, email, reason):
+    """
+    Count a failed attempt in the spool file & delay its next attempt, or
+    move it to the failed directory after max_attempts
+    """
+    attempts = email.get('attempts', 0) + 1
+    if attempts >= arguments['max_attempts']:
+        move_to_failed(arguments['spool_dir'], path, "Failed %s times: %s"
+                       % (attempts, reason))
+        return
+    email = dict(email, attempts=attempts, retry_after=time.time() +
+                 arguments['retry_interval'] * 2 ** (attempts - 1))
+    # Replaced atomically like spool_email() writes it, read_spool() skips
+    # the temporary file
+    fd, temp_path = tempfile.mkstemp(dir=arguments['spool_dir'], prefix='.',
+                                     suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(email, f)
+    os.rename(temp_path, path)
+
+
+def group_by_recipient(spooled):
+    groups = {}
+    for path, email in spooled:
+        key = (email['to'], email['from_address'], email['reply_to'])
+        groups.setdefault(key, []).append((path, email))
+    return groups
+
+
+def make_digest(emails):
+    """Merge many emails to the same recipient into one subject & body"""
+    if len(emails) == 1:
+        return (emails[0]['subject'], emails[0]['body'])
+    subject = "[%s notifications] %s (+%s more)" % (
+        len(emails), emails[0]['subject'], len(emails) - 1)
+    index = []
+    bodies = []
+    for i, email in enumerate(emails):
+        created = time.strftime('%Y-%m-%d %H:%M:%S',
+                                time.localtime(email['created']))
+        index.append("%s. [%s] %s" % (i + 1, created, email['subject']))
+        bodies.append("%s. %s\n\n%s" % (i + 1, email['subject'],
+                                        email['body']))
+    body = "%s notifications:\n\n%s\n\n%s\n\n%s" % (
+        len(emails), '\n'.join(index), '=' * 70,
+        ('\n\n%s\n\n' % ('-' * 70)).join(bodies))
+    return (subject, body)
+
+
+def send_batch(arguments, key, batch, connections, rate_limiter):
+    """
+    Send a batch of spooled emails to one recipient as one digest. Spool
+    files are removed once sent. Returns False if sending failed & may work
+    later, so other batches of the recipient should wait
+    """
+    subject, body = make_digest([email for _, email in batch])
+    send_arguments = dict(arguments)
+    send_arguments.update(to=key[0], from_address=key[1], reply_to=key[2])
+    rate_limiter.acquire()
+    try:
+        aws_ses_email.send_email(send_arguments, subject, body,
+                                 connections=connections)
+    except aws_ses_email.PermanentSendError as e:
+        logger.critical("AWS_SES_SPOOL_SENDER: Sending %s emails to '%s'"
+                        " failed: %s" % (len(batch), key[0], e))
+        if len(batch) == 1:
+            move_to_failed(arguments['spool_dir'], batch[0][0], str(e))
+        else:
+            # Retried one by one, so only the rejected emails are moved to
+            # the failed directory
+            for path, email in batch:
+                record_failure(arguments, path, email, str(e))
+        return True
+    except Exception as e:
+        logger.critical("AWS_SES_SPOOL_SENDER: Sending %s emails to '%s'"
+                        " failed: %s" % (len(batch), key[0], e))
+        for path, email in batch:
+            record_failure(arguments, path, email, str(e))
+        return False
+    logger.info("AWS_SES_SPOOL_SENDER: Email sent to '%s', %s merged."
+                " Subject: %s" % (key[0], len(batch), subject))
+    for path, _ in batch:
+        os.remove(path)
+    return True
+
+
+def send_ready(arguments, connections, rate_limiter):
+    """
+    Send spooled emails of every recipient whose oldest email has waited
+    for coalesce_window, or who has max_digest emails pending. Emails which
+    failed before are sent on their own once their retry time has passed,
+    never merged with new ones
+    """
+    now = time.time()
+    groups = group_by_recipient(read_spool(arguments['spool_dir']))
+    for key, spooled in groups.items():
+        batches = [[(path, email)] for path, email in spooled
+                   if email.get('attempts') and
+                   email.get('retry_after', 0) <= now]
+        spooled = [(path, email) for path, email in spooled
+                   if not email.get('attempts')]
+        if spooled and (
+                now - spooled[0][1]['created'] >= arguments['coalesce_window']
+                or len(spooled) >= arguments['max_digest']):
+            max_digest = arguments['max_digest']
+            batches.extend([spooled[i:i + max_digest]
+                            for i in range(0, len(spooled), max_digest)])
+        for batch in batches:
+            if not send_batch(arguments, key, batch, connections,
+                              rate_limiter):
+                break
+
+
+def run():
+    arguments = parse_options(OPTIONS, DESCRIPTION, USAGE, VERSION, DEFAULTS)
+    validate_arguments(arguments)
+    # Only one sender per spool directory
+    lock_file = open(os.path.join(arguments['spool_dir'], '.sender.lock'), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        print "Another sender is already running for %s" \
+            % arguments['spool_dir']
+        sys.exit(1)
+    connections = {}
+    rate_limiter = RateLimiter(arguments['max_rate'])
+    while True:
+        try:
+            send_ready(arguments, connections, rate_limiter)
+        except Exception as e:
+            logger.critical("AWS_SES_SPOOL_SENDER: %s" % e)
+        time.sleep(arguments['poll_interval'])
+
+
+if __name__ == '__main__':
+    logger.debug("AWS_SES_SPOOL_SENDER: Sender started")
+    run()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+#
+# Benchmark suite for the python plugins. Runs docker_container_status.py,
+# url_test.py, elb_health.py, aws_ses_email.py, kafka_lag.py &
+# freeswitch_api.py in fresh interpreters against local stand-ins (see
+# standins.py), sweeping the number of containers, URLs, ELB instances,
+# concurrent notifications, consumer groups & concurrent freeswitch checks.
+# Reports wall time, plugin import
+# time & peak RSS per case, saved as JSON to compare runs for regressions:
+#   plugin_suite.py --output=before.json
+#   plugin_suite.py --output=after.json --compare=before.json
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import optparse
+import platform
+import subprocess
+import standins
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+PLUGINS = ['docker_container_status', 'url_test', 'elb_health',
+           'aws_ses_email', 'kafka_lag', 'freeswitch_api']
+# Run in the plugin process: time the plugin module import, install the
+# stand-ins & run the plugin as a script
+CHILD = """
+import os, sys, imp, json, time, runpy
+config = json.loads(sys.argv[1])
+sys.argv = sys.argv[2:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+start_time = time.time()
+imp.load_source('benchmark_import', sys.argv[0])
+import_time = time.time() - start_time
+sys.path.insert(0, config['benchmark_dir'])
+import standins
+standins.install_stubs(config)
+with open(config['report_file'], 'w') as f:
+    json.dump({'import_time': import_time}, f)
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+
+def plugin_command(work_dir, plugin, config, argv, index=0):
+    config = dict(config, benchmark_dir=BENCHMARK_DIR,
+                  report_file=os.path.join(work_dir, 'report_%s.json' % index))
+    path = os.path.join(REPO_DIR, "%s.py" % plugin)
+    return [sys.executable, '-c', CHILD, json.dumps(config), path] + argv
+
+
+def run_processes(commands):
+    """
+    Start all commands together & wait for all of them.
+    Returns a tuple: (wall time, peak RSS in KB, exit statuses, outputs)
+    """
+    start_time = time.time()
+    processes = []
+    for command in commands:
+        output = tempfile.TemporaryFile()
+        process = subprocess.Popen(command, stdout=output,
+                                   stderr=subprocess.STDOUT)
+        processes.append((process, output))
+    peak_rss = 0
+    statuses = []
+    outputs = []
+    for process, output in processes:
+        # wait4 gives the resource usage of this process alone
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.WEXITSTATUS(status)
+        peak_rss = max(peak_rss, rusage.ru_maxrss)
+        statuses.append(process.returncode)
+        output.seek(0)
+        outputs.append(output.read())
+        output.close()
+    return (time.time() - start_time, peak_rss, statuses, outputs)
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'mean': sum(timings) / len(timings),
+        'median': timings[len(timings) / 2],
+        'min': timings[0],
+    }
+
+
+def measure(work_dir, plugin, params, commands, runs):
+    wall_times = []
+    import_times = []
+    peak_rss = 0
+    for i in xrange(runs):
+        wall_time, rss, statuses, outputs = run_processes(commands)
+        wall_times.append(wall_time)
+        peak_rss = max(peak_rss, rss)
+        for index in xrange(len(commands)):
+            report_file = os.path.join(work_dir, 'report_%s.json' % index)
+            try:
+                with open(report_file, 'r') as f:
+                    import_times.append(json.load(f)['import_time'])
+                os.remove(report_file)
+            except (IOError, ValueError, KeyError):
+                pass
+    if any('Traceback' in output for output in outputs):
+        sys.stderr.write("%s %s crashed:\n%s\n" % (plugin, params,
+                                                   outputs[0]))
+    return {
+        'plugin': plugin,
+        'case': ' '.join("%s=%s" % (k, params[k]) for k in sorted(params)),
+        'params': params,
+        'wall_time': summarize(wall_times),
+        'import_time': summarize(import_times) if import_times else None,
+        'peak_rss_kb': peak_rss,
+        'exit_status': max(statuses),
+        'output': outputs[0].split('\n')[0][:200],
+    }
+
+
+def bench_docker_container_status(options, work_dir):
+    socket_path = os.path.join(work_dir, 'docker.sock')
+    docker_api = standins.FakeDockerAPI(socket_path, 0, options.latency)
+    docker_api.start()
+    config = {'docker_socket': socket_path}
+    results = []
+    try:
+        for count in options.containers:
+            docker_api.set_containers(count)
+            for mode in 'count', 'stats':
+                command = plugin_command(
+                    work_dir, 'docker_container_status', config,
+                    ['--image_name', standins.BENCH_IMAGE, '--mode', mode])
+                results.append(measure(work_dir, 'docker_container_status',
+                                       {'containers': count, 'mode': mode},
+                                       [command], options.runs))
+    finally:
+        docker_api.stop()
+    return results
+
+
+def bench_url_test(options, work_dir):
+    http_server = standins.LatencyHTTPServer(options.latency)
+    http_server.start()
+    results = []
+    try:
+        for count in options.urls:
+            urls = ','.join(http_server.url('/%s' % i) for i in xrange(count))
+            command = plugin_command(work_dir, 'url_test', {},
+                                     ['-H', urls, '-w', str(options.workers)])
+            results.append(measure(work_dir, 'url_test', {'urls': count},
+                                   [command], options.runs))
+    finally:
+        http_server.stop()
+    return results
+
+
+def bench_elb_health(options, work_dir):
+    results = []
+    for count in options.instances:
+        config = {'elb_instances': count, 'latency': options.latency}
+        command = plugin_command(
+            work_dir, 'elb_health', config,
+            ['--aws_access_key', 'bench', '--aws_secret_access', 'bench',
+             '--loadbalancer', standins.BENCH_LOADBALANCER])
+        results.append(measure(work_dir, 'elb_health', {'instances': count},
+                               [command], options.runs))
+    return results
+
+
+def bench_aws_ses_email(options, work_dir):
+    config = {'ses': True, 'latency': options.latency}
+    argv = ['--aws_access_key_id', 'bench', '--aws_secret_access_key', 'bench',
+            '--region_stats_file', os.path.join(work_dir, 'region_stats.json'),
+            '--notification_for', 'service', '--to', 'ops@example.com',
+            '--from_address', 'shinken@example.com', '--host_name', 'web-1',
+            '--service_name', 'disk', '--state', 'CRITICAL',
+            '--message', 'Disk usage 91%']
+    results = []
+    for count in options.notifications:
+        commands = [plugin_command(work_dir, 'aws_ses_email', config, argv, i)
+                    for i in xrange(count)]
+        results.append(measure(work_dir, 'aws_ses_email',
+                               {'notifications': count}, commands,
+                               options.runs))
+    return results
+
+
+def bench_kafka_lag(options, work_dir):
+    results = []
+    for count in options.groups:
+        broker = standins.FakeKafkaBroker(count, options.topics,
+                                          options.partitions,
+                                          latency=options.latency)
+        broker.start()
+        try:
+            command = plugin_command(
+                work_dir, 'kafka_lag', {},
+                ['-b', broker.address(), '-g',
+                 ','.join(broker.group_names(count))])
+            results.append(measure(work_dir, 'kafka_lag', {
+                'groups': count, 'topics': options.topics,
+                'partitions': options.partitions}, [command], options.runs))
+        finally:
+            broker.stop()
+    return results
+
+
+def bench_freeswitch_api(options, work_dir):
+    """
+    Concurrent checks, each opening its own event socket session (direct)
+    or served from a fresh freeswitch_collector.py snapshot (snapshot)
+    """
+    results = []
+    server = standins.FakeESLServer(latency=options.latency)
+    server.start()
+    snapshot_file = os.path.join(work_dir, 'freeswitch_snapshot.json')
+    try:
+        for mode in 'direct', 'snapshot':
+            if mode == 'snapshot':
+                with open(snapshot_file, 'w') as f:
+                    json.dump({'updated': int(time.time()),
+                               'outputs': standins.FREESWITCH_OUTPUTS}, f)
+            for count in options.checks:
+                commands = [plugin_command(
+                    work_dir, 'freeswitch_api', {},
+                    ['-x', 'show channels count', '-P', str(server.port),
+                     '-s', snapshot_file, '-m', '3600'], index) for index in xrange(count)]
+                results.append(measure(work_dir, 'freeswitch_api',
+                                       {'checks': count, 'mode': mode},
+                                       commands, options.runs))
+    finally:
+        server.stop()
+    return results
+
+
+def print_results(results, previous=None):
+    previous_results = {}
+    for result in (previous or {}).get('results', []):
+        previous_results[(result['plugin'], result['case'])] = result
+    print "%-24s %-26s %10s %10s %9s %4s %s" % (
+        'plugin', 'case', 'wall ms', 'import ms', 'rss MB', 'exit',
+        'vs previous' if previous else '')
+    for result in results:
+        import_time = ''
+        if result['import_time']:
+            import_time = "%.1f" % (result['import_time']['median'] * 1000)
+        change = ''
+        old = previous_results.get((result['plugin'], result['case']))
+        if old:
+            change = "wall %+.1f%% rss %+.1f%%" % (
+                percent_change(old['wall_time']['median'],
+                               result['wall_time']['median']),
+                percent_change(old['peak_rss_kb'], result['peak_rss_kb']))
+        print "%-24s %-26s %10.1f %10s %9.1f %4s %s" % (
+            result['plugin'], result['case'],
+            result['wall_time']['median'] * 1000, import_time,
+            result['peak_rss_kb'] / 1024.0, result['exit_status'], change)
+
+
+def percent_change(old, new):
+    if not old:
+        return 0.0
+    return (new - old) * 100.0 / old
+
+
+def int_list(option, opt_str, value, parser):
+    try:
+        values = [int(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise optparse.OptionValueError("%s: comma separated integers"
+                                        " expected" % opt_str)
+    setattr(parser.values, option.dest, values)
+
+
+def parse_options():
+    parser = optparse.OptionParser(description="Benchmark suite for the"
+                                   " python plugins, using local stand-ins")
+    parser.add_option('--runs', dest='runs', type='int', default=5,
+                      help="Runs per case. Default: 5")
+    parser.add_option('--latency', dest='latency', type='float', default=5,
+                      help="Latency of every stand-in API call & HTTP"
+                      " request in ms. Default: 5")
+    parser.add_option('--plugins', dest='plugins', default=','.join(PLUGINS),
+                      help="Comma separated plugins to benchmark. Default:"
+                      " all")
+    for name, default, help_text in [
+            ('containers', '10,100,1000', "Running container counts"),
+            ('urls', '1,10,50', "URL counts"),
+            ('instances', '10,100,1000', "ELB instance counts"),
+            ('notifications', '1,10,50', "Concurrent notification counts"),
+            ('groups', '1,10,50', "Kafka consumer group counts"),
+            ('checks', '1,10,50', "Concurrent freeswitch check counts")]:
+        parser.add_option('--%s' % name, dest=name, type='string',
+                          action='callback', callback=int_list,
+                          help="%s to sweep. Default: %s" % (help_text,
+                                                             default))
+        parser.set_default(name, [int(v) for v in default.split(',')])
+    parser.add_option('--workers', dest='workers', type='int', default=10,
+                      help="url_test.py workers. Default: 10")
+    parser.add_option('--topics', dest='topics', type='int', default=2,
+                      help="Kafka topics consumed by every group. Default: 2")
+    parser.add_option('--partitions', dest='partitions', type='int',
+                      default=10, help="Partitions per kafka topic."
+                      " Default: 10")
+    parser.add_option('--output', dest='output',
+                      default="plugin_suite_%s.json"
+                      % time.strftime('%Y%m%d_%H%M%S'),
+                      help="JSON results file. Default:"
+                      " plugin_suite_<timestamp>.json")
+    parser.add_option('--compare', dest='compare',
+                      help="JSON results file of a previous run to compare"
+                      " with")
+    options, _ = parser.parse_args()
+    options.latency = options.latency / 1000.0
+    options.plugins = [p.strip() for p in options.plugins.split(',')
+                       if p.strip()]
+    for plugin in options.plugins:
+        if plugin not in PLUGINS:
+            parser.error("Unknown plugin: %s" % plugin)
+    return options
+
+
+def run():
+    options = parse_options()
+    previous = None
+    if options.compare:
+        with open(options.compare, 'r') as f:
+            previous = json.load(f)
+    work_dir = tempfile.mkdtemp(prefix='plugin_suite_')
+    results = []
+    try:
+        for plugin in options.plugins:
+            results.extend(globals()["bench_%s" % plugin](options, work_dir))
+    finally:
+        shutil.rmtree(work_dir, True)
+    data = {
+        'created': int(time.time()),
+        'python': platform.python_version(),
+        'runs': options.runs,
+        'latency': options.latency,
+        'results': results,
+    }
+    with open(options.output, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    print_results(results, previous)
+    print ""
+    print "Results saved in %s" % options.output
+
+
+if __name__ == '__main__':
+    run()
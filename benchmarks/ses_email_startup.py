@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# Startup time benchmark for aws_ses_email.py. Spools notifications (no AWS
+# calls) in fresh interpreters & compares wall time of: a bare interpreter,
+# the boto.ses import every notification used to pay at module load, a
+# notification compiling its templates & one using the on-disk compiled
+# template cache.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NOTIFICATION = """
+import sys
+sys.path.insert(0, %(repo_dir)r)
+import aws_ses_email
+aws_ses_email.TEMPLATE_CACHE_DIR = %(cache_dir)r
+sys.argv = ['aws_ses_email.py', '--notification_for', 'service',
+            '--to', 'ops@example.com', '--from_address', 'shinken@example.com',
+            '--message', 'Disk usage 91%%', '--service_name', 'disk',
+            '--host_name', 'web-1', '--state', 'CRITICAL',
+            '--spool_dir', %(spool_dir)r]
+aws_ses_email.run()
+"""
+
+
+def timed_run(code):
+    start_time = time.time()
+    subprocess.check_call([sys.executable, '-c', code])
+    return time.time() - start_time
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'mean': sum(timings) / len(timings),
+        'median': timings[len(timings) / 2],
+        'min': timings[0],
+    }
+
+
+def run():
+    parser = optparse.OptionParser(description="aws_ses_email.py startup"
+                                   " time benchmark")
+    parser.add_option('--runs', dest='runs', type='int', default=20,
+                      help="Runs per scenario. Default: 20")
+    options, _ = parser.parse_args()
+    work_dir = tempfile.mkdtemp(prefix='ses_email_startup_')
+    spool_dir = os.path.join(work_dir, 'spool')
+    cache_dir = os.path.join(work_dir, 'cache')
+    os.makedirs(spool_dir)
+    notification = NOTIFICATION % {'repo_dir': REPO_DIR,
+                                   'cache_dir': cache_dir,
+                                   'spool_dir': spool_dir}
+    results = {}
+    try:
+        scenarios = [
+            ('interpreter', 'pass', None),
+            ('boto_import', 'import boto.ses', None),
+            ('notification_cold_cache', notification, cache_dir),
+            ('notification_warm_cache', notification, None),
+        ]
+        for name, code, clear_dir in scenarios:
+            timings = []
+            for i in xrange(options.runs):
+                if clear_dir:
+                    shutil.rmtree(clear_dir, True)
+                timings.append(timed_run(code))
+            results[name] = summarize(timings)
+    finally:
+        shutil.rmtree(work_dir, True)
+    print "%-26s %10s %10s %10s" % ('scenario', 'mean ms', 'median ms',
+                                    'min ms')
+    for name, _, _ in scenarios:
+        r = results[name]
+        print "%-26s %10.1f %10.1f %10.1f" % (name, r['mean'] * 1000,
+                                              r['median'] * 1000,
+                                              r['min'] * 1000)
+    boto_import = results['boto_import']['median'] - \
+        results['interpreter']['median']
+    compile_time = results['notification_cold_cache']['median'] - \
+        results['notification_warm_cache']['median']
+    print ""
+    print "Saved per spooled notification (medians): %.1f ms boto.ses import" \
+        " + %.1f ms template compilation = %.1f ms" % (
+            boto_import * 1000, compile_time * 1000,
+            (boto_import + compile_time) * 1000)
+
+
+if __name__ == '__main__':
+    run()
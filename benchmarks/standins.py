@@ -0,0 +1,609 @@
+#!/usr/bin/env python
+#
+# Local stand-ins for the services used by the python plugins, for
+# benchmarking without docker, network or AWS access:
+#  - FakeDockerAPI: docker remote API subset served on a unix socket, with
+#    an event stream for docker_container_watcher.py
+#  - LatencyHTTPServer: HTTP server answering after a configurable latency
+#  - FakeKafkaBroker: single kafka broker answering the requests made by
+#    kafka_lag.py, with consumer groups lagging behind
+#  - FakeESLServer: FreeSWITCH event socket answering api commands with canned
+#    outputs, for freeswitch_api.py & freeswitch_collector.py
+#  - StubDNSServer: UDP nameserver answering A queries of dns_change.py from
+#    a dict of records, rotating addresses like round robin DNS
+#  - install_stubs(): replaces boto ELB/SES connections with in-process fakes
+#    & points docker.Client at the fake docker API, in the plugin process
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import re
+import json
+import socket
+import time
+import struct
+import threading
+import SocketServer
+import BaseHTTPServer
+
+
+BENCH_IMAGE = 'bench/app'
+BENCH_TAG = "%s:latest" % BENCH_IMAGE
+BENCH_LOADBALANCER = 'bench-elb'
+BENCH_GROUP = 'bench-group'
+BENCH_TOPIC = 'bench-topic'
+# Every Nth instance is reported OutOfService
+OUT_OF_SERVICE_EVERY = 20
+
+
+class QuietHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type='application/json'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def iso_time(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z', time.gmtime(epoch))
+
+
+class DockerAPIHandler(QuietHandler):
+    """
+    Answers the docker API calls made by docker_container_status.py &
+    docker_container_watcher.py. /events streams the queued events, one
+    chunk each, & closes
+    """
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        # Strip the API version prefix (/v1.22/...) & query string
+        path = re.sub(r'^/v[0-9.]+', '', self.path.split('?')[0])
+        containers = self.server.containers
+        if path == '/_ping':
+            return self.send_body('OK', 'text/plain')
+        if path == '/version':
+            return self.send_body(json.dumps({'ApiVersion': '1.22',
+                                              'Version': '1.10.3'}))
+        if path == '/images/json':
+            return self.send_body(json.dumps([{
+                'Id': 'sha256:%064x' % 1,
+                'RepoTags': [BENCH_TAG],
+                'Created': containers[0]['Created'] if containers else 0,
+            }]))
+        if path == '/containers/json':
+            return self.send_body(json.dumps(containers))
+        if path == '/events':
+            return self.send_events()
+        match = re.match(r'^/containers/([0-9a-f]+)/(stats|json)$', path)
+        if match and match.group(1) in self.server.container_index:
+            index = self.server.container_index[match.group(1)]
+            if match.group(2) == 'stats':
+                return self.send_body(json.dumps(container_stats(index)))
+            container = containers[index]
+            return self.send_body(json.dumps({
+                'Id': match.group(1),
+                'Created': iso_time(container['Created']),
+                'Config': {'Image': container['Image']},
+                'RestartCount': index % 3,
+                'State': {'Running': True,
+                          'StartedAt': iso_time(container['Created'] + 1)},
+            }))
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event in self.server.events:
+            data = json.dumps(event)
+            self.wfile.write("%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.write("0\r\n\r\n")
+        self.close_connection = 1
+
+
+def container_stats(index):
+    """Stats sample of a container, with cpu usage spread over 0-99%"""
+    system_delta = 10 ** 9
+    return {
+        'cpu_stats': {
+            'cpu_usage': {'total_usage': 2 * 10 ** 9 + (index % 100) *
+                          system_delta / 200, 'percpu_usage': [0, 0]},
+            'system_cpu_usage': 10 ** 12 + system_delta,
+            'online_cpus': 2,
+        },
+        'precpu_stats': {
+            'cpu_usage': {'total_usage': 2 * 10 ** 9},
+            'system_cpu_usage': 10 ** 12,
+        },
+        'memory_stats': {
+            'usage': (64 + index % 64) * 2 ** 20,
+            'limit': 512 * 2 ** 20,
+            'stats': {'cache': 8 * 2 ** 20},
+        },
+    }
+
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeDockerAPI(object):
+    """Docker API serving a number of running containers of BENCH_TAG"""
+    def __init__(self, socket_path, containers, latency=0):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.socket_path = socket_path
+        self.server = UnixHTTPServer(socket_path, DockerAPIHandler)
+        self.server.latency = latency
+        self.server.events = []
+        self.set_containers(containers)
+
+    def set_containers(self, count):
+        now = int(time.time())
+        containers = []
+        for i in xrange(count):
+            containers.append({
+                'Id': '%064x' % (i + 1),
+                'Image': BENCH_TAG,
+                'Names': ['/bench_%s' % i],
+                'Created': now - 3600 - i,
+                'State': 'running',
+                'Status': 'Up 1 hour',
+            })
+        self.server.containers = containers
+        self.server.container_index = dict(
+            (c['Id'], i) for i, c in enumerate(containers))
+
+    def add_event(self, status, index):
+        """Queue a container event of the container at index"""
+        container_id = '%064x' % (index + 1)
+        self.server.events.append({
+            'status': status, 'id': container_id, 'from': BENCH_TAG,
+            'Type': 'container', 'Action': status,
+            'Actor': {'ID': container_id}, 'time': int(time.time()),
+        })
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.unlink(self.socket_path)
+
+
+class LatencyHandler(QuietHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.send_body(self.server.body, 'text/html')
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class LatencyHTTPServer(object):
+    """HTTP server on 127.0.0.1 answering every GET after latency seconds"""
+    def __init__(self, latency=0, body_size=1024):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), LatencyHandler)
+        self.server.latency = latency
+        self.server.body = ('<html>bench ok</html>\n' +
+                            'x' * body_size)[:max(body_size, 22)]
+        self.port = self.server.server_address[1]
+
+    def url(self, path='/'):
+        return "http://127.0.0.1:%s%s" % (self.port, path)
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def kafka_string(value):
+    if value is None:
+        return struct.pack('>h', -1)
+    return struct.pack('>h', len(value)) + value
+
+
+def kafka_array(items, encode_item):
+    return struct.pack('>i', len(items)) + ''.join(encode_item(item)
+                                                   for item in items)
+
+
+class KafkaRequest(object):
+    """Decodes the request body primitives used by kafka_lag.py"""
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def string(self):
+        size = self.unpack('>h')[0]
+        value = self.data[self.offset:self.offset + max(size, 0)]
+        self.offset += max(size, 0)
+        return value if size >= 0 else None
+
+    def array(self, read_item):
+        size = self.unpack('>i')[0]
+        if size < 0:
+            return None
+        return [read_item() for i in xrange(size)]
+
+
+class KafkaHandler(SocketServer.BaseRequestHandler):
+    """
+    Answers Metadata v0, GroupCoordinator v0, OffsetFetch v1/v2 &
+    ListOffsets v0 requests, as node 0 leading all partitions
+    """
+    def handle(self):
+        while True:
+            size = self.receive(4)
+            if not size:
+                return
+            request = KafkaRequest(self.receive(struct.unpack('>i', size)[0]))
+            api_key, api_version, correlation_id = request.unpack('>hhi')
+            request.string()
+            time.sleep(self.server.latency)
+            handler = getattr(self, "api_%s" % api_key)
+            body = struct.pack('>i', correlation_id) + handler(request,
+                                                               api_version)
+            self.request.sendall(struct.pack('>i', len(body)) + body)
+
+    def receive(self, size):
+        data = ''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return ''
+            data += chunk
+        return data
+
+    def broker(self):
+        host, port = self.server.server_address
+        return struct.pack('>i', 0) + kafka_string(host) + \
+            struct.pack('>i', port)
+
+    def api_3(self, request, api_version):
+        """Metadata"""
+        topics = request.array(request.string) or sorted(self.server.topics)
+
+        def topic_metadata(topic):
+            if topic not in self.server.topics:
+                return struct.pack('>h', 3) + kafka_string(topic) + \
+                    kafka_array([], None)
+            return struct.pack('>h', 0) + kafka_string(topic) + kafka_array(
+                range(self.server.topics[topic]), lambda p: struct.pack(
+                    '>hiiiiii', 0, p, 0, 1, 0, 1, 0))
+        return kafka_array([None], lambda _: self.broker()) + \
+            kafka_array(topics, topic_metadata)
+
+    def api_10(self, request, api_version):
+        """GroupCoordinator"""
+        return struct.pack('>h', 0) + self.broker()
+
+    def api_9(self, request, api_version):
+        """OffsetFetch"""
+        group = request.string()
+        committed = self.server.groups.get(group, {})
+        topics = request.array(lambda: (request.string(), request.array(
+            lambda: request.unpack('>i')[0])))
+        if topics is None:
+            topics = [(topic, range(self.server.topics[topic]))
+                      for topic in sorted(set(t for t, p in committed))]
+
+        def partition_offset(topic):
+            return lambda p: struct.pack('>iq', p, committed.get(
+                (topic, p), -1)) + kafka_string('') + struct.pack('>h', 0)
+        body = kafka_array(topics, lambda (topic, partitions): kafka_string(
+            topic) + kafka_array(partitions, partition_offset(topic)))
+        if api_version >= 2:
+            body += struct.pack('>h', 0)
+        return body
+
+    def api_2(self, request, api_version):
+        """ListOffsets"""
+        request.unpack('>i')
+        topics = request.array(lambda: (request.string(), request.array(
+            lambda: request.unpack('>iqi')[0])))
+
+        def end_offset(topic):
+            return lambda p: struct.pack('>ih', p, 0) + kafka_array(
+                [self.server.end_offsets[(topic, p)]],
+                lambda o: struct.pack('>q', o))
+        return kafka_array(topics, lambda (topic, partitions): kafka_string(
+            topic) + kafka_array(partitions, end_offset(topic)))
+
+
+class ThreadingTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeKafkaBroker(object):
+    """
+    Kafka broker on 127.0.0.1 with topics of partitions, consumed by groups
+    <BENCH_GROUP>_<n>. Every group lags behind by lag messages per partition
+    """
+    def __init__(self, groups, topics=1, partitions=10, lag=100, latency=0):
+        self.server = ThreadingTCPServer(('127.0.0.1', 0), KafkaHandler)
+        self.server.latency = latency
+        self.server.topics = dict(("%s_%s" % (BENCH_TOPIC, t), partitions)
+                                  for t in xrange(topics))
+        self.server.end_offsets = dict(
+            ((topic, p), 10 ** 6 + p) for topic in self.server.topics
+            for p in xrange(partitions))
+        self.server.groups = dict(
+            (name, dict((tp, offset - lag) for tp, offset in
+                        self.server.end_offsets.items()))
+            for name in self.group_names(groups))
+        self.port = self.server.server_address[1]
+
+    @staticmethod
+    def group_names(groups):
+        return ["%s_%s" % (BENCH_GROUP, g) for g in xrange(groups)]
+
+    def address(self):
+        return "127.0.0.1:%s" % self.port
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Canned outputs of the api commands used by the freeswitch checks
+FREESWITCH_OUTPUTS = {
+    'status': "UP 0 years, 2 days, 3 hours, 4 minutes, 5 seconds, 6" \
+        " milliseconds, 7 microseconds\nFreeSWITCH (Version 1.6.20) is ready" \
+        "\n12 session(s) since startup\n2 session(s) - peak 8, last 5min" \
+        " 3\n0 session(s) per Sec out of max 30, peak 2, last 5min 1\n1000" \
+        " session(s) max\nmin idle cpu 0.00/98.67\nCurrent Stack Size/Max" \
+        " 240K/8192K",
+    'show channels count': "\n2 total.\n",
+    'show calls count': "\n1 total.\n",
+    'show channels': "uuid,direction,created,created_epoch,name\n" \
+        "a1,inbound,2016-01-01 10:00:00,1451642400,sofia/internal/1000\n" \
+        "b2,outbound,2016-01-01 10:00:01,1451642401,sofia/internal/1001\n" \
+        "\n2 total.\n",
+}
+
+
+class ESLHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write("Content-Type: auth/request\n\n")
+        while True:
+            lines = []
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                if line == '\n':
+                    break
+                lines.append(line.strip())
+            if not lines:
+                continue
+            command = lines[0]
+            if command == 'exit':
+                self.wfile.write("Content-Type: command/reply\nReply-Text:"
+                                 " +OK bye\n\n")
+                return
+            time.sleep(self.server.latency)
+            if command.startswith('auth '):
+                reply = '+OK accepted'
+                if command[5:] != self.server.password:
+                    reply = '-ERR invalid'
+                self.wfile.write("Content-Type: command/reply\nReply-Text:"
+                                 " %s\n\n" % reply)
+            elif command.startswith('api '):
+                body = self.server.outputs.get(
+                    command[4:], "-ERR %s Command not found!\n" % command[4:])
+                self.wfile.write("Content-Type: api/response\nContent-Length:"
+                                 " %s\n\n%s" % (len(body), body))
+            else:
+                self.wfile.write("Content-Type: command/reply\nReply-Text:"
+                                 " -ERR command not found\n\n")
+
+
+class FakeESLServer(object):
+    """
+    FreeSWITCH event socket on 127.0.0.1 answering api commands from
+    outputs, FREESWITCH_OUTPUTS by default, after latency seconds each
+    """
+    def __init__(self, outputs=None, password='ClueCon', latency=0):
+        self.server = ThreadingTCPServer(('127.0.0.1', 0), ESLHandler)
+        self.server.outputs = outputs or FREESWITCH_OUTPUTS
+        self.server.password = password
+        self.server.latency = latency
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# TTL & minimum of the SOA record of NXDOMAIN answers
+DNS_SOA_TTL = 300
+DNS_SOA_MINIMUM = 30
+
+
+def dns_name(name):
+    return ''.join(chr(len(label)) + label
+                   for label in name.split('.') if label) + '\0'
+
+
+def dns_response(query, addresses, ttl):
+    """
+    Response to an A query, with addresses compressed to the question name,
+    or NXDOMAIN with a SOA record if addresses is None
+    """
+    query_id = struct.unpack('!H', query[:2])[0]
+    question = query[12:]
+    if addresses is None:
+        soa = dns_name('ns.local') + dns_name('admin.local') + \
+            struct.pack('!IIIII', 1, 3600, 600, 86400, DNS_SOA_MINIMUM)
+        return struct.pack('!HHHHHH', query_id, 0x8183, 1, 0, 1, 0) + \
+            question + dns_name('local') + struct.pack(
+                '!HHIH', 6, 1, DNS_SOA_TTL, len(soa)) + soa
+    answers = ''.join('\xc0\x0c' + struct.pack('!HHIH', 1, 1, ttl, 4) +
+                      socket.inet_aton(address) for address in addresses)
+    return struct.pack('!HHHHHH', query_id, 0x8180, 1, len(addresses), 0,
+                       0) + question + answers
+
+
+class DNSHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        query, sock = self.request
+        labels = []
+        offset = 12
+        while ord(query[offset]):
+            length = ord(query[offset])
+            labels.append(query[offset + 1:offset + 1 + length])
+            offset += length + 1
+        name = '.'.join(labels).lower()
+        with self.server.lock:
+            self.server.queries.append(name)
+            if self.server.drop.get(name, 0) > 0:
+                self.server.drop[name] -= 1
+                return
+            record = self.server.records.get(name)
+            if record is not None:
+                addresses, ttl = record
+                # Round robin, every answer starts with the next address
+                self.server.records[name] = (addresses[1:] + addresses[:1],
+                                             ttl)
+        if record is None:
+            response = dns_response(query, None, None)
+        else:
+            response = dns_response(query, addresses, ttl)
+        sock.sendto(response, self.client_address)
+
+
+class ThreadingUDPServer(SocketServer.ThreadingMixIn, SocketServer.UDPServer):
+    daemon_threads = True
+
+
+class StubDNSServer(object):
+    """
+    Nameserver on 127.0.0.1 answering A queries from records, a dict of name
+    to (addresses, TTL), & NXDOMAIN for other names. The first drop[name]
+    queries of a name are not answered. Queried names are kept in queries
+    """
+    def __init__(self, records, drop=None):
+        self.server = ThreadingUDPServer(('127.0.0.1', 0), DNSHandler)
+        self.server.records = dict(records)
+        self.server.drop = dict(drop or {})
+        self.server.queries = []
+        self.server.lock = threading.Lock()
+        self.port = self.server.server_address[1]
+
+    def queries(self):
+        with self.server.lock:
+            return list(self.server.queries)
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FakeELBConnection(object):
+    """
+    boto ELB connection serving one load balancer with a number of instances.
+    Every call sleeps latency seconds, like an AWS API round trip
+    """
+    def __init__(self, instances, latency=0):
+        self.instances = instances
+        self.latency = latency
+
+    def get_all_load_balancers(self, load_balancer_names=None, marker=None):
+        from boto.resultset import ResultSet
+        from boto.ec2.elb.loadbalancer import LoadBalancer
+        time.sleep(self.latency)
+        result = ResultSet()
+        for name in load_balancer_names or [BENCH_LOADBALANCER]:
+            result.append(LoadBalancer(self, name))
+        return result
+
+    def describe_instance_health(self, load_balancer_name, instances=None):
+        from boto.ec2.elb.instancestate import InstanceState
+        time.sleep(self.latency)
+        health_list = []
+        for i in xrange(self.instances):
+            health = InstanceState()
+            health.instance_id = 'i-%08x' % (i + 1)
+            if i % OUT_OF_SERVICE_EVERY == OUT_OF_SERVICE_EVERY - 1:
+                health.state = 'OutOfService'
+            else:
+                health.state = 'InService'
+            health_list.append(health)
+        return health_list
+
+
+class FakeSESConnection(object):
+    def __init__(self, latency=0):
+        self.latency = latency
+
+    def send_email(self, source, subject, body, to_addresses, **kwargs):
+        time.sleep(self.latency)
+        return {'SendEmailResponse': {'SendEmailResult': {
+            'MessageId': '%x' % int(time.time() * 10 ** 6)}}}
+
+
+def install_stubs(config):
+    """
+    Patch service clients in the plugin process, using config keys:
+    docker_socket, elb_instances, ses and latency (seconds)
+    """
+    latency = config.get('latency', 0)
+    if config.get('docker_socket'):
+        import docker
+        docker_client = docker.Client
+        base_url = "unix://%s" % config['docker_socket']
+
+        def Client(*args, **kwargs):
+            if not args:
+                kwargs.setdefault('base_url', base_url)
+            return docker_client(*args, **kwargs)
+        docker.Client = Client
+    if config.get('elb_instances') is not None:
+        import boto.ec2.elb
+        boto.ec2.elb.connect_to_region = lambda *args, **kwargs: \
+            FakeELBConnection(config['elb_instances'], latency)
+    if config.get('ses'):
+        import boto.ses
+        boto.ses.connect_to_region = lambda *args, **kwargs: \
+            FakeSESConnection(latency)
@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+#
+# NRPE plugin to check status & token health of cassandra using nodetool.
+# The output of nodetool ring is streamed & aggregated per node in one pass,
+# keeping memory constant in the number of vnodes, along with the token
+# ownership skew per datacenter. With --cache_ttl, one snapshot of nodetool
+# version, info & ring (run in parallel) serves status & token checks.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import time
+import fcntl
+import subprocess
+from optparse import OptionParser
+
+
+__version__ = 1.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+OPTIONS = {
+    't': "checktype;Type of check to perform. Valid values: status & token",
+    'w': "warning;token: warning is percent of tokens up. Default: 80",
+    'c': "critical;token: critical is percent of tokens up. Default: 50",
+    'n': "nodetool;nodetool command. Default: nodetool",
+    'T': "cache_ttl;Seconds for which a snapshot of nodetool version, info" \
+         " & ring is shared by status & token checks. Default: 0 (disabled)",
+    'C': "cache_file;Cache file. Default: /var/tmp/cassandra_ring_cache.json",
+}
+DEFAULTS = {
+    'warning': '80',
+    'critical': '50',
+    'nodetool': 'nodetool',
+    'cache_ttl': '0',
+    'cache_file': '/var/tmp/cassandra_ring_cache.json',
+}
+CHECK_TYPES = ['status', 'token']
+# nodetool commands needed per check type
+CHECK_COMMANDS = {
+    'status': ['version', 'info'],
+    'token': ['ring'],
+}
+# Lines of nodetool version & info used, by lower case prefix
+INFO_KEYS = {
+    'releaseversion': 'version',
+    'uptime ': 'uptime',
+    'load ': 'load',
+    'heap memory ': 'heap_mem',
+    'off heap memory ': 'off_heap_mem',
+    'gossip ': 'gossip',
+    'thrift ': 'thrift',
+    'native transport ': 'native_transport',
+}
+# Token ring sizes of Murmur3Partitioner (signed 64 bit tokens) &
+# RandomPartitioner (0 to 2**127)
+MURMUR3_RING = 2 ** 64
+RANDOM_RING = 2 ** 127
+
+# Nagios exit status values
+ST_OK = 0
+ST_WR = 1
+ST_CR = 2
+ST_UK = 3
+
+
+class NodetoolError(Exception):
+    pass
+
+
+def parse_options():
+    parser = OptionParser(version=VERSION)
+    for option, description in OPTIONS.items():
+        shortopt = '-%s' % (option)
+        longopt = '--%s' % (description.split(';')[0])
+        keyname = description.split(';')[0]
+        help = ''
+        if len(description.split(';')) > 1:
+            help = description.split(';')[1]
+        parser.add_option(shortopt, longopt, dest=keyname, help=help)
+    (options, args) = parser.parse_args()
+    arguments = {}
+    for keyname, default in DEFAULTS.items():
+        value = getattr(options, keyname)
+        if value is None or value.strip() == '':
+            value = default
+        arguments[keyname] = value
+    arguments['checktype'] = options.checktype
+    return arguments
+
+
+def exit_formalalities(message, exit_status):
+    print message
+    sys.exit(exit_status)
+
+
+def validate_arguments(arguments):
+    if not arguments['checktype']:
+        raise ValueError("ERROR: Mandatory argument '--checktype' not"
+                         " provided")
+    if arguments['checktype'] not in CHECK_TYPES:
+        raise ValueError("ERROR: Invalid value for checktype - '%s'. Valid"
+                         " values are: 'status', 'token'"
+                         % arguments['checktype'])
+    for keyname in 'warning', 'critical':
+        if not arguments[keyname].isdigit():
+            raise ValueError("ERROR: Invalid value for --%s - '%s'. Integer"
+                             " percent expected" % (keyname,
+                                                    arguments[keyname]))
+        arguments[keyname] = int(arguments[keyname])
+    if arguments['warning'] < arguments['critical']:
+        raise ValueError("ERROR: Value for --warning (%s%%) must be greater"
+                         " than --critical (%s%%)" % (arguments['warning'],
+                                                      arguments['critical']))
+    try:
+        arguments['cache_ttl'] = float(arguments['cache_ttl'])
+    except ValueError:
+        raise ValueError("ERROR: Invalid value for --cache_ttl - '%s'"
+                         % arguments['cache_ttl'])
+
+
+class RingAnalyzer(object):
+    """
+    Aggregates nodetool ring output fed line by line: token counts by
+    status, per node state, load & owned token range, per datacenter.
+    Memory used grows with nodes, not with tokens
+    """
+    def __init__(self):
+        self.tokens_up = 0
+        self.tokens_down = 0
+        self.nodes = {}
+        self.datacenters = []
+        self.min_token = 0
+        self.datacenter = None
+
+    def start_datacenter(self, name):
+        self.finish_datacenter()
+        self.datacenter = {'name': name, 'last_token': None,
+                           'first': None, 'previous': None}
+        self.datacenters.append({'name': name, 'nodes': []})
+
+    def finish_datacenter(self):
+        """Add the range wrapping around the ring to its first token's node"""
+        dc = self.datacenter
+        if dc is None or dc['first'] is None:
+            return
+        address, first_token = dc['first']
+        last_token = dc['last_token']
+        if last_token is None:
+            last_token = dc['previous']
+        # Ring size is known once all tokens are seen, keep the offset
+        self.nodes[address]['wrap'] = first_token - last_token
+        self.datacenter = None
+
+    def feed(self, line):
+        fields = line.split()
+        if not fields:
+            return
+        if line.startswith('Datacenter:'):
+            self.start_datacenter(line.split(':', 1)[1].strip())
+            return
+        if self.datacenter is None:
+            self.start_datacenter('')
+        if len(fields) == 1:
+            # Last token of the ring, printed before its first token
+            try:
+                self.datacenter['last_token'] = int(fields[0])
+            except ValueError:
+                pass
+            return
+        if len(fields) < 7 or fields[2] not in ('Up', 'Down', '?'):
+            # Headers & warnings
+            return
+        try:
+            token = int(fields[-1])
+        except ValueError:
+            return
+        address, status, state = fields[0], fields[2], fields[3]
+        if status == 'Up':
+            self.tokens_up += 1
+        elif status == 'Down':
+            self.tokens_down += 1
+        node = self.nodes.get(address)
+        if node is None:
+            node = self.nodes[address] = {
+                'datacenter': self.datacenter['name'], 'status': status,
+                'state': state, 'load': ''.join(fields[4:-2]), 'tokens': 0,
+                'owned': 0, 'wrap': 0}
+            self.datacenters[-1]['nodes'].append(address)
+        node['tokens'] += 1
+        dc = self.datacenter
+        if dc['previous'] is None:
+            dc['first'] = (address, token)
+        else:
+            node['owned'] += token - dc['previous']
+        dc['previous'] = token
+        self.min_token = min(self.min_token, token)
+
+    def summary(self):
+        """Ring summary, plain data for the snapshot cache"""
+        self.finish_datacenter()
+        if self.min_token < 0:
+            ring_size = MURMUR3_RING
+        else:
+            ring_size = RANDOM_RING
+        max_skew = 0.0
+        for dc in self.datacenters:
+            ownership = []
+            for address in dc['nodes']:
+                node = self.nodes[address]
+                owned = node.pop('owned') + node.pop('wrap') % ring_size
+                node['owns'] = float(owned) / ring_size
+                ownership.append(node['owns'])
+            # Largest ownership relative to an even share, 1.0 is balanced
+            if ownership:
+                dc['skew'] = max(ownership) * len(ownership)
+                max_skew = max(max_skew, dc['skew'])
+        return {
+            'tokens_up': self.tokens_up,
+            'tokens_down': self.tokens_down,
+            'nodes': self.nodes,
+            'datacenters': self.datacenters,
+            'skew': max_skew,
+        }
+
+
+def parse_info(lines):
+    """Values of the INFO_KEYS lines of nodetool version & info"""
+    info = {}
+    for line in lines:
+        for prefix, keyname in INFO_KEYS.items():
+            if line.lower().startswith(prefix):
+                info[keyname] = line.split(':', 1)[-1].strip()
+    return info
+
+
+def run_nodetool(nodetool, commands):
+    """
+    Run nodetool commands in parallel, streaming their output: ring through
+    RingAnalyzer, version & info through parse_info.
+    Returns a snapshot dict with keys 'info' &/or 'ring'
+    """
+    processes = []
+    with open(os.devnull, 'w') as devnull:
+        for command in commands:
+            try:
+                processes.append((command, subprocess.Popen(
+                    nodetool.split() + [command], stdout=subprocess.PIPE,
+                    stderr=devnull)))
+            except OSError as e:
+                raise NodetoolError("nodetool %s: %s" % (command, e))
+    snapshot = {'time': time.time()}
+    info_lines = []
+    for command, process in processes:
+        if command == 'ring':
+            analyzer = RingAnalyzer()
+            for line in iter(process.stdout.readline, ''):
+                analyzer.feed(line)
+            snapshot['ring'] = analyzer.summary()
+        else:
+            info_lines.extend(iter(process.stdout.readline, ''))
+        if process.wait() != 0:
+            raise NodetoolError("nodetool %s exited with %s"
+                                % (command, process.returncode))
+    if info_lines:
+        snapshot['info'] = parse_info(info_lines)
+    return snapshot
+
+
+def read_cache(cache_file):
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+        if isinstance(cache, dict):
+            return cache
+    except (IOError, ValueError):
+        pass
+    return {}
+
+
+def cached_snapshot(arguments):
+    """
+    Snapshot for the check type. With a cache_ttl, the snapshot of all
+    commands is shared by all checks for cache_ttl seconds. Only one check
+    runs nodetool at a time, the others wait on its lock & read its result
+    """
+    cache_ttl = arguments['cache_ttl']
+    if cache_ttl <= 0:
+        return run_nodetool(arguments['nodetool'],
+                            CHECK_COMMANDS[arguments['checktype']])
+    cache_file = arguments['cache_file']
+
+    def fresh(snapshot):
+        return isinstance(snapshot, dict) and \
+            time.time() - snapshot.get('time', 0) < cache_ttl
+
+    snapshot = read_cache(cache_file)
+    if fresh(snapshot):
+        return snapshot
+    with open('%s.lock' % cache_file, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Another check may have run nodetool while we waited
+            snapshot = read_cache(cache_file)
+            if fresh(snapshot):
+                return snapshot
+            snapshot = run_nodetool(arguments['nodetool'],
+                                    ['version', 'info', 'ring'])
+            temp_file = "%s.%s.tmp" % (cache_file, os.getpid())
+            with open(temp_file, 'w') as f:
+                json.dump(snapshot, f)
+            os.rename(temp_file, cache_file)
+            return snapshot
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def formatted_status_message(info):
+    def active(keyname):
+        if info.get(keyname) == 'true':
+            return 'active'
+        return 'inactive'
+
+    load = info.get('load', '').replace(' ', '')
+    heap_mem = info.get('heap_mem', '').replace(' ', '')
+    off_heap_mem = info.get('off_heap_mem', '').replace(' ', '')
+    return "Version:%s uptime:%s load:%s heap_mem:%smb off_heap_mem:%smb" \
+        " gossip:%s thrift:%s native_transport:%s | load=%s heap_mem=%sMB" \
+        " off_heap_mem=%sMB" % (
+            info.get('version', ''), info.get('uptime', ''), load, heap_mem,
+            off_heap_mem, active('gossip'), active('thrift'),
+            active('native_transport'), load, heap_mem.split('/')[0],
+            off_heap_mem)
+
+
+def calc_tokens_health(ring, arguments):
+    """Returns a tuple: (exit status, message)"""
+    tokens_up = ring['tokens_up']
+    tokens_down = ring['tokens_down']
+    total_tokens = tokens_up + tokens_down
+    if total_tokens == 0:
+        return (ST_UK, "UNKNOWN - No tokens found in nodetool ring output")
+    percent_tokens_up = tokens_up * 100 / total_tokens
+    warning_count = arguments['warning'] * total_tokens / 100
+    critical_count = arguments['critical'] * total_tokens / 100
+    nodes_down = len([n for n in ring['nodes'].values()
+                      if n['status'] == 'Down'])
+    perf_info = "tokens_up=%s;%s;%s tokens_down=%s total_tokens=%s" \
+        " nodes=%s nodes_down=%s ownership_skew=%.3f" % (
+            tokens_up, warning_count, critical_count, tokens_down,
+            total_tokens, len(ring['nodes']), nodes_down, ring['skew'])
+    message = "Tokens up: %s/%s (%s%%), nodes down: %s/%s, ownership" \
+        " skew: %.2f | %s" % (tokens_up, total_tokens, percent_tokens_up,
+                              nodes_down, len(ring['nodes']), ring['skew'],
+                              perf_info)
+    if percent_tokens_up <= arguments['critical']:
+        return (ST_CR, "CRITICAL - %s" % message)
+    elif percent_tokens_up <= arguments['warning']:
+        return (ST_WR, "WARNING - %s" % message)
+    return (ST_OK, "OK - %s" % message)
+
+
+def run():
+    arguments = parse_options()
+    try:
+        validate_arguments(arguments)
+    except ValueError as e:
+        exit_formalalities("%s\nUse -h/--help option to get more details"
+                           % e, ST_UK)
+    try:
+        snapshot = cached_snapshot(arguments)
+    except NodetoolError:
+        exit_formalalities("CRITICAL - Cassandra not responding!", ST_CR)
+    if arguments['checktype'] == 'status':
+        exit_formalalities(formatted_status_message(snapshot['info']), ST_OK)
+    exit_status, message = calc_tokens_health(snapshot['ring'], arguments)
+    exit_formalalities(message, exit_status)
+
+
+if __name__ == '__main__':
+    run()
@@ -3,7 +3,9 @@
 # NRPE plugin to check status of freeswitch
 # Valid commands: 'show channels count', 'status'
 #
-# Actual fs_cli commands being run to perform checks:
+# Command outputs are read through freeswitch_api.py, served from the snapshot
+# kept by freeswitch_collector.py over one persistent event socket connection.
+# Equivalent fs_cli commands of the checks:
 # show channels count: /usr/local/freeswitch/bin/fs_cli -q -x "show channels count" -t 2000
 # show calls count: /usr/local/freeswitch/bin/fs_cli -q -x "show calls count" -t 2000
 # zombie_calls: /usr/local/freeswitch/bin/fs_cli -q -x "show channels" -t 2000
@@ -14,6 +16,7 @@
 
 AUTHOR="Rohit Gupta - @rohit01"
 PROGNAME=`basename $0`
+PROGDIR=`dirname $0`
 VERSION="Version 1.0,"
 
 ## Global static variables
@@ -39,7 +42,7 @@ print_help() {
     print_version
     echo ""
     echo "$PROGNAME is a custom NRPE plugin to check freeswitch status"
-    echo "using fs_cli command."
+    echo "using event socket api commands (freeswitch_api.py)."
     echo "Freeswitch status check commands defined in this module are:"
     echo "'show channels count', 'show calls count', 'status', 'pri_metrics', "
     echo "'pri_status', 'calls_count', 'zombie_calls'"
@@ -96,7 +99,7 @@ check_timeout() {
 }
 
 execute_check() {
-    fscli_output="$(/usr/local/freeswitch/bin/fs_cli -q -x "$fs_command" -t 2000)"
+    fscli_output="$(python "${PROGDIR}/freeswitch_api.py" -x "$fs_command" -t 2000)"
     check_exit_status
     check_timeout
 }
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+#
+# Nagios plugin to monitor the given DNS change & reload/restart running
+# services to counter dns cached locally. Noticed DNS cache problem in nginx.
+# A queries for all names are sent at once to the nameserver. Answers are
+# kept with their TTL, so a name is queried again only after its answer has
+# expired, & compared as sets, so round robin reordering isn't a change.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import random
+import select
+import socket
+import stat
+import struct
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+
+__version__ = 1.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+OPTIONS = {
+    'd': "dns_names;dns addresses separated by comma. Mandatory option",
+    's': "services;Services (separated by comma) to reload/restart in event" \
+         " of DNS change. Default: nginx",
+    'a': "action;Init script argument: start/stop/restart/reload." \
+         " Default: reload",
+    'n': "nameserver;Nameserver to query. Default: first nameserver in" \
+         " /etc/resolv.conf",
+    'T': "max_ttl;Query a name at least every max_ttl seconds, whatever the" \
+         " TTL of its answer. Default: 3600",
+}
+DEFAULTS = {
+    'services': 'nginx',
+    'action': 'reload',
+    'max_ttl': '3600',
+}
+
+# Settings
+LOCK_FILENAME = '/tmp/._monitor_DNS_change_lock_1855_'
+KEEP_TRACK_FILE = '/tmp/._monitor_DNS_change_keep_track_1855_.json'
+RESOLV_CONF = '/etc/resolv.conf'
+DEFAULT_NAMESERVER = '127.0.0.1'
+DNS_PORT = 53
+# Unanswered queries are sent again every RETRY_INTERVAL seconds
+NO_OF_RETRY = 10
+RETRY_INTERVAL = 0.5
+# TTL of a NXDOMAIN answer without SOA record
+NEGATIVE_TTL = 60
+INIT_DIR = '/etc/init.d/'
+# Tries of a service init script command
+NO_OF_COMMAND_TRY = 5
+NOT_FOUND_TEXT = 'Not_Found'
+
+# DNS constants
+TYPE_A = 1
+TYPE_SOA = 6
+CLASS_IN = 1
+FLAG_RD = 0x0100
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+
+# Nagios exit status values
+ST_OK = 0
+ST_WR = 1
+ST_CR = 2
+ST_UK = 3
+
+
+def parse_options():
+    parser = OptionParser(version=VERSION)
+    for option, description in OPTIONS.items():
+        shortopt = '-%s' % (option)
+        longopt = '--%s' % (description.split(';')[0])
+        keyname = description.split(';')[0]
+        help = ''
+        if len(description.split(';')) > 1:
+            help = description.split(';')[1]
+        parser.add_option(shortopt, longopt, dest=keyname, help=help)
+    (options, args) = parser.parse_args()
+    arguments = {}
+    for keyname, default in DEFAULTS.items():
+        value = getattr(options, keyname)
+        if value is None or value.strip() == '':
+            value = default
+        arguments[keyname] = value
+    arguments['dns_names'] = options.dns_names
+    arguments['nameserver'] = options.nameserver
+    return arguments
+
+
+def exit_formalalities(message, exit_status):
+    print message
+    sys.exit(exit_status)
+
+
+def split_strings(value):
+    return [s.strip() for s in (value or '').split(',') if s.strip()]
+
+
+def validate_arguments(arguments):
+    arguments['dns_names'] = [name.lower().rstrip('.') for name in
+                              split_strings(arguments['dns_names'])]
+    if not arguments['dns_names']:
+        raise ValueError("DNS names not passed. Used option '-d' to specify")
+    arguments['services'] = split_strings(arguments['services'])
+    if not arguments['max_ttl'].isdigit():
+        raise ValueError("Invalid value: '%s' for option -T/--max_ttl."
+                         " Possible value: Positive integer"
+                         % arguments['max_ttl'])
+    arguments['max_ttl'] = int(arguments['max_ttl'])
+    if not arguments['nameserver']:
+        arguments['nameserver'] = system_nameserver()
+
+
+def system_nameserver():
+    try:
+        with open(RESOLV_CONF, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 1 and fields[0] == 'nameserver':
+                    return fields[1]
+    except IOError:
+        pass
+    return DEFAULT_NAMESERVER
+
+
+## DNS messages ##
+
+def encode_query(query_id, name):
+    labels = ''.join("%s%s" % (chr(len(label)), label)
+                     for label in name.split('.') if label)
+    return struct.pack('!HHHHHH', query_id, FLAG_RD, 1, 0, 0, 0) + \
+        labels + '\0' + struct.pack('!HH', TYPE_A, CLASS_IN)
+
+
+def skip_name(message, offset):
+    """Offset after the, possibly compressed, name at offset"""
+    while True:
+        length = ord(message[offset])
+        if length & 0xc0 == 0xc0:
+            return offset + 2
+        offset += length + 1
+        if length == 0:
+            return offset
+
+
+def decode_response(message):
+    """
+    Returns a tuple: (query id, rcode, A record addresses, TTL) of a
+    response. TTL is the lowest TTL of the A records, or of the SOA record
+    for negative answers
+    """
+    query_id, flags, qdcount, ancount, nscount, _ = struct.unpack(
+        '!HHHHHH', message[:12])
+    rcode = flags & 0x000f
+    offset = 12
+    for _ in xrange(qdcount):
+        offset = skip_name(message, offset) + 4
+    addresses = set()
+    ttls = []
+    negative_ttls = []
+    for index in xrange(ancount + nscount):
+        offset = skip_name(message, offset)
+        rtype, rclass, ttl, length = struct.unpack(
+            '!HHIH', message[offset:offset + 10])
+        offset += 10
+        rdata = message[offset:offset + length]
+        offset += length
+        if index < ancount and rtype == TYPE_A and rclass == CLASS_IN:
+            addresses.add(socket.inet_ntoa(rdata))
+            ttls.append(ttl)
+        elif index >= ancount and rtype == TYPE_SOA:
+            # Negative caching TTL: lower of SOA TTL & SOA minimum
+            minimum = struct.unpack('!I', rdata[-4:])[0]
+            negative_ttls.append(min(ttl, minimum))
+    ttl = min(ttls or negative_ttls or [NEGATIVE_TTL])
+    return (query_id, rcode, sorted(addresses), ttl)
+
+
+def resolve(names, nameserver):
+    """
+    Query A records of all names at once, sending unanswered queries again
+    every RETRY_INTERVAL seconds, up to NO_OF_RETRY times.
+    Returns a dict: name -> (addresses, TTL) of the answered names. Names
+    not found map to ([NOT_FOUND_TEXT], TTL)
+    """
+    family, _, _, _, address = socket.getaddrinfo(
+        nameserver, DNS_PORT, 0, socket.SOCK_DGRAM)[0]
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        queries = {}
+        used_ids = set()
+        for name in names:
+            query_id = random.randint(0, 0xffff)
+            while query_id in used_ids:
+                query_id = random.randint(0, 0xffff)
+            used_ids.add(query_id)
+            queries[query_id] = (name, encode_query(query_id, name))
+        answers = {}
+        for attempt in xrange(NO_OF_RETRY + 1):
+            for query_id, (name, query) in queries.items():
+                if name not in answers:
+                    sock.sendto(query, address)
+            deadline = time.time() + RETRY_INTERVAL
+            while len(answers) < len(names):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    readable, _, _ = select.select([sock], [], [], remaining)
+                except select.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if not readable:
+                    break
+                message, source = sock.recvfrom(65536)
+                if source[0] != address[0]:
+                    continue
+                try:
+                    query_id, rcode, addresses, ttl = decode_response(message)
+                except (struct.error, IndexError, socket.error):
+                    continue
+                if query_id not in queries:
+                    continue
+                name = queries[query_id][0]
+                if rcode == RCODE_NXDOMAIN or (rcode == RCODE_NOERROR and
+                                               not addresses):
+                    answers[name] = ([NOT_FOUND_TEXT], ttl)
+                elif rcode == RCODE_NOERROR:
+                    answers[name] = (addresses, ttl)
+            if len(answers) == len(names):
+                break
+        return answers
+    finally:
+        sock.close()
+
+
+## Tracked answers ##
+
+def trusted_file(path):
+    """
+    True if path is a regular file owned by root or this user & not writable
+    by others. Another user could plant a track file in /tmp with far future
+    expiry times, hiding DNS changes
+    """
+    try:
+        file_stat = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISREG(file_stat.st_mode) and \
+        file_stat.st_uid in (0, os.getuid()) and \
+        not file_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def read_track_file():
+    """Returns a dict: name -> {'answers': [...], 'expires': epoch} or None"""
+    if not trusted_file(KEEP_TRACK_FILE):
+        return None
+    try:
+        with open(KEEP_TRACK_FILE, 'r') as f:
+            return json.load(f)['names']
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_track_file(names):
+    """Atomic replace through an unpredictable temp file. Exits on failure"""
+    try:
+        fd, temp_file = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(KEEP_TRACK_FILE)))
+    except (IOError, OSError) as e:
+        exit_formalalities("UNKNOWN - Saving DNS details failed: %s" % e,
+                           ST_UK)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'updated': int(time.time()), 'names': names}, f)
+        os.rename(temp_file, KEEP_TRACK_FILE)
+    except (IOError, OSError) as e:
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+        exit_formalalities("UNKNOWN - Saving DNS details failed: %s" % e,
+                           ST_UK)
+
+
+def run_service_action(service, action):
+    """Init script command, tried up to NO_OF_COMMAND_TRY times"""
+    command = "%s%s %s" % (INIT_DIR, service, action)
+    for _ in xrange(NO_OF_COMMAND_TRY):
+        if subprocess.call([INIT_DIR + service, action]) == 0:
+            return (True, command)
+    return (False, command)
+
+
+def run():
+    arguments = parse_options()
+    try:
+        validate_arguments(arguments)
+    except ValueError as e:
+        exit_formalalities(str(e), ST_UK)
+    try:
+        # Never through a symlink planted in /tmp
+        lock_file = os.fdopen(os.open(LOCK_FILENAME, os.O_WRONLY | os.O_CREAT |
+                                      os.O_NOFOLLOW, 0600), 'w')
+    except OSError as e:
+        exit_formalalities("UNKNOWN - Opening lock file failed: %s" % e,
+                           ST_UK)
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        exit_formalalities("The script is already running !", ST_UK)
+    tracked = read_track_file()
+    now = time.time()
+    names = arguments['dns_names']
+    expired = [name for name in names if tracked is None or
+               name not in tracked or tracked[name]['expires'] <= now]
+    answers = {}
+    if expired:
+        try:
+            answers = resolve(expired, arguments['nameserver'])
+        except socket.error as e:
+            exit_formalalities("UNKNOWN - DNS query failed: %s" % e, ST_UK)
+    current = dict(tracked or {})
+    for name, (addresses, ttl) in answers.items():
+        current[name] = {
+            'answers': addresses,
+            'expires': int(now) + min(ttl, arguments['max_ttl']),
+        }
+    unresolved = [name for name in expired if name not in answers]
+    if tracked is None:
+        write_track_file(current)
+        exit_formalalities("UNKNOWN - OLD dns details not found !", ST_UK)
+    changed = [name for name in names if name in answers and (
+        name not in tracked or
+        set(tracked[name]['answers']) != set(answers[name][0]))]
+    if not changed:
+        if answers:
+            write_track_file(current)
+        if unresolved:
+            exit_formalalities("UNKNOWN - DNS query timed out: %s"
+                               % ', '.join(unresolved), ST_UK)
+        exit_formalalities("OK - DNS has not changed", ST_OK)
+    failed_commands = []
+    for service in arguments['services']:
+        success, command = run_service_action(service, arguments['action'])
+        if not success:
+            failed_commands.append("'%s'" % command)
+    if failed_commands:
+        # Changed answers aren't saved, so next run reloads again
+        for name in changed:
+            if name in tracked:
+                current[name] = dict(tracked[name], expires=0)
+            else:
+                del current[name]
+        write_track_file(current)
+        exit_formalalities("CRITICAL - Error in executing commands: %s"
+                           % ', '.join(failed_commands), ST_CR)
+    write_track_file(current)
+    exit_formalalities("WARNING - DNS Changed (%s). Services"
+                       " reloaded/restarted" % ', '.join(changed), ST_WR)
+
+
+if __name__ == '__main__':
+    run()
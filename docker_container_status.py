@@ -4,11 +4,17 @@
 # Author: Rohit Gupta - @rohit01
 #
 
-import docker
+import instrumentation
+with instrumentation.phase('import'):
+    import docker
 import os
 import sys
+import json
+import time
 import optparse
 import datetime
+import threading
+import Queue
 
 
 __version__ = 0.1
@@ -16,8 +22,52 @@ VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
 DESCRIPTION = "NRPE plugin to monitor running docker containers. Requires:" \
     " docker-py"
 OPTIONS = {
-    "image_name": "Docker image name",
+    "image_name": "Docker image name. Comma separated names are checked" \
+        " together, each with its own container count",
+    "snapshot_file": "Snapshot file kept up to date by" \
+        " docker_container_watcher.py. If fresh, it is used instead of the" \
+        " docker API. Default: not used",
+    "snapshot_max_age": "Max age of snapshot file in seconds, beyond which" \
+        " the docker API is used. Default: 120",
+    "mode": "count: number of running containers, stats: per container" \
+        " cpu, memory & restart count (needs docker-py >= 1.9). Default:" \
+        " count",
+    "stats_workers": "Containers sampled in parallel in stats mode." \
+        " Default: 20",
+    "stats_deadline": "Total deadline in seconds for sampling stats of all" \
+        " containers. Default: 10",
+    "cpu_warning": "Per container cpu usage warning level (in %)",
+    "cpu_critical": "Per container cpu usage critical level (in %)",
+    "memory_warning": "Per container memory usage warning level (in % of" \
+        " memory limit)",
+    "memory_critical": "Per container memory usage critical level (in % of" \
+        " memory limit)",
+    "restart_warning": "Per container restart count warning level",
+    "restart_critical": "Per container restart count critical level",
+    "profile": "Write a cProfile dump & JSON phase timing report of this run" \
+        " in profile_dir",
+    "profile_dir": "Directory for profiles. Default:" \
+        " /var/tmp/nrpe_plugin_profiles",
 }
+DEFAULTS = {
+    "snapshot_file": None,
+    "snapshot_max_age": 120,
+    "mode": "count",
+    "stats_workers": 20,
+    "stats_deadline": 10,
+    "cpu_warning": None,
+    "cpu_critical": None,
+    "memory_warning": None,
+    "memory_critical": None,
+    "restart_warning": None,
+    "restart_critical": None,
+    "profile": False,
+    "profile_dir": instrumentation.PROFILE_DIR,
+}
+# Options without value
+FLAG_OPTIONS = ['profile']
+THRESHOLD_KEYS = ['cpu_warning', 'cpu_critical', 'memory_warning',
+                  'memory_critical', 'restart_warning', 'restart_critical']
 USAGE = "%s [options]"  % os.path.basename(__file__)
 
 # NRPE exit status variables
@@ -27,63 +77,338 @@ ST_CR = 2
 ST_UK = 3
 
 
-def parse_options(options, description=None, usage=None, version=None):
+def parse_options(options, description=None, usage=None, version=None,
+        defaults=None):
     parser = optparse.OptionParser(description=description, usage=usage,
                                    version=version)
     for keyname, description in options.items():
         longopt = '--%s' % keyname
-        parser.add_option(longopt, dest=keyname, help=description)
+        if keyname in FLAG_OPTIONS:
+            parser.add_option(longopt, dest=keyname, action='store_true',
+                              help=description)
+        else:
+            parser.add_option(longopt, dest=keyname, help=description)
     option_args, _ = parser.parse_args()
     arguments = {}
     for keyname in options.keys():
         arguments[keyname] = eval("option_args.%s" % keyname)
+    if defaults:
+        for k, v in arguments.items():
+            if (not v) and (k in defaults):
+                arguments[k] = defaults[k]
     return arguments
 
 
 def validate_arguments(arguments):
     for keyname in arguments.keys():
-        if arguments[keyname] is None:
+        if arguments[keyname] is None and keyname not in DEFAULTS:
             print "Mandatory argument missing: --%s" % keyname
             sys.exit(ST_UK)
+    if arguments['mode'] not in ('count', 'stats'):
+        print "Invalid argument: --mode must be count or stats"
+        sys.exit(ST_UK)
+    for keyname in ['snapshot_max_age', 'stats_deadline'] + THRESHOLD_KEYS:
+        if arguments[keyname] is None:
+            continue
+        try:
+            arguments[keyname] = float(arguments[keyname])
+        except ValueError:
+            print "Invalid argument: --%s must be a number" % keyname
+            sys.exit(ST_UK)
+    try:
+        arguments['stats_workers'] = int(arguments['stats_workers'])
+        if arguments['stats_workers'] < 1:
+            raise ValueError()
+    except ValueError:
+        print "Invalid argument: --stats_workers must be a positive integer"
+        sys.exit(ST_UK)
+
+
+def split_image_names(image_names):
+    return [name.strip() for name in image_names.split(',') if name.strip()]
+
+
+def image_references(dclient, image_name):
+    """
+    Image references to be used with the daemon side ancestor filter. An
+    image name without tag matches all its locally available tags
+    """
+    if ':' in image_name.split('/')[-1]:
+        return [image_name]
+    references = []
+    for image in dclient.images(name=image_name):
+        for tag in image.get('RepoTags') or []:
+            if tag.startswith("%s:" % image_name):
+                references.append(tag)
+    return references
 
 
-def get_container_ids(arguments):
-    dclient = docker.Client()
-    container_list = dclient.containers()
-    container_ids = []
+def image_matches(container_image, image_name):
+    if ':' in image_name.split('/')[-1]:
+        return container_image == image_name
+    return container_image.startswith("%s:" % image_name)
+
+
+@instrumentation.timed
+def get_containers(dclient, image_names):
+    """
+    Fetch running containers of all image names in one API call, filtered by
+    the docker daemon. Returns a dict of image name to container details
+    """
+    references = []
+    for image_name in image_names:
+        for reference in image_references(dclient, image_name):
+            if reference not in references:
+                references.append(reference)
+    containers = dict((image_name, []) for image_name in image_names)
+    if not references:
+        return containers
+    try:
+        container_list = dclient.containers(filters={'ancestor': references})
+    except docker.errors.APIError:
+        # Docker daemon older than 1.10 does not support the ancestor filter
+        container_list = dclient.containers()
     for container_details in container_list:
-        image_prefix = "%s:" % arguments['image_name']
-        if container_details['Image'].startswith(image_prefix):
-            container_ids.append(container_details['Id'])
-    return container_ids
+        for image_name in image_names:
+            if image_matches(container_details['Image'], image_name):
+                containers[image_name].append(container_details)
+    return containers
 
 
-def print_container_summary(container_ids):
-    dclient = docker.Client()
-    container_time_info = {}
-    for cid in container_ids:
-        details = dclient.inspect_container(cid)
-        iso_time = details['Created'].split('.')[0]
-        create_time = datetime.datetime.strptime(iso_time, "%Y-%m-%dT%H:%M:%S")
-        container_time_info[cid] = create_time
-    no_of_containers = len(container_time_info)
-    last_create_time = None
-    for ctime in container_time_info.values():
-        if not last_create_time:
-            last_create_time = ctime
-        elif ctime > last_create_time:
-            last_create_time = ctime
-    if no_of_containers <= 0:
-        print "CRITICAL: No running containers | containers=0"
-        sys.exit(ST_CR)
-    elif no_of_containers == 1:
-        relative_time = pretty_date(last_create_time)
-        print "OK: %s running container, started: %s | containers=%s" \
-            % (no_of_containers, relative_time, no_of_containers)
+@instrumentation.timed
+def get_containers_from_snapshot(snapshot_file, image_names, max_age):
+    """
+    Read running containers from the snapshot written by
+    docker_container_watcher.py, in the same form as get_containers().
+    Returns None if the snapshot is missing, unreadable or stale
+    """
+    try:
+        with open(snapshot_file, 'r') as f:
+            snapshot = json.load(f)
+        if time.time() - snapshot['updated'] > max_age:
+            return None
+        images = snapshot['images']
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+    containers = dict((image_name, []) for image_name in image_names)
+    for image, container_times in images.items():
+        for image_name in image_names:
+            if not image_matches(image, image_name):
+                continue
+            for cid, (created, started) in container_times.items():
+                containers[image_name].append({
+                    'Id': cid,
+                    'Image': image,
+                    'Created': created,
+                    'Started': started,
+                })
+    return containers
+
+
+def last_create_time(container_list):
+    create_times = [c['Created'] for c in container_list]
+    if not create_times:
+        return None
+    return datetime.datetime.utcfromtimestamp(max(create_times))
+
+
+def print_container_summary(containers):
+    if len(containers) == 1:
+        container_list = containers.values()[0]
+        no_of_containers = len(container_list)
+        relative_time = pretty_date(last_create_time(container_list))
+        perf_data = instrumentation.perf_data(
+            "containers=%s" % no_of_containers)
+        if no_of_containers <= 0:
+            print "CRITICAL: No running containers | %s" % perf_data
+            sys.exit(ST_CR)
+        elif no_of_containers == 1:
+            print "OK: %s running container, started: %s | %s" \
+                % (no_of_containers, relative_time, perf_data)
+        else:
+            print "OK: %s running containers, newest one started: %s | " \
+                "%s" % (no_of_containers, relative_time, perf_data)
+        return
+    exit_status = ST_OK
+    summary = []
+    perf_data = []
+    for image_name in sorted(containers.keys()):
+        container_list = containers[image_name]
+        no_of_containers = len(container_list)
+        relative_time = pretty_date(last_create_time(container_list))
+        if no_of_containers <= 0:
+            exit_status = ST_CR
+            summary.append("%s: No running containers" % image_name)
+        elif no_of_containers == 1:
+            summary.append("%s: %s running container, started: %s"
+                           % (image_name, no_of_containers, relative_time))
+        else:
+            summary.append("%s: %s running containers, newest one started: "
+                           "%s" % (image_name, no_of_containers, relative_time))
+        perf_data.append("'containers_%s'=%s" % (image_name, no_of_containers))
+    if exit_status == ST_OK:
+        status_text = "OK"
     else:
-        relative_time = pretty_date(last_create_time)
-        print "OK: %s running containers, newest one started: %s | " \
-            "containers=%s" % (no_of_containers, relative_time, no_of_containers)
+        status_text = "CRITICAL"
+    print "%s: %s | %s" % (status_text, '; '.join(summary),
+                           instrumentation.perf_data(' '.join(perf_data)))
+    sys.exit(exit_status)
+
+
+@instrumentation.timed
+def container_stats(dclient, container_id, with_restarts=False):
+    """
+    Take a single non streaming stats sample of a container. The daemon
+    returns it with the previous cpu counters, used to compute cpu %
+    """
+    sample = dclient.stats(container_id, decode=True, stream=False)
+    cpu_stats = sample['cpu_stats']
+    precpu_stats = sample.get('precpu_stats') or {}
+    cpu_delta = cpu_stats['cpu_usage']['total_usage'] - \
+        precpu_stats.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu_stats.get('system_cpu_usage', 0) - \
+        precpu_stats.get('system_cpu_usage', 0)
+    online_cpus = cpu_stats.get('online_cpus') or \
+        len(cpu_stats['cpu_usage'].get('percpu_usage') or []) or 1
+    cpu_percent = 0.0
+    if cpu_delta > 0 and system_delta > 0:
+        cpu_percent = float(cpu_delta) / system_delta * online_cpus * 100.0
+    memory_stats = sample.get('memory_stats') or {}
+    memory_usage = memory_stats.get('usage', 0) - \
+        (memory_stats.get('stats') or {}).get('cache', 0)
+    memory_limit = memory_stats.get('limit')
+    memory_percent = 0.0
+    if memory_limit:
+        memory_percent = float(memory_usage) * 100.0 / memory_limit
+    stats = {
+        'cpu': cpu_percent,
+        'memory': memory_percent,
+        'memory_bytes': memory_usage,
+    }
+    if with_restarts:
+        details = dclient.inspect_container(container_id)
+        stats['restarts'] = details['RestartCount']
+    return stats
+
+
+@instrumentation.timed
+def collect_stats(container_ids, workers, deadline, with_restarts=False):
+    """
+    Sample stats of all containers in parallel using a bounded pool of
+    worker threads, each with its own docker client. Container ids must be
+    unique. Returns a dict of container id to stats, or to an error message
+    for containers which failed or missed the deadline
+    """
+    pending = Queue.Queue()
+    for cid in container_ids:
+        pending.put(cid)
+    results = {}
+    results_lock = threading.Lock()
+    done = threading.Event()
+
+    def worker():
+        dclient = None
+        while True:
+            try:
+                cid = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                if dclient is None:
+                    dclient = docker.Client()
+                result = container_stats(dclient, cid, with_restarts)
+            except Exception as e:
+                result = "Exception occured: %s" % e
+            with results_lock:
+                results[cid] = result
+                if len(results) == len(container_ids):
+                    done.set()
+
+    if not container_ids:
+        return results
+    threads = []
+    for i in xrange(min(workers, len(container_ids))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    if done.wait(deadline):
+        for thread in threads:
+            thread.join()
+    with results_lock:
+        results = dict(results)
+    for cid in container_ids:
+        if cid not in results:
+            results[cid] = "Deadline of %ss exceeded" % deadline
+    return results
+
+
+def check_threshold(value, warning, critical):
+    if critical is not None and value >= critical:
+        return ST_CR
+    if warning is not None and value >= warning:
+        return ST_WR
+    return ST_OK
+
+
+def print_container_stats(containers, stats, arguments):
+    exit_status = ST_OK
+    reasons = []
+    perf_data = []
+    total_cpu = 0.0
+    total_memory = 0
+    no_of_containers = 0
+    for image_name in sorted(containers.keys()):
+        if not containers[image_name]:
+            exit_status = ST_CR
+            reasons.append("%s: No running containers" % image_name)
+        for container_details in containers[image_name]:
+            no_of_containers += 1
+            cid = container_details['Id']
+            short_id = cid[:12]
+            result = stats[cid]
+            if not isinstance(result, dict):
+                if exit_status == ST_OK:
+                    exit_status = ST_WR
+                reasons.append("%s: stats unavailable. %s" % (short_id, result))
+                continue
+            total_cpu += result['cpu']
+            total_memory += result['memory_bytes']
+            checks = [('cpu', '%'), ('memory', '%')]
+            if 'restarts' in result:
+                checks.append(('restarts', ''))
+            for key, unit in checks:
+                prefix = key.replace('restarts', 'restart')
+                warning = arguments['%s_warning' % prefix]
+                critical = arguments['%s_critical' % prefix]
+                value = result[key]
+                if isinstance(value, float):
+                    value = round(value, 2)
+                status = check_threshold(value, warning, critical)
+                if status == ST_CR:
+                    exit_status = ST_CR
+                    reasons.append("%s: %s %s%s >= %s (CR)"
+                                   % (short_id, key, value, unit, critical))
+                elif status == ST_WR:
+                    if exit_status == ST_OK:
+                        exit_status = ST_WR
+                    reasons.append("%s: %s %s%s >= %s (WR)"
+                                   % (short_id, key, value, unit, warning))
+                perf_data.append("'%s_%s'=%s%s;%s;%s" % (
+                    key, short_id, value, unit,
+                    warning if warning is not None else '',
+                    critical if critical is not None else ''))
+    perf_data = ["containers=%s" % no_of_containers,
+                 "cpu_total=%s%%" % round(total_cpu, 2),
+                 "memory_total=%sB" % total_memory] + perf_data
+    status_text = {ST_OK: "OK", ST_WR: "WARNING", ST_CR: "CRITICAL"}
+    message = "%s: %s running containers, total cpu: %.1f%%, total memory:" \
+        " %.1fMB" % (status_text[exit_status], no_of_containers, total_cpu,
+                     total_memory / 1048576.0)
+    if reasons:
+        message = "%s. Reason: %s" % (message, ', '.join(reasons))
+    print "%s | %s" % (message, instrumentation.perf_data(' '.join(perf_data)))
+    sys.exit(exit_status)
 
 
 def pretty_date(time_object=False):
@@ -128,14 +453,45 @@ def pretty_date(time_object=False):
 
 
 def run():
-    arguments = parse_options(OPTIONS, DESCRIPTION, USAGE, VERSION)
+    arguments = parse_options(OPTIONS, DESCRIPTION, USAGE, VERSION, DEFAULTS)
     validate_arguments(arguments)
+    if arguments['profile']:
+        instrumentation.start_profile('docker_container_status',
+                                      arguments['profile_dir'])
     try:
-        container_ids = get_container_ids(arguments)
-        print_container_summary(container_ids)
+        image_names = split_image_names(arguments['image_name'])
+        if not image_names:
+            print "Mandatory argument missing: --image_name"
+            sys.exit(ST_UK)
+        containers = None
+        if arguments['snapshot_file']:
+            containers = get_containers_from_snapshot(
+                arguments['snapshot_file'], image_names,
+                arguments['snapshot_max_age'])
+        if containers is None:
+            with instrumentation.phase('docker_client'):
+                dclient = docker.Client()
+            containers = get_containers(dclient, image_names)
+        if arguments['mode'] == 'stats':
+            # A container matching many image names is sampled once
+            container_ids = []
+            seen = set()
+            for container_list in containers.values():
+                for c in container_list:
+                    if c['Id'] not in seen:
+                        seen.add(c['Id'])
+                        container_ids.append(c['Id'])
+            with_restarts = arguments['restart_warning'] is not None or \
+                arguments['restart_critical'] is not None
+            stats = collect_stats(container_ids, arguments['stats_workers'],
+                                  arguments['stats_deadline'], with_restarts)
+            print_container_stats(containers, stats, arguments)
+        print_container_summary(containers)
     except Exception as e:
         print "Exception occured: %s" % e.message
         sys.exit(ST_CR)
+    finally:
+        instrumentation.stop_profile()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+#
+# Long running companion of docker_container_status.py. Subscribes to the
+# docker events stream & keeps an on-disk snapshot of running containers per
+# image up to date. Requires: docker-py
+# Author: Rohit Gupta - @rohit01
+#
+
+import docker
+import os
+import sys
+import json
+import time
+import calendar
+import tempfile
+import optparse
+import threading
+import logging
+import logging.handlers
+
+
+__version__ = 0.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+DESCRIPTION = "Keeps a snapshot of running docker containers up to date" \
+    " using docker events. Used by docker_container_status.py. Requires:" \
+    " docker-py"
+OPTIONS = {
+    "snapshot_file": "Snapshot file path. Default:" \
+        " /var/tmp/docker_container_snapshot.json",
+    "heartbeat": "Interval in seconds to resync running containers with" \
+        " the daemon & rewrite the snapshot, marking it fresh, even without" \
+        " any events. Default: 30",
+}
+DEFAULTS = {
+    "snapshot_file": "/var/tmp/docker_container_snapshot.json",
+    "heartbeat": 30,
+}
+USAGE = "%s [options]"  % os.path.basename(__file__)
+# Container events after which a container is no longer running. 'kill' is
+# sent for any signal & 'oom' may leave the container running, 'stop' always
+# comes with 'die'
+STOP_EVENTS = ['die', 'destroy']
+RECONNECT_INTERVAL = 5
+
+logger = logging.getLogger("Docker container watcher")
+logger.setLevel(logging.INFO)
+# Logging in syslog (/var/log/syslog)
+handler = logging.handlers.SysLogHandler(address='/dev/log')
+logger.addHandler(handler)
+
+
+def parse_options(options, description=None, usage=None, version=None,
+        defaults=None):
+    parser = optparse.OptionParser(description=description, usage=usage,
+                                   version=version)
+    for keyname, description in options.items():
+        longopt = '--%s' % keyname
+        parser.add_option(longopt, dest=keyname, help=description)
+    option_args, _ = parser.parse_args()
+    arguments = {}
+    for keyname in options.keys():
+        arguments[keyname] = eval("option_args.%s" % keyname)
+    if defaults:
+        for k, v in arguments.items():
+            if (not v) and (k in defaults):
+                arguments[k] = defaults[k]
+    return arguments
+
+
+def validate_arguments(arguments):
+    try:
+        arguments['heartbeat'] = float(arguments['heartbeat'])
+        if arguments['heartbeat'] <= 0:
+            raise ValueError()
+    except ValueError:
+        print "Option --heartbeat invalid. Value %s must be a positive" \
+            " number" % arguments['heartbeat']
+        sys.exit(1)
+
+
+def iso_to_epoch(iso_time):
+    iso_time = iso_time.split('.')[0].rstrip('Z')
+    return calendar.timegm(time.strptime(iso_time, "%Y-%m-%dT%H:%M:%S"))
+
+
+class ContainerSnapshot(object):
+    """
+    Running containers indexed by container id. Written to disk grouped per
+    image: {"updated": epoch, "images": {image: {id: [created, started]}}}
+    Nothing is written while out of sync with the daemon, so the snapshot on
+    disk goes stale & readers fall back to the docker API.
+    Every event change gets a sequence number, so a resync listing taken
+    before a change doesn't undo it.
+    """
+    def __init__(self, snapshot_file):
+        self.snapshot_file = snapshot_file
+        self.containers = {}
+        self.synced = False
+        self.lock = threading.Lock()
+        self.sequence = 0
+        # Container id -> (sequence, container or None if removed), of
+        # changes not older than the listing of the last resync
+        self.changes = {}
+        self.listed_sequence = 0
+
+    def add(self, container_id, image, created, started):
+        with self.lock:
+            self.sequence += 1
+            self.containers[container_id] = (image, created, started)
+            self.changes[container_id] = (self.sequence,
+                                          self.containers[container_id])
+
+    def remove(self, container_id):
+        with self.lock:
+            self.sequence += 1
+            self.containers.pop(container_id, None)
+            self.changes[container_id] = (self.sequence, None)
+
+    def replace(self, containers, sequence):
+        """
+        Replace containers by a listing taken at sequence, keeping changes
+        made since. Ignored if a later listing was applied already
+        """
+        with self.lock:
+            if sequence < self.listed_sequence:
+                return
+            changes = {}
+            for cid, (change_sequence, container) in self.changes.items():
+                if change_sequence <= sequence:
+                    continue
+                changes[cid] = (change_sequence, container)
+                if container is None:
+                    containers.pop(cid, None)
+                else:
+                    containers[cid] = container
+            self.containers = containers
+            self.changes = changes
+            self.listed_sequence = sequence
+            self.synced = True
+
+    def known(self):
+        """Returns a tuple: (containers, sequence of the last change)"""
+        with self.lock:
+            return (dict(self.containers), self.sequence)
+
+    def invalidate(self):
+        with self.lock:
+            self.synced = False
+
+    def write(self):
+        with self.lock:
+            if not self.synced:
+                return
+            images = {}
+            for cid, (image, created, started) in self.containers.items():
+                images.setdefault(image, {})[cid] = [created, started]
+            data = {'updated': int(time.time()), 'images': images}
+            fd, temp_file = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.snapshot_file)),
+                prefix='.docker_container_snapshot.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.chmod(temp_file, 0644)
+            # Atomic replace, readers never see a partial snapshot
+            os.rename(temp_file, self.snapshot_file)
+
+
+def inspect_times(dclient, container_id):
+    details = dclient.inspect_container(container_id)
+    return (details['Config']['Image'], iso_to_epoch(details['Created']),
+            iso_to_epoch(details['State']['StartedAt']))
+
+
+def sync_containers(dclient, snapshot):
+    """
+    Resync running containers with the daemon & write the snapshot. Start
+    times are only available through inspect, so only containers not in the
+    snapshot yet are inspected
+    """
+    known, sequence = snapshot.known()
+    containers = {}
+    for container_details in dclient.containers():
+        cid = container_details['Id']
+        if cid in known:
+            containers[cid] = known[cid]
+            continue
+        try:
+            image, created, started = inspect_times(dclient, cid)
+        except docker.errors.APIError:
+            # Container is already gone
+            continue
+        containers[cid] = (container_details['Image'], created, started)
+    snapshot.replace(containers, sequence)
+    snapshot.write()
+
+
+def handle_event(dclient, snapshot, event):
+    if isinstance(event, basestring):
+        event = json.loads(event)
+    if event.get('Type', 'container') != 'container':
+        # The stream is alive
+        snapshot.write()
+        return
+    status = event.get('status') or event.get('Action')
+    cid = event.get('id')
+    if not cid:
+        snapshot.write()
+        return
+    if status == 'start':
+        try:
+            image, created, started = inspect_times(dclient, cid)
+        except docker.errors.APIError:
+            # Container is already gone
+            return
+        snapshot.add(cid, event.get('from') or image, created, started)
+        snapshot.write()
+    elif status in STOP_EVENTS:
+        snapshot.remove(cid)
+        snapshot.write()
+    else:
+        snapshot.write()
+
+
+def heartbeat(snapshot, interval):
+    """
+    The snapshot is only marked fresh by a successful resync, never just
+    rewritten, so it goes stale while the daemon is unreachable even if the
+    event stream hangs
+    """
+    dclient = None
+    while True:
+        time.sleep(interval)
+        try:
+            if dclient is None:
+                dclient = docker.Client()
+            sync_containers(dclient, snapshot)
+        except Exception as e:
+            dclient = None
+            logger.warning("Docker container watcher: Heartbeat resync"
+                           " failed: %s" % e)
+
+
+def watch(snapshot):
+    while True:
+        try:
+            dclient = docker.Client()
+            # Subscribe from before the resync so no event is missed
+            since = int(time.time())
+            sync_containers(dclient, snapshot)
+            for event in dclient.events(since=since):
+                handle_event(dclient, snapshot, event)
+        except Exception as e:
+            snapshot.invalidate()
+            logger.warning("Docker container watcher: Event stream failed:"
+                           " %s. Reconnecting" % e)
+        time.sleep(RECONNECT_INTERVAL)
+
+
+def run():
+    arguments = parse_options(OPTIONS, DESCRIPTION, USAGE, VERSION, DEFAULTS)
+    validate_arguments(arguments)
+    snapshot = ContainerSnapshot(arguments['snapshot_file'])
+    thread = threading.Thread(target=heartbeat,
+                              args=(snapshot, arguments['heartbeat']))
+    thread.daemon = True
+    thread.start()
+    watch(snapshot)
+
+
+if __name__ == '__main__':
+    logger.info("Docker container watcher: Started")
+    run()
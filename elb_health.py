@@ -4,13 +4,28 @@
 # Author: Rohit Gupta - @rohit01
 #
 
-import boto
-import boto.ec2
-import boto.ec2.elb
+import instrumentation
+with instrumentation.phase('import'):
+    import boto
+    import boto.ec2
+    import boto.ec2.elb
 import sys
 import os
+import re
+import json
+import time
+import errno
+import fcntl
+import stat
+import struct
+import tempfile
+import fnmatch
+import collections
 import logging
+import logging.handlers
 import optparse
+import threading
+import Queue
 
 
 __version__ = 0.1
@@ -19,13 +34,45 @@ DESCRIPTION = """Nagios plugin for monitor ELB instance health count"""
 OPTIONS = {
     "aws_access_key"    : "AWS access key",
     "aws_secret_access" : "AWS secret key",
-    "loadbalancer"      : "AWS Elastic Load Balancer name to be checked",
+    "loadbalancer"      : "AWS Elastic Load Balancer name to be checked." \
+        " Comma separated names or glob patterns check many load balancers" \
+        " in one batch",
     "region"            : "AWS region name in which load balancer is hosted. Default: us-east-1",
     "warning"           : "Health warning level (in %). Default: 99",
     "critical"          : "Health critical level (in %). Default: 50",
     "warningcount"      : "Healthy instance count warning level. Default: 1",
     "criticalcount"     : "Healthy instance count critical level. Default: 0",
+    "workers"           : "Load balancers whose instance health is fetched" \
+        " in parallel in batch mode. Default: 10",
+    "cache_ttl"         : "Seconds for which AWS API results are cached on" \
+        " disk & shared by all checks. 0 disables the cache. Default: 0",
+    "cache_dir"         : "Directory for cached AWS API results, created" \
+        " 0700 if missing & must be owned by the check's user. Default:" \
+        " /var/tmp/elb_health_cache",
+    "history_size"      : "Number of runs of per instance health history" \
+        " kept per ELB for flap detection. 0 disables it. Default: 0",
+    "history_dir"       : "Directory for health history files, created" \
+        " 0700 if missing & must be owned by the check's user. Default:" \
+        " /var/tmp/elb_health_history",
+    "flapwarning"       : "Instance flap rate warning level (in % of state" \
+        " changes in history). Default: 20",
+    "flapcritical"      : "Instance flap rate critical level (in % of state" \
+        " changes in history). Default: 50",
+    "flap_min_samples"  : "Samples of an instance needed in history before" \
+        " its flap rate is checked. Default: half of history_size, at least 2",
+    "statewarning"      : "Instance time in state warning level (in" \
+        " seconds). Alerts if an instance changed state less than this long" \
+        " ago. Default: 0, disabled",
+    "statecritical"     : "Instance time in state critical level (in" \
+        " seconds). Alerts if an instance changed state less than this long" \
+        " ago. Default: 0, disabled",
+    "profile"           : "Write a cProfile dump & JSON phase timing report" \
+        " of this run in profile_dir",
+    "profile_dir"       : "Directory for profiles. Default:" \
+        " /var/tmp/nrpe_plugin_profiles",
 }
+# Options without value
+FLAG_OPTIONS = ['profile']
 USAGE = "%s --aws_access_key=<value> --aws_secret_access=<value> " \
     "--loadbalancer=<value> [other options]"  % os.path.basename(__file__)
 
@@ -35,6 +82,18 @@ DEFAULTS = {
     "critical"      : 50,
     "warningcount"  : 1,
     "criticalcount" : 0,
+    "workers"       : 10,
+    "cache_ttl"     : 0,
+    "cache_dir"     : '/var/tmp/elb_health_cache',
+    "history_size"  : 0,
+    "history_dir"   : '/var/tmp/elb_health_history',
+    "flapwarning"   : 20,
+    "flapcritical"  : 50,
+    "flap_min_samples" : None,
+    "statewarning"  : 0,
+    "statecritical" : 0,
+    "profile"       : False,
+    "profile_dir"   : instrumentation.PROFILE_DIR,
 }
 
 # Global variables
@@ -46,6 +105,13 @@ exit_status = ST_OK
 reason_for_alert_list = []
 health_states = {}
 DISPLAY_KEY_ORDER = ['Total', 'InService']
+# AWS API error codes for which stale cached data is served
+THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException',
+                          'RequestLimitExceeded']
+InstanceHealth = collections.namedtuple('InstanceHealth', 'instance_id state')
+# Instance health states as stored in history files. 0 is no sample
+STATE_CODES = {'InService': 1, 'OutOfService': 2}
+STATE_UNKNOWN = 3
 logger = logging.getLogger("ELB health check")
 logger.setLevel(logging.WARNING)
 # Logging in syslog (/var/log/syslog)
@@ -59,7 +125,11 @@ def parse_options(options, description=None, usage=None, version=None,
                                    version=version)
     for keyname, description in options.items():
         longopt = '--%s' % keyname
-        parser.add_option(longopt, dest=keyname, help=description)
+        if keyname in FLAG_OPTIONS:
+            parser.add_option(longopt, dest=keyname, action='store_true',
+                              help=description)
+        else:
+            parser.add_option(longopt, dest=keyname, help=description)
     option_args, _ = parser.parse_args()
     arguments = {}
     for keyname in options.keys():
@@ -79,7 +149,12 @@ def validate_arguments(arguments=None):
                 " details" % k
             exit_formalalities(message, ST_UK)
     # Integer arguments
-    for key in 'warning', 'critical', 'warningcount', 'criticalcount':
+    for key in 'warning', 'critical', 'warningcount', 'criticalcount', \
+            'workers', 'cache_ttl', 'history_size', 'flapwarning', \
+            'flapcritical', 'flap_min_samples', 'statewarning', \
+            'statecritical':
+        if arguments[key] is None:
+            continue
         try:
             arguments[key] = int(arguments[key])
             if arguments[key] < 0:
@@ -88,6 +163,10 @@ def validate_arguments(arguments=None):
             message = "Option --%s invalid. Value %s must be a positive " \
                 "integer" % (key, arguments[key])
             exit_formalalities(message, ST_UK)
+    if arguments["workers"] < 1:
+        message = "option --workers(%s) must be at least 1" \
+             % arguments["workers"]
+        exit_formalalities(message, ST_UK)
     if arguments["warning"] < arguments["critical"]:
         message = "option --warning(%s) must be greater than --critical(%s)" \
              % (arguments["warning"], arguments["critical"])
@@ -96,6 +175,30 @@ def validate_arguments(arguments=None):
         message = "option --warningcount(%s) must be greater than --criticalcount(%s)" \
              % (arguments["warningcount"], arguments["criticalcount"])
         exit_formalalities(message, ST_UK)
+    if arguments["flapwarning"] > arguments["flapcritical"]:
+        message = "option --flapcritical(%s) must be greater than --flapwarning(%s)" \
+             % (arguments["flapcritical"], arguments["flapwarning"])
+        exit_formalalities(message, ST_UK)
+    if arguments["statecritical"] > arguments["statewarning"] > 0:
+        message = "option --statewarning(%s) must be greater than --statecritical(%s)" \
+             % (arguments["statewarning"], arguments["statecritical"])
+        exit_formalalities(message, ST_UK)
+    if arguments["history_size"] > 65535:
+        message = "option --history_size(%s) must be less than 65536" \
+             % arguments["history_size"]
+        exit_formalalities(message, ST_UK)
+    if arguments["flap_min_samples"] is None:
+        arguments["flap_min_samples"] = max(arguments["history_size"] // 2, 2)
+    for key, enabled in (("cache_dir", arguments["cache_ttl"] > 0),
+                         ("history_dir", arguments["history_size"] > 0)):
+        if not enabled:
+            continue
+        try:
+            prepare_private_dir(arguments[key])
+        except OSError as e:
+            message = "option --%s(%s) unusable: %s" % (key, arguments[key],
+                                                       e.strerror)
+            exit_formalalities(message, ST_UK)
 
 
 def exit_formalalities(message, exit_status):
@@ -103,6 +206,7 @@ def exit_formalalities(message, exit_status):
     sys.exit(exit_status)
 
 
+@instrumentation.timed
 def get_elb_connection(region, aws_access_key, aws_secret_access):
     try:
         conn = boto.ec2.elb.connect_to_region(
@@ -117,6 +221,7 @@ def get_elb_connection(region, aws_access_key, aws_secret_access):
     return conn
 
 
+@instrumentation.timed
 def fetch_load_balancer(arguments):
     conn = get_elb_connection(arguments['region'],arguments['aws_access_key'],
         arguments['aws_secret_access'])
@@ -125,59 +230,471 @@ def fetch_load_balancer(arguments):
             load_balancer_names=[arguments['loadbalancer']])
         return elb_list[0]
     except boto.exception.BotoServerError as e:
+        if is_throttling(e):
+            raise
         message = "Exception occured while fetching AWS ELB: %s, region: %s." \
             " Message: %s" % (arguments['loadbalancer'], arguments['region'], e.message)
         exit_formalalities(message, ST_CR)
 
 
-def calculate_exit_status(elb_object, arguments):
-    global exit_status
-    global health_states
-    health_list = elb_object.get_instance_health()
+def is_throttling(error):
+    return isinstance(error, boto.exception.BotoServerError) and \
+        (error.error_code in THROTTLING_ERROR_CODES or error.status == 503)
+
+
+def read_cache(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def prepare_private_dir(path):
+    """
+    Create a cache or history directory 0700 if missing. Refuse a directory
+    of another user or writable by others, who could plant cached health or
+    history in it
+    """
+    try:
+        os.makedirs(path, 0700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    dir_stat = os.lstat(path)
+    if not stat.S_ISDIR(dir_stat.st_mode) or \
+            dir_stat.st_uid != os.getuid() or \
+            dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise OSError(errno.EPERM, "Directory %s must be owned by uid %s &"
+                      " not writable by group or others"
+                      % (path, os.getuid()))
+
+
+def write_atomic(path, data):
+    """Replace path with data through a temp file in the same directory"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def open_lock(path):
+    """Lock file opened for flock(), never through a symlink"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0600)
+    return os.fdopen(fd, 'w')
+
+
+def write_cache(path, value):
+    write_atomic(path, json.dumps({'time': time.time(), 'value': value}))
+
+
+def cached_call(arguments, kind, name, fetch):
+    """
+    Return the result of fetch() through an on-disk cache shared by all
+    checks, keyed by region, kind & name. Only one process refreshes an
+    expired key at a time, the others wait on its lock & read the refreshed
+    value. If AWS throttles the refresh, the expired value is served.
+    Returns a tuple: (value, age in seconds if stale else None)
+    """
+    if arguments['cache_ttl'] <= 0:
+        return (fetch(), None)
+    filename = re.sub(r'[^A-Za-z0-9_.-]', '_', '%s_%s_%s' % (
+        arguments['region'], kind, name))
+    path = os.path.join(arguments['cache_dir'], '%s.json' % filename)
+    entry = read_cache(path)
+    if entry and time.time() - entry['time'] < arguments['cache_ttl']:
+        return (entry['value'], None)
+    with open_lock('%s.lock' % path) as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Another process may have refreshed it while we waited
+            entry = read_cache(path)
+            if entry and time.time() - entry['time'] < arguments['cache_ttl']:
+                return (entry['value'], None)
+            try:
+                value = fetch()
+            except boto.exception.BotoServerError as e:
+                if entry and is_throttling(e):
+                    logger.warning("ELB health check: AWS API throttled,"
+                                   " serving stale %s of %s" % (kind, name))
+                    return (entry['value'], int(time.time() - entry['time']))
+                raise
+            write_cache(path, value)
+            return (value, None)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@instrumentation.timed
+def get_instance_health(arguments, name, conn=None):
+    """
+    Instance health of a load balancer, through the cache if enabled.
+    Returns a tuple: (list of InstanceHealth, age in seconds if stale)
+    """
+    def fetch():
+        if conn is None:
+            elb = fetch_load_balancer(arguments)
+            with instrumentation.phase('describe_instance_health'):
+                health_list = elb.get_instance_health()
+        else:
+            with instrumentation.phase('describe_instance_health'):
+                health_list = conn.describe_instance_health(name)
+        return [(h.instance_id, str(h.state).strip()) for h in health_list]
+    value, stale_age = cached_call(arguments, 'health', name, fetch)
+    return ([InstanceHealth(*h) for h in value], stale_age)
+
+
+class HealthHistory(object):
+    """
+    Fixed size ring buffer of per instance health states of one ELB, one
+    slot per run, kept in a compact binary file:
+      header: magic, version, capacity, filled slots, next slot, instances
+      slot timestamps: capacity x uint32
+      per instance: 20 byte instance id + capacity x uint8 state codes
+    """
+    MAGIC = 'ELBH'
+    VERSION = 1
+    HEADER = struct.Struct('!4sBHHHH')
+    ID_SIZE = 20
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        self.head = 0
+        self.timestamps = [0] * capacity
+        self.states = collections.OrderedDict()
+
+    @classmethod
+    def load(cls, path, capacity):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return cls(capacity)
+        try:
+            return cls.parse(data, capacity)
+        except struct.error:
+            # Truncated file, after a crash or with the disk full
+            return cls(capacity)
+
+    @classmethod
+    def parse(cls, data, capacity):
+        history = cls(capacity)
+        magic, version, file_capacity, count, head, rows = \
+            cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION or \
+                file_capacity != capacity or count > capacity or \
+                head >= capacity:
+            # Incompatible or resized history, start afresh
+            return history
+        offset = cls.HEADER.size
+        timestamps = list(struct.unpack_from('!%dI' % capacity, data, offset))
+        offset += 4 * capacity
+        row_format = struct.Struct('!%ds%ds' % (cls.ID_SIZE, capacity))
+        for i in xrange(rows):
+            instance_id, states = row_format.unpack_from(data, offset)
+            offset += row_format.size
+            history.states[instance_id.rstrip('\0')] = bytearray(states)
+        history.count, history.head = count, head
+        history.timestamps = timestamps
+        return history
+
+    def save(self, path):
+        row_format = struct.Struct('!%ds%ds' % (self.ID_SIZE, self.capacity))
+        chunks = [self.HEADER.pack(self.MAGIC, self.VERSION, self.capacity,
+                                   self.count, self.head, len(self.states)),
+                  struct.pack('!%dI' % self.capacity, *self.timestamps)]
+        for instance_id, states in self.states.items():
+            chunks.append(row_format.pack(instance_id, str(states)))
+        write_atomic(path, ''.join(chunks))
+
+    def append(self, timestamp, health_list):
+        slot = self.head
+        self.timestamps[slot] = int(timestamp)
+        for states in self.states.values():
+            states[slot] = 0
+        for health in health_list:
+            states = self.states.get(health.instance_id)
+            if states is None:
+                states = bytearray(self.capacity)
+                self.states[health.instance_id] = states
+            states[slot] = STATE_CODES.get(health.state, STATE_UNKNOWN)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        # Forget instances without any sample left in history
+        for instance_id, states in self.states.items():
+            if not any(states):
+                del self.states[instance_id]
+
+    def slots(self):
+        """Filled slot indexes, oldest first"""
+        start = (self.head - self.count) % self.capacity
+        return [(start + i) % self.capacity for i in xrange(self.count)]
+
+    def flap_stats(self, now):
+        """
+        Per instance flap rate (% of consecutive samples with a state change)
+        & seconds spent in the current state, at least.
+        Returns a dict: {instance id: (flap rate, time in state, samples)}
+        """
+        slots = self.slots()
+        stats = {}
+        for instance_id, states in self.states.items():
+            samples = [(self.timestamps[i], states[i]) for i in slots
+                       if states[i]]
+            if not samples:
+                continue
+            changes = 0
+            state_since = samples[0][0]
+            for (_, previous), (timestamp, current) in zip(samples,
+                                                           samples[1:]):
+                if current != previous:
+                    changes += 1
+                    state_since = timestamp
+            if len(samples) > 1:
+                flap_rate = changes * 100.0 / (len(samples) - 1)
+            else:
+                flap_rate = 0.0
+            stats[instance_id] = (flap_rate, int(now - state_since),
+                                  len(samples))
+        return stats
+
+
+@instrumentation.timed
+def evaluate_flapping(arguments, name, health_list, stale_age=None):
+    """
+    Record current instance health in the ELB history & check per instance
+    flap rates, once an instance has flap_min_samples, & time in state after
+    a state change. Stale data is not recorded.
+    Returns a tuple: (exit status, reasons for alert, perf data)
+    """
+    filename = re.sub(r'[^A-Za-z0-9_.-]', '_', '%s_%s' % (
+        arguments['region'], name))
+    path = os.path.join(arguments['history_dir'], '%s.hist' % filename)
+    now = time.time()
+    with open_lock('%s.lock' % path) as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            history = HealthHistory.load(path, arguments['history_size'])
+            if stale_age is None:
+                history.append(now, health_list)
+                history.save(path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    current = set(health.instance_id for health in health_list)
+    stats = dict((k, v) for k, v in history.flap_stats(now).items()
+                 if k in current)
+    status = ST_OK
+    reasons = []
+    flapping = 0
+    for instance_id in sorted(stats):
+        flap_rate, time_in_state, samples = stats[instance_id]
+        # Too few samples of new instances to tell flapping
+        checked = samples >= arguments['flap_min_samples']
+        if checked and flap_rate >= arguments['flapcritical']:
+            status = ST_CR
+            flapping += 1
+            reasons.append('%s flapping %.0f%% (CR)' % (instance_id, flap_rate))
+        elif checked and flap_rate >= arguments['flapwarning']:
+            if status == ST_OK:
+                status = ST_WR
+            flapping += 1
+            reasons.append('%s flapping %.0f%% (WR)' % (instance_id, flap_rate))
+        # Without a state change in history, an instance may have been in
+        # its state for longer
+        if flap_rate == 0:
+            continue
+        if time_in_state < arguments['statecritical']:
+            status = ST_CR
+            reasons.append('%s changed state %ss ago (CR)'
+                           % (instance_id, time_in_state))
+        elif time_in_state < arguments['statewarning']:
+            if status == ST_OK:
+                status = ST_WR
+            reasons.append('%s changed state %ss ago (WR)'
+                           % (instance_id, time_in_state))
+    max_flap_rate = max([v[0] for v in stats.values()
+                         if v[2] >= arguments['flap_min_samples']] or [0])
+    min_time_in_state = min([v[1] for v in stats.values()] or [0])
+    # Thresholds as nagios ranges, alerting below the level
+    state_thresholds = ['%s:' % arguments[k] if arguments[k] else ''
+                        for k in ('statewarning', 'statecritical')]
+    if name == arguments['loadbalancer']:
+        prefix = ''
+    else:
+        prefix = '%s_' % name
+    perf_data = "'%sflap_rate'=%.1f%%;%s;%s '%sflapping'=%s '%stime_in_state'=%ss;%s;%s" \
+        % (prefix, max_flap_rate, arguments['flapwarning'],
+           arguments['flapcritical'], prefix, flapping, prefix,
+           min_time_in_state, state_thresholds[0], state_thresholds[1])
+    return (status, reasons, perf_data)
+
+
+def stale_reason(stale_age):
+    return 'AWS API throttled, using data from %ss ago (WR)' % stale_age
+
+
+@instrumentation.timed
+def evaluate_health(health_list, arguments, status=ST_OK):
+    """
+    Count instance health states & check them against thresholds.
+    Returns a tuple: (exit status, health states, reasons for alert)
+    """
+    states = {}
+    reasons = []
     for instance_health in health_list:
         key = str(instance_health.state).strip()
         try:
-            health_states[key] += 1
+            states[key] += 1
         except KeyError:
-            health_states[key] = 1
-    if 'InService' not in health_states:
-        health_states['InService'] = 0
+            states[key] = 1
+    if 'InService' not in states:
+        states['InService'] = 0
     total = len(health_list)
-    health_states['Total'] = total
-    healthy_count = health_states['InService']
+    states['Total'] = total
+    healthy_count = states['InService']
     if total == 0:
         healthy_percentage = 0
     else:
         healthy_percentage = float(healthy_count) * 100.0 / float(total)
     if healthy_percentage <= arguments['critical']:
-        exit_status = ST_CR
+        status = ST_CR
         message = 'InService count <= %s%% (CR)' % arguments['critical']
-        reason_for_alert_list.append(message)
+        reasons.append(message)
     elif healthy_percentage <= arguments['warning']:
-        if exit_status == ST_OK or exit_status == ST_UK:
-            exit_status = ST_WR
+        if status == ST_OK or status == ST_UK:
+            status = ST_WR
         message = 'InService count <= %s%% (WR)' % arguments['warning']
-        reason_for_alert_list.append(message)
+        reasons.append(message)
     if healthy_count <= arguments['criticalcount']:
-        exit_status = ST_CR
+        status = ST_CR
         message = 'InService count <= %s(CR)' % arguments['criticalcount']
-        reason_for_alert_list.append(message)
+        reasons.append(message)
     elif healthy_count <= arguments['warningcount']:
+        if status == ST_OK or status == ST_UK:
+            status = ST_WR
+        message = 'InService count <= %s(WR)' % arguments['warningcount']
+        reasons.append(message)
+    return (status, states, reasons)
+
+
+def calculate_exit_status(health_list, arguments, stale_age=None):
+    global exit_status
+    global health_states
+    exit_status, health_states, reasons = evaluate_health(
+        health_list, arguments, status=exit_status)
+    reason_for_alert_list.extend(reasons)
+    if stale_age is not None:
         if exit_status == ST_OK or exit_status == ST_UK:
             exit_status = ST_WR
-        message = 'InService count <= %s(WR)' % arguments['warningcount']
-        reason_for_alert_list.append(message)
+        reason_for_alert_list.append(stale_reason(stale_age))
+
+
+def calculate_flap_status(health_list, arguments, stale_age=None):
+    global exit_status
+    flap_status, reasons, perf_data = evaluate_flapping(
+        arguments, arguments['loadbalancer'], health_list, stale_age)
+    if flap_status == ST_CR:
+        exit_status = ST_CR
+    elif flap_status == ST_WR:
+        if exit_status == ST_OK or exit_status == ST_UK:
+            exit_status = ST_WR
+    reason_for_alert_list.extend(reasons)
+    return perf_data
+
+
+def is_batch(loadbalancer):
+    return any(c in loadbalancer for c in ',*?[')
+
 
+@instrumentation.timed
+def fetch_load_balancer_names(arguments, patterns):
+    """
+    Fetch all load balancers in the region, following pagination, and
+    select the ones matching any of the names or glob patterns.
+    Returns a tuple: (load balancer names, age in seconds if stale)
+    """
+    def fetch():
+        conn = get_elb_connection(arguments['region'],
+            arguments['aws_access_key'], arguments['aws_secret_access'])
+        elb_names = []
+        marker = None
+        while True:
+            result = conn.get_all_load_balancers(marker=marker)
+            elb_names.extend(elb.name for elb in result)
+            marker = getattr(result, 'next_marker', None)
+            if not marker:
+                break
+        return elb_names
+    elb_names, stale_age = cached_call(arguments, 'loadbalancers', 'all',
+                                       fetch)
+    elb_names = [name for name in elb_names
+                 if any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+    return (elb_names, stale_age)
 
-def formatted_message():
+
+@instrumentation.timed
+def fetch_instance_health(arguments, elb_names):
+    """
+    Fetch instance health of many load balancers in parallel using a
+    bounded pool of worker threads, each with its own ELB connection.
+    Returns a dict of load balancer name to get_instance_health() result or
+    exception
+    """
+    pending = Queue.Queue()
+    for name in elb_names:
+        pending.put(name)
+    results = {}
+    results_lock = threading.Lock()
+
+    def worker():
+        conn = None
+        while True:
+            try:
+                name = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                if conn is None:
+                    conn = boto.ec2.elb.connect_to_region(
+                        region_name=arguments['region'],
+                        aws_access_key_id=arguments['aws_access_key'],
+                        aws_secret_access_key=arguments['aws_secret_access'])
+                result = get_instance_health(arguments, name, conn=conn)
+            except Exception as e:
+                result = e
+            with results_lock:
+                results[name] = result
+
+    threads = []
+    for i in xrange(min(arguments['workers'], len(elb_names))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def formatted_message(states=None):
+    if states is None:
+        states = health_states
     message = ''
     key_checked = []
-    for key in DISPLAY_KEY_ORDER + health_states.keys():
+    for key in DISPLAY_KEY_ORDER + states.keys():
         if key in key_checked:
             continue
         key_checked.append(key)
         try:
-            value = health_states[key]
+            value = states[key]
         except KeyError:
             continue
         if message != '':
@@ -187,27 +704,106 @@ def formatted_message():
     return message
 
 
-def calc_perf_data(arguments):
-    inservice = health_states['InService']
-    total = health_states['Total'] 
+def calc_perf_data(arguments, states=None, label='inservice'):
+    if states is None:
+        states = health_states
+    inservice = states['InService']
+    total = states['Total']
     if total == 0:
         inservice_percent = 0
     else:
         inservice_percent = float(inservice) * 100.0 / float(total)
-    data = "inservice=%s%%;%s;%s" % (
-        inservice_percent, arguments['warning'], arguments['critical']
+    data = "%s=%s%%;%s;%s" % (
+        label, inservice_percent, arguments['warning'], arguments['critical']
     )
     return data
 
 
+def run_batch(arguments):
+    """
+    Check many load balancers in one run. The first output line summarizes
+    all of them with per load balancer perfdata, followed by one line per
+    load balancer as long output
+    """
+    patterns = [p.strip() for p in arguments['loadbalancer'].split(',')
+                if p.strip()]
+    elb_names, list_stale_age = fetch_load_balancer_names(arguments, patterns)
+    if not elb_names:
+        message = "No AWS ELB found matching: %s, region: %s" % (
+            arguments['loadbalancer'], arguments['region'])
+        exit_formalalities(message, ST_CR)
+    elb_names = sorted(elb_names)
+    health_results = fetch_instance_health(arguments, elb_names)
+    status_text = {ST_OK: 'OK', ST_WR: 'WARNING', ST_CR: 'CRITICAL',
+                   ST_UK: 'UNKNOWN'}
+    batch_status = ST_OK
+    status_count = dict((status, 0) for status in status_text)
+    perf_data = []
+    details = []
+    for name in elb_names:
+        result = health_results.get(name)
+        if isinstance(result, tuple):
+            health_list, stale_age = result
+            status, states, reasons = evaluate_health(health_list, arguments)
+            if stale_age is not None:
+                if status == ST_OK:
+                    status = ST_WR
+                reasons.append(stale_reason(stale_age))
+            if arguments['history_size'] > 0:
+                flap_status, flap_reasons, flap_perf = evaluate_flapping(
+                    arguments, name, health_list, stale_age)
+                if flap_status == ST_CR or \
+                        (flap_status == ST_WR and status == ST_OK):
+                    status = flap_status
+                reasons.extend(flap_reasons)
+                perf_data.append(flap_perf)
+            perf_data.append(calc_perf_data(arguments, states,
+                                            label="'%s_inservice'" % name))
+            perf_data.append("'%s_total'=%s" % (name, states['Total']))
+            line = "%s: %s - %s" % (name, status_text[status],
+                                    formatted_message(states))
+            if reasons:
+                line = "%s. Reason: %s" % (line, ', '.join(reasons))
+        else:
+            status = ST_CR
+            line = "%s: CRITICAL - Exception occured: %s" % (
+                name, ' '.join(str(result).split()))
+        status_count[status] += 1
+        if status == ST_CR or (status == ST_WR and batch_status != ST_CR):
+            batch_status = status
+        details.append(line)
+    summary = ', '.join("%s %s" % (status_count[status], status_text[status])
+                        for status in (ST_OK, ST_WR, ST_CR)
+                        if status_count[status])
+    if list_stale_age is not None:
+        if batch_status == ST_OK:
+            batch_status = ST_WR
+        summary = "%s. Load balancer list: %s" % (summary,
+                                                  stale_reason(list_stale_age))
+    message = "%s - ELBs: %s checked, %s | %s\n%s" % (
+        status_text[batch_status], len(elb_names), summary,
+        instrumentation.perf_data(' '.join(perf_data)), '\n'.join(details))
+    exit_formalalities(message, exit_status=batch_status)
+
+
 def run():
     try:
         arguments = parse_options(OPTIONS, DESCRIPTION, USAGE, VERSION, DEFAULTS)
         validate_arguments(arguments=arguments)
-        elb_object = fetch_load_balancer(arguments)
-        calculate_exit_status(elb_object, arguments)
+        if arguments['profile']:
+            instrumentation.start_profile('elb_health',
+                                          arguments['profile_dir'])
+        if is_batch(arguments['loadbalancer']):
+            run_batch(arguments)
+        health_list, stale_age = get_instance_health(
+            arguments, arguments['loadbalancer'])
+        calculate_exit_status(health_list, arguments, stale_age)
         current_status = formatted_message()
         perf_data = calc_perf_data(arguments)
+        if arguments['history_size'] > 0:
+            flap_perf = calculate_flap_status(health_list, arguments, stale_age)
+            perf_data = '%s %s' % (perf_data, flap_perf)
+        perf_data = instrumentation.perf_data(perf_data)
         if len(reason_for_alert_list) > 0:
             alert_reason = ', '.join(reason_for_alert_list)
             alert_reason = '. Reason: %s' % alert_reason
@@ -234,6 +830,8 @@ def run():
         message = "Exception occured - %s" % e.message
         logger.critical("ELB health check: %s" % message)
         exit_formalalities(message, exit_status=ST_CR)
+    finally:
+        instrumentation.stop_profile()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#
+# Runs a FreeSWITCH api command like 'fs_cli -q -x <command>' for the
+# freeswitch checks. The output is served from the snapshot kept by
+# freeswitch_collector.py over its persistent event socket connection. Only
+# if the snapshot is missing, stale or lacks the command, an event socket
+# session is opened for the command.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import stat
+import time
+import socket
+from optparse import OptionParser
+
+
+__version__ = 1.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+OPTIONS = {
+    'x': "command;FreeSWITCH api command to run. For eg: 'show channels" \
+         " count'",
+    'H': "host;Event socket host. Default: 127.0.0.1",
+    'P': "port;Event socket port. Default: 8021",
+    'p': "password;Event socket password. Default: ClueCon",
+    't': "timeout;Timeout in milliseconds. Default: 2000",
+    's': "snapshot_file;Snapshot file kept up to date by" \
+         " freeswitch_collector.py. Only used if owned by root or this user," \
+         " in a directory not writable by others. Default:" \
+         " /var/run/freeswitch-collector/freeswitch_snapshot.json",
+    'm': "snapshot_max_age;Max age of snapshot file in seconds, beyond" \
+         " which the command is run over a new connection. Default: 30",
+}
+DEFAULTS = {
+    'host': '127.0.0.1',
+    'port': '8021',
+    'password': 'ClueCon',
+    'timeout': '2000',
+    'snapshot_file': '/var/run/freeswitch-collector/freeswitch_snapshot.json',
+    'snapshot_max_age': '30',
+}
+TIMED_OUT = "-ERR Request timed out"
+
+
+class ESLError(Exception):
+    pass
+
+
+class ESLConnection(object):
+    """
+    Inbound FreeSWITCH event socket connection, authenticated on connect.
+    Not subscribed to events, so every reply answers the last command
+    """
+    def __init__(self, host, port, password, timeout):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.buffer = ''
+        headers, _ = self.receive()
+        if headers.get('Content-Type') != 'auth/request':
+            raise ESLError("Unexpected greeting: %s"
+                           % headers.get('Content-Type'))
+        headers, _ = self.command("auth %s" % password)
+        if not headers.get('Reply-Text', '').startswith('+OK'):
+            raise ESLError("Authentication failed: %s"
+                           % headers.get('Reply-Text'))
+
+    def read_until(self, separator):
+        while separator not in self.buffer:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ESLError("Connection closed by FreeSWITCH")
+            self.buffer += data
+        data, self.buffer = self.buffer.split(separator, 1)
+        return data
+
+    def read_bytes(self, size):
+        while len(self.buffer) < size:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ESLError("Connection closed by FreeSWITCH")
+            self.buffer += data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def receive(self):
+        """Returns a tuple: (headers dict, body) of the next message"""
+        headers = {}
+        for line in self.read_until('\n\n').split('\n'):
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip()] = value.strip()
+        body = ''
+        if 'Content-Length' in headers:
+            body = self.read_bytes(int(headers['Content-Length']))
+        return (headers, body)
+
+    def command(self, command):
+        self.sock.sendall("%s\n\n" % command)
+        while True:
+            headers, body = self.receive()
+            content_type = headers.get('Content-Type')
+            if content_type == 'text/disconnect-notice':
+                raise ESLError("Disconnected by FreeSWITCH")
+            if content_type in ('command/reply', 'api/response'):
+                return (headers, body)
+
+    def api(self, command):
+        """Output of a FreeSWITCH api command, as printed by fs_cli"""
+        headers, body = self.command("api %s" % command)
+        return body
+
+    def close(self):
+        try:
+            self.sock.sendall("exit\n\n")
+        except socket.error:
+            pass
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+def trusted_file(path):
+    """
+    True if path is a regular file owned by root or this user, in a
+    directory owned by one of them & not writable by others, so no other
+    user could have written or replaced it
+    """
+    trusted_uids = (0, os.getuid())
+    try:
+        file_stat = os.lstat(path)
+        dir_stat = os.stat(os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        return False
+    return stat.S_ISREG(file_stat.st_mode) and \
+        file_stat.st_uid in trusted_uids and \
+        not file_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and \
+        dir_stat.st_uid in trusted_uids and \
+        not dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def read_snapshot(snapshot_file, command, max_age):
+    """
+    Output of command from the snapshot written by freeswitch_collector.py.
+    Returns None if the snapshot is missing, untrusted, unreadable, stale,
+    from the future or lacks the command
+    """
+    if not trusted_file(snapshot_file):
+        return None
+    try:
+        with open(snapshot_file, 'r') as f:
+            snapshot = json.load(f)
+        age = time.time() - snapshot['updated']
+        if age < 0 or age > max_age:
+            return None
+        output = snapshot['outputs'][command]
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+    return output.encode('utf-8')
+
+
+def parse_options():
+    parser = OptionParser(version=VERSION)
+    for option, description in OPTIONS.items():
+        shortopt = '-%s' % (option)
+        longopt = '--%s' % (description.split(';')[0])
+        keyname = description.split(';')[0]
+        help = ''
+        if len(description.split(';')) > 1:
+            help = description.split(';')[1]
+        parser.add_option(shortopt, longopt, dest=keyname, help=help)
+    (options, args) = parser.parse_args()
+    arguments = {}
+    for keyname, default in DEFAULTS.items():
+        value = getattr(options, keyname)
+        if value is None or value.strip() == '':
+            value = default
+        arguments[keyname] = value
+    arguments['command'] = options.command
+    return arguments
+
+
+def run():
+    arguments = parse_options()
+    if not arguments['command']:
+        sys.stderr.write("Mandatory option -x/--command not specified\n")
+        sys.exit(1)
+    try:
+        port = int(arguments['port'])
+        timeout = float(arguments['timeout']) / 1000
+        max_age = float(arguments['snapshot_max_age'])
+    except ValueError as e:
+        sys.stderr.write("Invalid option value: %s\n" % e)
+        sys.exit(1)
+    output = read_snapshot(arguments['snapshot_file'], arguments['command'],
+                           max_age)
+    if output is None:
+        try:
+            connection = ESLConnection(arguments['host'], port,
+                                       arguments['password'], timeout)
+            try:
+                output = connection.api(arguments['command'])
+            finally:
+                connection.close()
+        except socket.timeout:
+            output = TIMED_OUT
+        except (socket.error, ESLError) as e:
+            sys.stderr.write("Event socket error: %s\n" % e)
+            sys.exit(1)
+    # fs_cli prints a newline after the api output
+    sys.stdout.write("%s\n" % output)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#
+# Long running companion of check_freeswitch.sh & freeswitch_status.sh.
+# Holds one FreeSWITCH event socket connection & refreshes an on-disk
+# snapshot of the output of all api commands used by the checks every
+# interval, so checks don't open an event socket session each. Checks read
+# it through freeswitch_api.py.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import stat
+import time
+import errno
+import socket
+import tempfile
+import optparse
+import logging
+import logging.handlers
+from freeswitch_api import ESLConnection, ESLError, DEFAULTS as API_DEFAULTS
+
+
+__version__ = 0.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+DESCRIPTION = "Keeps a snapshot of FreeSWITCH api command outputs up to date" \
+    " over a persistent event socket connection. Used by" \
+    " check_freeswitch.sh & freeswitch_status.sh through freeswitch_api.py"
+OPTIONS = {
+    "host": "Event socket host. Default: 127.0.0.1",
+    "port": "Event socket port. Default: 8021",
+    "password": "Event socket password. Default: ClueCon",
+    "timeout": "Timeout in seconds of a command. Default: 2",
+    "interval": "Interval in seconds between snapshots. Default: 10",
+    "commands": "Comma separated api commands to snapshot. Default: the" \
+        " commands used by the checks: %s" % ', '.join(
+            ["status", "show channels count", "show calls count",
+             "show channels", "ftdm list", "ftdm core calls", "g729_info",
+             "vqa show license"]),
+    "snapshot_file": "Snapshot file path. Its directory is created if" \
+        " missing & must be owned by the collector's user & not writable by" \
+        " others. Checks only trust snapshots of root or their own user, so" \
+        " run the collector as one of them. Default: %s"
+        % API_DEFAULTS['snapshot_file'],
+}
+DEFAULTS = {
+    "host": "127.0.0.1",
+    "port": 8021,
+    "password": "ClueCon",
+    "timeout": 2,
+    "interval": 10,
+    "commands": "status,show channels count,show calls count,show channels," \
+        "ftdm list,ftdm core calls,g729_info,vqa show license",
+    "snapshot_file": API_DEFAULTS['snapshot_file'],
+}
+USAGE = "%s [options]"  % os.path.basename(__file__)
+RECONNECT_INTERVAL = 5
+
+logger = logging.getLogger("FreeSWITCH collector")
+logger.setLevel(logging.INFO)
+# Logging in syslog (/var/log/syslog)
+handler = logging.handlers.SysLogHandler(address='/dev/log')
+logger.addHandler(handler)
+
+
+def parse_options(options, description=None, usage=None, version=None,
+        defaults=None):
+    parser = optparse.OptionParser(description=description, usage=usage,
+                                   version=version)
+    for keyname, description in options.items():
+        longopt = '--%s' % keyname
+        parser.add_option(longopt, dest=keyname, help=description)
+    option_args, _ = parser.parse_args()
+    arguments = {}
+    for keyname in options.keys():
+        arguments[keyname] = eval("option_args.%s" % keyname)
+    if defaults:
+        for k, v in arguments.items():
+            if (not v) and (k in defaults):
+                arguments[k] = defaults[k]
+    return arguments
+
+
+def validate_arguments(arguments):
+    for keyname in 'port', 'timeout', 'interval':
+        try:
+            arguments[keyname] = float(arguments[keyname])
+            if arguments[keyname] <= 0:
+                raise ValueError()
+        except ValueError:
+            print "Option --%s invalid. Value %s must be a positive" \
+                " number" % (keyname, arguments[keyname])
+            sys.exit(1)
+    arguments['port'] = int(arguments['port'])
+    arguments['commands'] = [c.strip() for c in
+                             arguments['commands'].split(',') if c.strip()]
+    if not arguments['commands']:
+        print "Option --commands invalid. No command given"
+        sys.exit(1)
+
+
+def prepare_snapshot_dir(snapshot_file):
+    """
+    Create the snapshot directory 0755 if missing. Exits if it is owned by
+    another user or writable by others, as checks would not trust it
+    """
+    path = os.path.dirname(os.path.abspath(snapshot_file))
+    try:
+        os.mkdir(path, 0755)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            print "Creating snapshot directory %s failed: %s" % (path, e)
+            sys.exit(1)
+    dir_stat = os.lstat(path)
+    if not stat.S_ISDIR(dir_stat.st_mode) or \
+            dir_stat.st_uid != os.getuid() or \
+            dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        print "Snapshot directory %s must be owned by uid %s & not writable" \
+            " by group or others" % (path, os.getuid())
+        sys.exit(1)
+
+
+def write_snapshot(snapshot_file, outputs):
+    data = {'updated': int(time.time()), 'outputs': outputs}
+    fd, temp_file = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(snapshot_file)),
+        prefix='.freeswitch_snapshot.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        # Readable by checks running as another user
+        os.chmod(temp_file, 0644)
+        # Atomic replace, readers never see a partial snapshot
+        os.rename(temp_file, snapshot_file)
+    except (IOError, OSError):
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+        raise
+
+
+def collect(arguments):
+    """
+    Snapshot all commands every interval over one connection. After a
+    failure nothing is written until reconnected, so the snapshot on disk
+    goes stale & readers fall back to their own connection
+    """
+    connection = None
+    while True:
+        start_time = time.time()
+        try:
+            if connection is None:
+                connection = ESLConnection(arguments['host'],
+                                           arguments['port'],
+                                           arguments['password'],
+                                           arguments['timeout'])
+                logger.info("FreeSWITCH collector: Connected to %s:%s"
+                            % (arguments['host'], arguments['port']))
+            outputs = {}
+            for command in arguments['commands']:
+                outputs[command] = connection.api(command).decode(
+                    'utf-8', 'replace')
+            write_snapshot(arguments['snapshot_file'], outputs)
+        except (socket.error, ESLError, IOError, OSError) as e:
+            logger.warning("FreeSWITCH collector: Snapshot failed: %s."
+                           " Reconnecting" % e)
+            if connection is not None:
+                connection.close()
+                connection = None
+            time.sleep(RECONNECT_INTERVAL)
+            continue
+        time.sleep(max(arguments['interval'] - (time.time() - start_time), 0))
+
+
+def run():
+    arguments = parse_options(OPTIONS, DESCRIPTION, USAGE, VERSION, DEFAULTS)
+    validate_arguments(arguments)
+    prepare_snapshot_dir(arguments['snapshot_file'])
+    collect(arguments)
+
+
+if __name__ == '__main__':
+    logger.info("FreeSWITCH collector: Started")
+    run()
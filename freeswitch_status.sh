@@ -12,6 +12,7 @@ ST_UK=3
 
 AUTHOR="Rohit Gupta - @rohit01"
 PROGNAME=`basename $0`
+PROGDIR=`dirname $0`
 VERSION="Version 1.0,"
 
 print_version() {
@@ -22,7 +23,7 @@ print_help() {
     print_version
     echo ""
     echo "$PROGNAME is a custom Nagios plugin to check freeswitch status"
-    echo "using fs_cli command."
+    echo "using event socket api commands (freeswitch_api.py)."
     echo "Freeswitch status check commands defined in this module are:"
     echo "'show channels count', 'status', 'g729_info' & 'vqa show license'"
     echo ""
@@ -150,7 +151,7 @@ check_timeout() {
 }
 
 execute_check() {
-    /usr/local/freeswitch/bin/fs_cli -b -q -x "$fs_command" -t 2000 > $TEMP_FILE
+    python "${PROGDIR}/freeswitch_api.py" -x "$fs_command" -t 2000 > $TEMP_FILE
     check_exit_status
     check_timeout
 }
@@ -337,7 +338,8 @@ fi
 
 exit_formalities "${message}" "${ST_OK}"
 
-# Actual commands being run to get data:
+# Actual commands being run to get data, read through freeswitch_api.py from
+# the snapshot kept by freeswitch_collector.py. Equivalent fs_cli commands:
 # /usr/local/freeswitch/bin/fs_cli -b -q -x "show channels count" -t 2000
 # /usr/local/freeswitch/bin/fs_cli -b -q -x "status" -t 2000
 # /usr/local/freeswitch/bin/fs_cli -b -q -x "g729_info" -t 2000
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# Description: Shared instrumentation for the python plugins. Times named
+# phases of a check (imports, connection setup, API calls, parsing), reported
+# as perfdata, & optionally profiles the check, writing a cProfile dump & a
+# JSON phase report per run.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import contextlib
+import collections
+
+
+PROFILE_DIR = '/var/tmp/nrpe_plugin_profiles'
+
+
+class PhaseTimer(object):
+    """
+    Total time & number of calls of named phases, in order of first use.
+    Phases run in parallel threads add up, so a total may exceed wall time
+    """
+    def __init__(self):
+        self.start_time = time.time()
+        self.phases = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, name, elapsed):
+        with self.lock:
+            total, calls = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (total + elapsed, calls + 1)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start_time)
+
+    def timed(self, function):
+        """Decorator timing every call of function as phase of its name"""
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            with self.phase(function.__name__):
+                return function(*args, **kwargs)
+        return timed_function
+
+    def perf_data(self, perf_data=''):
+        """Phase totals appended to perf_data as 'phase_<name>'=<seconds>s"""
+        with self.lock:
+            data = ["'phase_%s'=%.6fs" % (name, total)
+                    for name, (total, calls) in self.phases.items()]
+        if perf_data:
+            data.insert(0, perf_data)
+        return ' '.join(data)
+
+    def report(self):
+        with self.lock:
+            phases = [{'name': name, 'total': total, 'calls': calls}
+                      for name, (total, calls) in self.phases.items()]
+        return {
+            'started': self.start_time,
+            'wall_time': time.time() - self.start_time,
+            'phases': phases,
+        }
+
+
+timer = PhaseTimer()
+phase = timer.phase
+timed = timer.timed
+perf_data = timer.perf_data
+profiler = None
+profile_path = None
+
+
+def start_profile(name, profile_dir=None):
+    """
+    Profile the rest of the run. stop_profile() writes <name>_<time>_<pid>
+    .prof (cProfile dump, see pstats) & .json (phase report) in profile_dir.
+    Failures are reported on stderr & never fail the check
+    """
+    global profiler, profile_path
+    import cProfile
+    profile_dir = profile_dir or PROFILE_DIR
+    try:
+        if not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+    except OSError as e:
+        sys.stderr.write("Profiling disabled, creating %s failed: %s\n"
+                         % (profile_dir, e))
+        return
+    profile_path = os.path.join(profile_dir, "%s_%s_%s" % (
+        name, time.strftime('%Y%m%d_%H%M%S'), os.getpid()))
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+
+def stop_profile():
+    """Write profile & phase report, if profiling. Never raises"""
+    global profiler
+    if profiler is None:
+        return
+    profiler.disable()
+    try:
+        profiler.dump_stats("%s.prof" % profile_path)
+        with open("%s.json" % profile_path, 'w') as f:
+            json.dump(timer.report(), f, indent=2)
+    except (IOError, OSError) as e:
+        sys.stderr.write("Writing profile %s failed: %s\n" % (profile_path, e))
+    profiler = None
@@ -2,6 +2,10 @@
 #
 # NRPE plugin to check kafka lag for new consumer groups
 #
+# New consumers are checked by kafka_lag.py, talking to the brokers directly
+# without starting a JVM. Old (zookeeper) consumers still use
+# kafka-consumer-offset-checker.sh
+#
 
 AUTHOR="Rohit Gupta - @rohit01"
 PROGNAME=`basename $0`
@@ -43,7 +47,7 @@ print_help() {
     echo "  -z/--zookeeper)"
     echo "    Zookeeper string (for old consumers). For eg: zk1.local:2181,zk2.local:2181"
     echo "  -t/--topic)"
-    echo "    Kafka topic (applicable only for old consumers)"
+    echo "    Kafka topic. Mandatory for old consumers. For new consumers, only this topic is checked. Default: all topics of the group"
     echo "  -T/--ctype)"
     echo "    Kafka consumer type. Possible values: old & new. default: new"
     echo "  -g/--group)"
@@ -146,6 +150,15 @@ elif [ "${warning}" -gt "${critical}" ]; then
     exit "${ST_UK}"
 fi
 
+#### New consumers: native check, no JVM startup ##############################
+if [ "${ctype}" == "new" ]; then
+    args=(-b "${brokers}" -g "${group}" -w "${warning}" -c "${critical}")
+    if [ "${topic}" != "" ]; then
+        args+=(-t "${topic}")
+    fi
+    exec python "$(dirname "$0")/kafka_lag.py" "${args[@]}"
+fi
+
 #### Function Definitions #####################################################
 fetch_new_consumer_details() {
   # Argument: None
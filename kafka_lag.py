@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+#
+# Nagios NRPE plugin to check kafka lag of new (kafka stored offsets)
+# consumer groups, talking the kafka protocol to the brokers directly instead
+# of starting kafka-consumer-groups.sh in a JVM. Committed offsets of all
+# groups & end offsets of all their partitions are fetched in batches, over
+# one connection per broker, pipelining the requests of a batch.
+# Author: Rohit Gupta - @rohit01
+#
+
+import sys
+import socket
+import struct
+from optparse import OptionParser
+
+
+__version__ = 1.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+OPTIONS = {
+    'b': "brokers;Kafka brokers server string. For eg:" \
+         " kafka1.local:9092,kafka2.local:9092",
+    'g': "groups;Kafka consumer group names separated by comma",
+    't': "topics;Check lag of these topics only, separated by comma." \
+         " Default: all topics with offsets committed by the group",
+    'w': "warning;Message lag of a group for warning alert. Default: 50000",
+    'c': "critical;Message lag of a group for critical alert." \
+         " Default: 150000",
+    'T': "timeout;Network timeout in seconds. Default: 10",
+}
+DEFAULTS = {
+    'warning': '50000',
+    'critical': '150000',
+    'timeout': '10',
+}
+CLIENT_ID = 'nrpe-kafka-lag'
+
+# Kafka protocol api keys & versions used
+API_LIST_OFFSETS = 2
+API_METADATA = 3
+API_OFFSET_FETCH = 9
+API_GROUP_COORDINATOR = 10
+# OffsetFetch v2 returns offsets of all topics of a group for a null topic
+# list. v1 needs the topic partitions. Brokers before kafka 0.10.2 close the
+# connection on v2, or answer UNSUPPORTED_VERSION
+OFFSET_FETCH_ALL_TOPICS = 2
+OFFSET_FETCH_TOPICS = 1
+UNSUPPORTED_VERSION = 35
+LATEST_OFFSET = -1
+NO_OFFSET = -1
+ERRORS = {
+    3: 'UNKNOWN_TOPIC_OR_PARTITION',
+    5: 'LEADER_NOT_AVAILABLE',
+    6: 'NOT_LEADER_FOR_PARTITION',
+    7: 'REQUEST_TIMED_OUT',
+    14: 'GROUP_LOAD_IN_PROGRESS',
+    15: 'GROUP_COORDINATOR_NOT_AVAILABLE',
+    16: 'NOT_COORDINATOR_FOR_GROUP',
+    25: 'UNKNOWN_MEMBER_ID',
+    30: 'GROUP_AUTHORIZATION_FAILED',
+    35: 'UNSUPPORTED_VERSION',
+}
+# Transient group errors, reported as warning like a rebalancing group
+WARNING_ERRORS = [14, 15, 16]
+
+# Nagios exit status values
+ST_OK = 0
+ST_WR = 1
+ST_CR = 2
+ST_UK = 3
+STATUS_TEXT = {ST_OK: 'OK', ST_WR: 'WARNING', ST_CR: 'CRITICAL',
+               ST_UK: 'UNKNOWN'}
+
+
+class KafkaError(Exception):
+    pass
+
+
+def error_name(code):
+    return ERRORS.get(code, 'ERROR_%s' % code)
+
+
+def parse_options():
+    parser = OptionParser(version=VERSION)
+    for option, description in OPTIONS.items():
+        shortopt = '-%s' % (option)
+        longopt = '--%s' % (description.split(';')[0])
+        keyname = description.split(';')[0]
+        help = ''
+        if len(description.split(';')) > 1:
+            help = description.split(';')[1]
+        parser.add_option(shortopt, longopt, dest=keyname, help=help)
+    (options, args) = parser.parse_args()
+    return options
+
+
+def exit_formalalities(message, exit_status):
+    print message
+    sys.exit(exit_status)
+
+
+def split_strings(value):
+    return [s.strip() for s in (value or '').split(',') if s.strip()]
+
+
+def validate_options(options):
+    options.brokers = split_strings(options.brokers)
+    options.groups = split_strings(options.groups)
+    options.topics = split_strings(options.topics)
+    if not options.brokers:
+        raise ValueError("Argument Error: -b/--brokers missing")
+    if not options.groups:
+        raise ValueError("Argument Error: -g/--groups missing")
+    for keyname in 'warning', 'critical':
+        value = getattr(options, keyname) or DEFAULTS[keyname]
+        if not value.isdigit():
+            raise ValueError("Argument Error: -%s/--%s must be a number,"
+                             " given: %s" % (keyname[0], keyname, value))
+        setattr(options, keyname, int(value))
+    if options.warning > options.critical:
+        raise ValueError("Argument Error: value for warning (%s) must be less"
+                         " than or equal to critical (%s)"
+                         % (options.warning, options.critical))
+    try:
+        options.timeout = float(options.timeout or DEFAULTS['timeout'])
+    except ValueError:
+        raise ValueError("Argument Error: -T/--timeout must be a number,"
+                         " given: %s" % options.timeout)
+    for broker in options.brokers:
+        host, _, port = broker.rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError("Invalid broker: '%s'. Expected <host>:<port>"
+                             % broker)
+
+
+## Protocol encoding ##
+
+def encode_string(value):
+    if value is None:
+        return struct.pack('>h', -1)
+    return struct.pack('>h', len(value)) + value
+
+
+def encode_array(items, encode_item):
+    if items is None:
+        return struct.pack('>i', -1)
+    return struct.pack('>i', len(items)) + ''.join(encode_item(item)
+                                                   for item in items)
+
+
+def encode_topics(partitions, encode_partition):
+    """Array of (topic, array of partitions), for a dict of topic to list"""
+    if partitions is None:
+        return encode_array(None, None)
+    return encode_array(sorted(partitions.items()), lambda item: (
+        encode_string(item[0]) +
+        encode_array(sorted(item[1]), encode_partition)))
+
+
+class Reader(object):
+    """Decodes kafka protocol primitives from a response body"""
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        size = struct.calcsize(fmt)
+        if self.offset + size > len(self.data):
+            raise KafkaError("Truncated response")
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += size
+        return values
+
+    def int16(self):
+        return self.unpack('>h')[0]
+
+    def int32(self):
+        return self.unpack('>i')[0]
+
+    def int64(self):
+        return self.unpack('>q')[0]
+
+    def string(self):
+        size = self.int16()
+        if size < 0:
+            return None
+        value = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return value
+
+    def array(self, read_item):
+        size = self.int32()
+        return [read_item() for i in xrange(max(size, 0))]
+
+
+class BrokerConnection(object):
+    """Blocking connection to a broker"""
+    def __init__(self, host, port, timeout):
+        self.address = (host, port)
+        self.sock = socket.create_connection(self.address, timeout)
+        self.correlation_id = 0
+
+    def pipeline(self, requests):
+        """
+        Send all (api key, api version, body) requests, then read their
+        responses. Brokers answer the requests of a connection in order.
+        Returns a list of Reader, positioned after the response header
+        """
+        messages = []
+        first_id = self.correlation_id + 1
+        for api_key, api_version, body in requests:
+            self.correlation_id += 1
+            message = struct.pack('>hhi', api_key, api_version,
+                                  self.correlation_id) + \
+                encode_string(CLIENT_ID) + body
+            messages.append(struct.pack('>i', len(message)) + message)
+        self.sock.sendall(''.join(messages))
+        readers = []
+        for correlation_id in xrange(first_id, self.correlation_id + 1):
+            size = struct.unpack('>i', self.receive(4))[0]
+            reader = Reader(self.receive(size))
+            if reader.int32() != correlation_id:
+                raise KafkaError("Out of order response from %s:%s"
+                                 % self.address)
+            readers.append(reader)
+        return readers
+
+    def receive(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self.sock.recv(min(size, 65536))
+            if not chunk:
+                raise KafkaError("Connection closed by %s:%s" % self.address)
+            chunks.append(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class BrokerPool(object):
+    """
+    Connections to brokers, opened on first use & reused by all requests of
+    the check. Broker addresses of node ids are learnt from metadata
+    """
+    def __init__(self, brokers, timeout):
+        self.bootstrap = []
+        for broker in brokers:
+            host, _, port = broker.rpartition(':')
+            self.bootstrap.append((host, int(port)))
+        self.timeout = timeout
+        self.connections = {}
+        self.nodes = {}
+
+    def connection(self, address):
+        if address not in self.connections:
+            self.connections[address] = BrokerConnection(address[0],
+                                                         address[1],
+                                                         self.timeout)
+        return self.connections[address]
+
+    def pipeline(self, address, requests):
+        try:
+            return self.connection(address).pipeline(requests)
+        except (socket.error, KafkaError):
+            # Never reuse a connection in an unknown state
+            connection = self.connections.pop(address, None)
+            if connection:
+                connection.close()
+            raise
+
+    def any_pipeline(self, requests):
+        """Requests to the first reachable broker, connected ones first"""
+        addresses = self.connections.keys() + [
+            a for a in self.bootstrap if a not in self.connections]
+        errors = []
+        for address in addresses:
+            try:
+                return self.pipeline(address, requests)
+            except (socket.error, KafkaError) as e:
+                errors.append("%s:%s: %s" % (address[0], address[1], e))
+        raise KafkaError("No broker reachable. %s" % '; '.join(errors))
+
+    def any_request(self, api_key, api_version, body):
+        return self.any_pipeline([(api_key, api_version, body)])[0]
+
+    def node_pipeline(self, node_id, requests):
+        if node_id not in self.nodes:
+            raise KafkaError("Unknown broker node id: %s" % node_id)
+        return self.pipeline(self.nodes[node_id], requests)
+
+    def close(self):
+        for connection in self.connections.values():
+            connection.close()
+        self.connections = {}
+
+
+## Kafka requests ##
+
+def fetch_metadata(pool, topics):
+    """
+    Partition leaders of topics, also recording broker addresses in pool.
+    Returns a dict of topic to dict of partition to leader node id
+    """
+    reader = pool.any_request(API_METADATA, 0,
+                              encode_array(topics, encode_string))
+    for node_id, host, port in reader.array(
+            lambda: (reader.int32(), reader.string(), reader.int32())):
+        pool.nodes[node_id] = (host, port)
+    leaders = {}
+
+    def read_partition():
+        error, partition, leader = reader.unpack('>hii')
+        reader.array(reader.int32)
+        reader.array(reader.int32)
+        return (partition, leader)
+
+    for topic_error, topic, partitions in reader.array(
+            lambda: (reader.int16(), reader.string(),
+                     reader.array(read_partition))):
+        if topic_error == 0:
+            leaders[topic] = dict(partitions)
+    return leaders
+
+
+def fetch_coordinators(pool, groups):
+    """
+    Coordinators of all groups, in one batch.
+    Returns a dict of group to coordinator node id or KafkaError
+    """
+    readers = pool.any_pipeline([(API_GROUP_COORDINATOR, 0,
+                                  encode_string(group)) for group in groups])
+    coordinators = {}
+    for group, reader in zip(groups, readers):
+        error, node_id = reader.int16(), reader.int32()
+        host, port = reader.string(), reader.int32()
+        if error:
+            coordinators[group] = KafkaError(error_name(error), error)
+        else:
+            pool.nodes[node_id] = (host, port)
+            coordinators[group] = node_id
+    return coordinators
+
+
+def read_committed_offsets(reader, version):
+    """Returns a dict of (topic, partition) to offset, or raises KafkaError"""
+    offsets = {}
+
+    def read_partition():
+        partition, offset = reader.int32(), reader.int64()
+        reader.string()
+        return (partition, offset, reader.int16())
+
+    for topic, topic_partitions in reader.array(
+            lambda: (reader.string(), reader.array(read_partition))):
+        for partition, offset, error in topic_partitions:
+            if error:
+                raise KafkaError(error_name(error), error)
+            if offset != NO_OFFSET:
+                offsets[(topic, partition)] = offset
+    if version >= OFFSET_FETCH_ALL_TOPICS:
+        error = reader.int16()
+        if error:
+            raise KafkaError(error_name(error), error)
+    return offsets
+
+
+def fetch_committed_offsets(pool, coordinators, partitions=None):
+    """
+    Committed offsets of groups, of all their topics or of partitions, a
+    dict of topic to list of partitions. One batch per coordinator.
+    Returns a dict of group to either a dict of (topic, partition) to offset
+    or KafkaError
+    """
+    if partitions is None:
+        version = OFFSET_FETCH_ALL_TOPICS
+    else:
+        version = OFFSET_FETCH_TOPICS
+    topics = encode_topics(partitions, lambda p: struct.pack('>i', p))
+    by_coordinator = {}
+    committed = {}
+    for group, coordinator in coordinators.items():
+        if isinstance(coordinator, KafkaError):
+            committed[group] = coordinator
+        else:
+            by_coordinator.setdefault(coordinator, []).append(group)
+    for coordinator, groups in sorted(by_coordinator.items()):
+        readers = pool.node_pipeline(coordinator, [
+            (API_OFFSET_FETCH, version, encode_string(group) + topics)
+            for group in groups])
+        for group, reader in zip(groups, readers):
+            try:
+                committed[group] = read_committed_offsets(reader, version)
+            except KafkaError as e:
+                committed[group] = e
+    return committed
+
+
+def fetch_all_committed_offsets(pool, coordinators, leaders):
+    """
+    Committed offsets of groups, of all their topics. Groups whose
+    coordinator does not support OffsetFetch v2 are fetched again with v1,
+    for all partitions of all topics in metadata, also added to leaders.
+    Returns like fetch_committed_offsets()
+    """
+    try:
+        committed = fetch_committed_offsets(pool, coordinators)
+    except (socket.error, KafkaError):
+        committed = {}
+    retry = dict((group, coordinator)
+                 for group, coordinator in coordinators.items()
+                 if group not in committed or
+                 (isinstance(committed[group], KafkaError) and
+                  committed[group].args[1:] == (UNSUPPORTED_VERSION,)))
+    if not retry:
+        return committed
+    # Metadata of no topics is metadata of all topics
+    leaders.update(fetch_metadata(pool, []))
+    partitions = dict((topic, sorted(topic_partitions))
+                      for topic, topic_partitions in leaders.items())
+    committed.update(fetch_committed_offsets(pool, retry, partitions))
+    return committed
+
+
+def fetch_end_offsets(pool, leaders, topic_partitions):
+    """
+    Latest offsets of topic_partitions, one ListOffsets request per leader.
+    Returns a dict of (topic, partition) to offset. Partitions without
+    leader or with errors are missing
+    """
+    by_leader = {}
+    for topic, partition in topic_partitions:
+        leader = leaders.get(topic, {}).get(partition, -1)
+        if leader >= 0:
+            by_leader.setdefault(leader, {}).setdefault(topic, []).append(
+                partition)
+    offsets = {}
+    for leader, partitions in sorted(by_leader.items()):
+        # Replica id -1: a client, not a follower broker
+        body = struct.pack('>i', -1) + encode_topics(
+            partitions, lambda p: struct.pack('>iqi', p, LATEST_OFFSET, 1))
+        reader = pool.node_pipeline(leader, [(API_LIST_OFFSETS, 0, body)])[0]
+
+        def read_partition():
+            partition, error = reader.int32(), reader.int16()
+            return (partition, error, reader.array(reader.int64))
+
+        for topic, topic_partitions in reader.array(
+                lambda: (reader.string(), reader.array(read_partition))):
+            for partition, error, partition_offsets in topic_partitions:
+                if not error and partition_offsets:
+                    offsets[(topic, partition)] = partition_offsets[0]
+    return offsets
+
+
+def fetch_group_lags(pool, groups, topics=None):
+    """
+    Lag of every partition with a committed offset, for all groups.
+    Returns a dict of group to either a dict of (topic, partition) to lag,
+    or the KafkaError of the group
+    """
+    leaders = {}
+    partitions = None
+    if topics:
+        leaders = fetch_metadata(pool, topics)
+        partitions = dict((topic, sorted(leaders[topic]))
+                          for topic in topics if topic in leaders)
+    coordinators = fetch_coordinators(pool, groups)
+    if partitions is None:
+        committed = fetch_all_committed_offsets(pool, coordinators, leaders)
+    else:
+        committed = fetch_committed_offsets(pool, coordinators, partitions)
+    # End offsets of the partitions of all groups, fetched once
+    topic_partitions = set()
+    for offsets in committed.values():
+        if not isinstance(offsets, KafkaError):
+            topic_partitions.update(offsets)
+    missing_topics = set(t for t, p in topic_partitions if t not in leaders)
+    if missing_topics:
+        leaders.update(fetch_metadata(pool, sorted(missing_topics)))
+    end_offsets = fetch_end_offsets(pool, leaders, topic_partitions)
+    lags = {}
+    for group, offsets in committed.items():
+        if isinstance(offsets, KafkaError):
+            lags[group] = offsets
+            continue
+        lags[group] = dict((tp, max(end_offsets[tp] - offset, 0))
+                           for tp, offset in offsets.items()
+                           if tp in end_offsets)
+    return lags
+
+
+## Check result ##
+
+def group_status(group, lags, options):
+    """Returns a tuple: (exit status, message) of a group"""
+    if isinstance(lags, KafkaError):
+        code = lags.args[1] if len(lags.args) > 1 else None
+        status = ST_WR if code in WARNING_ERRORS else ST_CR
+        return (status, "fetch error. %s, group '%s'" % (lags.args[0], group))
+    if not lags:
+        return (ST_WR, "no numeric lag value found for lag calculation,"
+                " group '%s'" % group)
+    lag = sum(lags.values())
+    if lag >= options.critical:
+        return (ST_CR, "kafka consumer lag is %s (> %s), group '%s'"
+                % (lag, options.critical, group))
+    if lag >= options.warning:
+        return (ST_WR, "kafka consumer lag is %s (> %s), group '%s'"
+                % (lag, options.warning, group))
+    return (ST_OK, "kafka consumer lag is %s, group '%s'" % (lag, group))
+
+
+def calc_perf_data(group_lags, options):
+    data = []
+    for group in options.groups:
+        lags = group_lags[group]
+        if isinstance(lags, KafkaError) or not lags:
+            continue
+        data.append("'lag_%s'=%s;%s;%s;0" % (group, sum(lags.values()),
+                                            options.warning,
+                                            options.critical))
+        for topic, partition in sorted(lags):
+            data.append("'lag_%s_%s_%s'=%s;;;0" % (
+                group, topic, partition, lags[(topic, partition)]))
+    return ' '.join(data)
+
+
+def run():
+    options = parse_options()
+    try:
+        validate_options(options)
+    except ValueError as e:
+        exit_formalalities(str(e), ST_UK)
+    pool = BrokerPool(options.brokers, options.timeout)
+    try:
+        group_lags = fetch_group_lags(pool, options.groups, options.topics)
+    except (socket.error, KafkaError) as e:
+        exit_formalalities("CRITICAL- fetch error. %s, groups '%s'"
+                           % (e, ','.join(options.groups)), ST_CR)
+    finally:
+        pool.close()
+    results = [group_status(group, group_lags[group], options)
+               for group in options.groups]
+    exit_status = ST_OK
+    for status, message in results:
+        if status == ST_CR or (status == ST_WR and exit_status != ST_CR):
+            exit_status = status
+    perf_data = calc_perf_data(group_lags, options)
+    if perf_data:
+        perf_data = " | %s" % perf_data
+    if len(results) == 1:
+        exit_formalalities("%s- %s%s" % (STATUS_TEXT[exit_status],
+                                         results[0][1], perf_data),
+                           exit_status)
+    details = ["%s- %s" % (STATUS_TEXT[status], message)
+               for status, message in results]
+    exit_formalalities("%s- kafka consumer lag of %s groups checked%s\n%s"
+                       % (STATUS_TEXT[exit_status], len(results), perf_data,
+                          '\n'.join(details)), exit_status)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+#
+# Script to clear the oldest log files in directories. To be used as a event
+# for monitoring disk space. Can help automatically clean log files.
+# Directories are scanned once, keeping only the --max_files oldest log files
+# in a heap, & log files are cleared oldest first until the free space goal
+# of their filesystem is met. Without a goal, only the oldest file is
+# cleared.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import glob
+import stat
+import heapq
+import fnmatch
+from optparse import OptionParser
+
+# scandir gives file types with the directory listing, so only matching log
+# files are stat'ed when walking. Part of os since python 3.5, else the
+# scandir package if installed
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+__version__ = 1.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+OPTIONS = {
+    'd': "logdir;Directories to search for old log files, separated by" \
+         " comma. Can be a Unix glob as well. Default: /var/log/",
+    's': "minsize;Minimum size of the log file targeted for deletion." \
+         " Supported suffix: k(KB), M(MB), G(GB). Default: 5M",
+    'N': "name;File name pattern of log files. Default: *.log*",
+    'm': "max_files;Max log files cleared in one run. Default: 100",
+    'b': "free_bytes;Clear log files until free space of their filesystem" \
+         " is at least this size. Supported suffix: k(KB), M(MB), G(GB)",
+    'p': "free_percent;Clear log files until free space of their" \
+         " filesystem is at least this percent",
+    'r': "remove;Remove log files instead of truncating them. Space of" \
+         " removed files still open is freed only once they are closed",
+    'n': "dry_run;Only show the log files which would be cleared",
+}
+FLAG_OPTIONS = ['remove', 'dry_run']
+DEFAULTS = {
+    'logdir': '/var/log/',
+    'minsize': '5M',
+    'name': '*.log*',
+    'max_files': '100',
+}
+# Size suffixes, as in 'find -size'. Without suffix, 512 byte blocks
+SIZE_UNITS = {
+    'c': 1,
+    'k': 1024,
+    'M': 1024 ** 2,
+    'G': 1024 ** 3,
+    '': 512,
+}
+# Goal sizes without suffix are in bytes
+GOAL_SIZE_UNITS = dict(SIZE_UNITS, **{'': 1})
+
+# Nagios exit status values
+ST_OK = 0
+ST_WR = 1
+ST_CR = 2
+ST_UK = 3
+
+
+def parse_options():
+    parser = OptionParser(version=VERSION)
+    for option, description in OPTIONS.items():
+        shortopt = '-%s' % (option)
+        longopt = '--%s' % (description.split(';')[0])
+        keyname = description.split(';')[0]
+        help = ''
+        if len(description.split(';')) > 1:
+            help = description.split(';')[1]
+        if keyname in FLAG_OPTIONS:
+            action = 'store_true'
+        else:
+            action = 'store'
+        parser.add_option(shortopt, longopt, dest=keyname, action=action,
+                          help=help)
+    (options, args) = parser.parse_args()
+    arguments = {}
+    for keyname in OPTIONS.values():
+        keyname = keyname.split(';')[0]
+        value = getattr(options, keyname)
+        if keyname in DEFAULTS and (value is None or value.strip() == ''):
+            value = DEFAULTS[keyname]
+        arguments[keyname] = value
+    return arguments
+
+
+def exit_formalalities(message, exit_status):
+    print message
+    sys.exit(exit_status)
+
+
+def parse_size(value, units):
+    value = value.strip()
+    suffix = '' if value[-1:].isdigit() else value[-1:]
+    number = value[:len(value) - len(suffix)]
+    if suffix not in units or not number.isdigit():
+        raise ValueError(value)
+    return int(number) * units[suffix]
+
+
+def validate_arguments(arguments):
+    arguments['logdir'] = [d.strip() for d in arguments['logdir'].split(',')
+                           if d.strip()]
+    for keyname, units in ('minsize', SIZE_UNITS), \
+            ('free_bytes', GOAL_SIZE_UNITS):
+        if arguments[keyname] is None:
+            continue
+        try:
+            arguments[keyname] = parse_size(arguments[keyname], units)
+        except ValueError:
+            raise ValueError("Invalid value: '%s' for option --%s. Possible"
+                             " value: Positive integer with optional suffix"
+                             " k, M or G" % (arguments[keyname], keyname))
+    if not arguments['max_files'].isdigit() or \
+            int(arguments['max_files']) == 0:
+        raise ValueError("Invalid value: '%s' for option -m/--max_files."
+                         " Possible value: Positive integer"
+                         % arguments['max_files'])
+    arguments['max_files'] = int(arguments['max_files'])
+    if arguments['free_percent'] is not None:
+        try:
+            free_percent = float(arguments['free_percent'])
+            if not 0 < free_percent <= 100:
+                raise ValueError()
+            arguments['free_percent'] = free_percent
+        except ValueError:
+            raise ValueError("Invalid value: '%s' for option -p/"
+                             "--free_percent. Possible value: 0 to 100"
+                             % arguments['free_percent'])
+
+
+def human_size(size):
+    """Size like 'du -h'"""
+    for suffix in '', 'K', 'M', 'G', 'T':
+        if size < 1024:
+            break
+        size /= 1024.0
+    if suffix and size < 10:
+        return "%.1f%s" % (size, suffix)
+    return "%d%s" % (size, suffix)
+
+
+def walk_files(directory, name_pattern):
+    """
+    Yields a tuple: (path, lstat result) of every regular file under
+    directory whose name matches name_pattern, without following symbolic
+    links, like 'find -type f -name'
+    """
+    if scandir is not None:
+        try:
+            entries = list(scandir(directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    for item in walk_files(entry.path, name_pattern):
+                        yield item
+                elif fnmatch.fnmatch(entry.name, name_pattern) and \
+                        entry.is_file(follow_symlinks=False):
+                    yield (entry.path, entry.stat(follow_symlinks=False))
+            except OSError:
+                continue
+        return
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            stat_result = os.lstat(path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(stat_result.st_mode):
+            for item in walk_files(path, name_pattern):
+                yield item
+        elif stat.S_ISREG(stat_result.st_mode) and \
+                fnmatch.fnmatch(name, name_pattern):
+            yield (path, stat_result)
+
+
+def oldest_log_files(arguments):
+    """
+    The max_files oldest log files larger than minsize, oldest first, found
+    in one pass over the log directories. Newer files are dropped from a
+    heap as soon as max_files older ones are found.
+    Returns a list of tuples: (mtime, path, stat result)
+    """
+    heap = []
+    # Inodes in heap, as overlapping directories yield a file again
+    inodes = set()
+    for pattern in arguments['logdir']:
+        for directory in sorted(glob.glob(pattern)):
+            for path, stat_result in walk_files(directory, arguments['name']):
+                inode = (stat_result.st_dev, stat_result.st_ino)
+                if stat_result.st_size <= arguments['minsize'] or \
+                        inode in inodes:
+                    continue
+                # Max heap on mtime, newest candidate on top
+                item = (-stat_result.st_mtime, path, stat_result)
+                if len(heap) < arguments['max_files']:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    newest = heapq.heapreplace(heap, item)
+                    inodes.discard((newest[2].st_dev, newest[2].st_ino))
+                else:
+                    continue
+                inodes.add(inode)
+    return [(-mtime, path, stat_result) for mtime, path, stat_result in
+            sorted(heap, reverse=True)]
+
+
+def free_space(path):
+    """Returns a tuple: (free bytes, total bytes) of the filesystem of path"""
+    result = os.statvfs(path)
+    return (result.f_bavail * result.f_frsize,
+            result.f_blocks * result.f_frsize)
+
+
+def goal_met(free, total, arguments):
+    if arguments['free_bytes'] is not None and \
+            free < arguments['free_bytes']:
+        return False
+    if arguments['free_percent'] is not None and \
+            free * 100.0 < arguments['free_percent'] * total:
+        return False
+    return True
+
+
+def clear_log_file(path, remove):
+    if remove:
+        os.remove(path)
+    else:
+        # Truncated in place, like 'cat /dev/null > file', so that space is
+        # freed even if the file is still open for writing
+        open(path, 'w').close()
+
+
+def reclaim(candidates, arguments):
+    """
+    Clear candidates oldest first until the goal of their filesystem is met,
+    or only the oldest one without a goal. In dry run, free space after
+    clearing is estimated from disk usage of the files.
+    Returns a tuple: (lines, bytes freed, files cleared, errors, unmet
+    filesystems)
+    """
+    has_goal = arguments['free_bytes'] is not None or \
+        arguments['free_percent'] is not None
+    if not has_goal:
+        candidates = candidates[:1]
+    lines = []
+    bytes_freed = 0
+    files_cleared = 0
+    errors = 0
+    # Filesystem device -> (free bytes, total bytes)
+    filesystems = {}
+    # Filesystem device -> free bytes before clearing, bytes freed
+    initial_free = {}
+    freed = {}
+    for _, path, stat_result in candidates:
+        device = stat_result.st_dev
+        if has_goal:
+            if device not in filesystems:
+                filesystems[device] = free_space(os.path.dirname(path))
+                initial_free[device] = filesystems[device][0]
+                freed[device] = 0
+            if goal_met(filesystems[device][0], filesystems[device][1],
+                        arguments):
+                continue
+        # Disk usage, as shown by 'du'
+        usage = stat_result.st_blocks * 512
+        if arguments['dry_run']:
+            lines.append("Would clear log file: %s, Size: %s"
+                         % (path, human_size(usage)))
+            if has_goal:
+                free, total = filesystems[device]
+                filesystems[device] = (free + usage, total)
+        else:
+            try:
+                clear_log_file(path, arguments['remove'])
+            except (IOError, OSError) as e:
+                lines.append("Clearing log file failed: %s, %s" % (path, e))
+                errors += 1
+                continue
+            lines.append("Clearing log file: %s, Size: %s"
+                         % (path, human_size(usage)))
+            if has_goal:
+                # statvfs may lag behind, until the filesystem has released
+                # the blocks of cleared files
+                freed[device] += usage
+                free, total = free_space(os.path.dirname(path))
+                filesystems[device] = (
+                    max(free, initial_free[device] + freed[device]), total)
+        bytes_freed += usage
+        files_cleared += 1
+    unmet = [device for device, (free, total) in filesystems.items()
+             if not goal_met(free, total, arguments)]
+    return (lines, bytes_freed, files_cleared, errors, unmet)
+
+
+def run():
+    arguments = parse_options()
+    try:
+        validate_arguments(arguments)
+    except ValueError as e:
+        exit_formalalities("UNKNOWN - %s" % e, ST_UK)
+    candidates = oldest_log_files(arguments)
+    lines, bytes_freed, files_cleared, errors, unmet = reclaim(candidates,
+                                                               arguments)
+    verb = "Would clear" if arguments['dry_run'] else "Cleared"
+    message = "%s %s log files, %s freed" % (verb, files_cleared,
+                                             human_size(bytes_freed))
+    exit_status = ST_OK
+    if errors:
+        message = "%s. Failed to clear %s log files" % (message, errors)
+        exit_status = ST_WR
+    if unmet:
+        message = "%s. Free space goal not met on %s filesystems" % (
+            message, len(unmet))
+        exit_status = ST_WR
+    status_text = {ST_OK: 'OK', ST_WR: 'WARNING'}
+    perf_data = "'bytes_freed'=%sB;;;0 'files_cleared'=%s;;;0" % (
+        bytes_freed, files_cleared)
+    output = "%s - %s | %s" % (status_text[exit_status], message, perf_data)
+    if lines:
+        output = "%s\n%s" % (output, '\n'.join(lines))
+    exit_formalalities(output, exit_status)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+#
+# Nagios NRPE plugin to monitor the dropped & error packets per million for
+# the given network cards using RX & TX counters of /proc/net/dev, read once
+# for all devices. Counters of the last check are kept in KEEP_TRACK_FILE &
+# the check result is UNKNOWN for the first run.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import tempfile
+from optparse import OptionParser
+
+
+__version__ = 1.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+OPTIONS = {
+    'd': "devices;Network device names or glob patterns separated by comma." \
+         " For eg: eth0,bond1 or 'eth*,bond*'. Default: eth0",
+    'w': "warning;No of dropped/error packets per million to raise warning." \
+         " Default: 100",
+    'c': "critical;No of dropped/error packets per million to raise critical" \
+         " alert. Default: 500",
+}
+DEFAULTS = {
+    'devices': 'eth0',
+    'warning': 100,
+    'critical': 500,
+}
+
+# Settings
+PROC_NET_DEV = '/proc/net/dev'
+MINIMUM_PACKET_DIFFERENCE = 10000
+KEEP_TRACK_FILE = '/tmp/._monitor_dropped_packets_1855_'
+MEASURE_UNIT = 1000000    # per million
+# Counters in /proc/net/dev are unsigned long, 64 bit on 64 bit kernels
+COUNTER_MAX = 2 ** 64
+# Fields of a device line after 'name:' in /proc/net/dev
+RX_PACKETS, RX_ERRORS, RX_DROPPED = 1, 2, 3
+TX_PACKETS, TX_ERRORS, TX_DROPPED = 9, 10, 11
+
+# Nagios exit status values
+ST_OK = 0
+ST_WR = 1
+ST_CR = 2
+ST_UK = 3
+
+
+def parse_options():
+    parser = OptionParser(version=VERSION)
+    for option, description in OPTIONS.items():
+        shortopt = '-%s' % (option)
+        longopt = '--%s' % (description.split(';')[0])
+        keyname = description.split(';')[0]
+        help = ''
+        if len(description.split(';')) > 1:
+            help = description.split(';')[1]
+        parser.add_option(shortopt, longopt, dest=keyname, help=help)
+    (options, args) = parser.parse_args()
+    arguments = {}
+    for keyname, default in DEFAULTS.items():
+        value = getattr(options, keyname)
+        if value is None or value.strip() == '':
+            value = default
+        arguments[keyname] = value
+    return arguments
+
+
+def exit_formalalities(message, exit_status):
+    print message
+    sys.exit(exit_status)
+
+
+def validate_arguments(arguments):
+    for keyname in 'warning', 'critical':
+        try:
+            arguments[keyname] = float(arguments[keyname])
+            if arguments[keyname] < 0:
+                raise ValueError()
+        except ValueError:
+            exit_formalalities('UNKNOWN - Invalid value passed for %s'
+                               % keyname, ST_UK)
+    arguments['devices'] = [d.strip() for d in arguments['devices'].split(',')
+                            if d.strip()]
+
+
+def read_counters(patterns):
+    """
+    Read RX & TX (packets, errors, dropped) counters of all devices matching
+    any of the name patterns, in one pass over /proc/net/dev.
+    Returns a dict of device name to [rx packets, rx errors, rx dropped,
+    tx packets, tx errors, tx dropped]
+    """
+    counters = {}
+    with open(PROC_NET_DEV, 'r') as f:
+        for line in f:
+            if ':' not in line:
+                # Header lines
+                continue
+            name, data = line.split(':', 1)
+            name = name.strip()
+            if not any(fnmatch.fnmatchcase(name, p) for p in patterns):
+                continue
+            fields = data.split()
+            counters[name] = [int(fields[i]) for i in (
+                RX_PACKETS, RX_ERRORS, RX_DROPPED,
+                TX_PACKETS, TX_ERRORS, TX_DROPPED)]
+    return counters
+
+
+def load_last_check(path):
+    """
+    Counters saved by earlier checks, or None if missing or unreadable.
+    Returns a dict of device name to {"time": epoch, "counters": counters}
+    """
+    try:
+        with open(path, 'r') as f:
+            last_check = json.load(f)
+        if not isinstance(last_check, dict):
+            return None
+        return last_check
+    except (IOError, ValueError):
+        return None
+
+
+def save_last_check(path, last_check):
+    # Unpredictable temp file, created exclusively: another user can't
+    # plant a symlink at its name in a shared directory like /tmp
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(last_check, f)
+        # Atomic replace, parallel checks never read a partial file
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def counter_delta(current, previous):
+    """
+    Increase of a counter since previous, across a counter wrap. A counter
+    which went back (device reset or recreated) counts from zero
+    """
+    delta = (current - previous) % COUNTER_MAX
+    if delta > COUNTER_MAX / 2:
+        return current
+    return delta
+
+
+def device_totals(counters):
+    """Returns a tuple: (total packets, error packets, dropped packets)"""
+    return (counters[0] + counters[3], counters[1] + counters[4],
+            counters[2] + counters[5])
+
+
+def per_unit(difference, total):
+    if total == 0:
+        return 0.0
+    return float(difference) * MEASURE_UNIT / total
+
+
+def calculate_dropped_packets(counters, last_check, now, arguments):
+    """
+    Compare counters with the last check & check per million rates against
+    thresholds. Returns a tuple: (exit status, rates, devices to save) where
+    rates is a dict of device name to (errors per million, dropped per
+    million, errors per second, dropped per second) or None for devices not
+    in the last check
+    """
+    exit_status = ST_OK
+    save_devices = []
+    rates = {}
+    for name in sorted(counters):
+        try:
+            old_counters = last_check[name]['counters']
+            elapsed = max(now - last_check[name]['time'], 0)
+            if len(old_counters) != len(counters[name]):
+                raise ValueError()
+        except (KeyError, TypeError, ValueError):
+            rates[name] = None
+            save_devices.append(name)
+            continue
+        deltas = [counter_delta(c, o) for c, o in zip(counters[name],
+                                                      old_counters)]
+        total, errors, dropped = device_totals(deltas)
+        errors_pm = per_unit(errors, total)
+        dropped_pm = per_unit(dropped, total)
+        if elapsed > 0:
+            rates[name] = (errors_pm, dropped_pm, float(errors) / elapsed,
+                           float(dropped) / elapsed)
+        else:
+            rates[name] = (errors_pm, dropped_pm, 0.0, 0.0)
+        if errors_pm >= arguments['critical'] or \
+                dropped_pm >= arguments['critical']:
+            exit_status = ST_CR
+        elif exit_status == ST_OK and (errors_pm >= arguments['warning'] or
+                                       dropped_pm >= arguments['warning']):
+            exit_status = ST_WR
+        # Keep the old counters until enough packets are seen for a
+        # meaningful per million rate
+        if total > MINIMUM_PACKET_DIFFERENCE:
+            save_devices.append(name)
+    return (exit_status, rates, save_devices)
+
+
+def formatted_device_status(counters):
+    status = []
+    for name in sorted(counters):
+        c = counters[name]
+        status.append("%s(p:%s,e:%s,d:%s; p:%s,e:%s,d:%s)" % (
+            name, c[0], c[1], c[2], c[3], c[4], c[5]))
+    return '; '.join(status)
+
+
+def formatted_error_status(rates):
+    status = []
+    for name in sorted(rates):
+        if rates[name] is None:
+            status.append("%s-(Errors:X, Dropped:X)" % name)
+        else:
+            status.append("%s-(Errors:%.1f/M, Dropped:%.1f/M)" % (
+                name, rates[name][0], rates[name][1]))
+    return '; '.join(status)
+
+
+def calc_perf_data(rates, arguments):
+    data = []
+    for name in sorted(rates):
+        if rates[name] is None:
+            continue
+        errors_pm, dropped_pm, errors_ps, dropped_ps = rates[name]
+        data.append("'errors_%s'=%.1f;%g;%g;0" % (
+            name, errors_pm, arguments['warning'], arguments['critical']))
+        data.append("'dropped_%s'=%.1f;%g;%g;0" % (
+            name, dropped_pm, arguments['warning'], arguments['critical']))
+        data.append("'errors_per_sec_%s'=%.3f;;;0" % (name, errors_ps))
+        data.append("'dropped_per_sec_%s'=%.3f;;;0" % (name, dropped_ps))
+    return ' '.join(data)
+
+
+def run():
+    arguments = parse_options()
+    validate_arguments(arguments)
+    now = time.time()
+    try:
+        counters = read_counters(arguments['devices'])
+    except (IOError, ValueError, IndexError) as e:
+        exit_formalalities('UNKNOWN - Unable to read %s: %s'
+                           % (PROC_NET_DEV, e), ST_UK)
+    if not counters:
+        exit_formalalities('UNKNOWN - No network device found matching: %s'
+                           % ','.join(arguments['devices']), ST_UK)
+    last_check = load_last_check(KEEP_TRACK_FILE)
+    if last_check is None:
+        try:
+            save_last_check(KEEP_TRACK_FILE, dict(
+                (name, {'time': now, 'counters': counters[name]})
+                for name in counters))
+        except (IOError, OSError) as e:
+            exit_formalalities('UNKNOWN - Unable to save counters in %s: %s'
+                               % (KEEP_TRACK_FILE, e), ST_UK)
+        exit_formalalities('UNKNOWN - Errors: UNKNOWN, Dropped: UNKNOWN.'
+                           ' Current status- %s'
+                           % formatted_device_status(counters), ST_UK)
+    exit_status, rates, save_devices = calculate_dropped_packets(
+        counters, last_check, now, arguments)
+    if save_devices:
+        # Other devices, also those not checked in this run, keep their
+        # saved counters
+        for name in save_devices:
+            last_check[name] = {'time': now, 'counters': counters[name]}
+        try:
+            save_last_check(KEEP_TRACK_FILE, last_check)
+        except (IOError, OSError) as e:
+            exit_formalalities('UNKNOWN - Unable to save counters in %s: %s'
+                               % (KEEP_TRACK_FILE, e), ST_UK)
+    status_text = {ST_OK: 'OK', ST_WR: 'WARNING', ST_CR: 'CRITICAL'}
+    message = "%s- %s. Current status- %s | %s" % (
+        status_text[exit_status], formatted_error_status(rates),
+        formatted_device_status(counters), calc_perf_data(rates, arguments))
+    exit_formalalities(message, exit_status)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# Thin NRPE client for plugin_runner.py. Use it in place of a python plugin:
+#   plugin_client.py elb_health.py --loadbalancer=web ...
+# Output & exit status are the plugin's. If the runner is not reachable the
+# plugin script is executed directly.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import stat
+import socket
+
+
+SOCKET_PATH = os.environ.get(
+    'NRPE_PLUGIN_RUNNER_SOCKET',
+    '/var/run/nrpe-plugin-runner/nrpe_plugin_runner.sock')
+# Seconds to wait for the check result. More than the runner's check timeout
+# (Default: 60), which reports timed out checks itself
+TIMEOUT = float(os.environ.get('NRPE_PLUGIN_RUNNER_TIMEOUT', 75))
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+ST_UK = 3
+
+
+def run_directly(plugin, argv):
+    path = os.path.join(PLUGIN_DIR, os.path.basename(plugin))
+    if not path.endswith('.py'):
+        path = "%s.py" % path
+    os.execv(sys.executable, [sys.executable, path] + argv)
+
+
+def trusted_socket(path):
+    """
+    True if path is a socket owned by root or this user, in a directory
+    owned by one of them & not writable by others. The plugin argv, with
+    credentials, is sent to it
+    """
+    trusted_uids = (0, os.getuid())
+    try:
+        socket_stat = os.lstat(path)
+        dir_stat = os.stat(os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        return False
+    return stat.S_ISSOCK(socket_stat.st_mode) and \
+        socket_stat.st_uid in trusted_uids and \
+        dir_stat.st_uid in trusted_uids and \
+        not dir_stat.st_mode & stat.S_IWOTH
+
+
+def run():
+    if len(sys.argv) < 2:
+        print "UNKNOWN - Usage: %s <plugin> [plugin options]" \
+            % os.path.basename(__file__)
+        sys.exit(ST_UK)
+    plugin, argv = sys.argv[1], sys.argv[2:]
+    if not trusted_socket(SOCKET_PATH):
+        run_directly(plugin, argv)
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(TIMEOUT)
+    try:
+        conn.connect(SOCKET_PATH)
+    except socket.error:
+        run_directly(plugin, argv)
+    data = ''
+    try:
+        conn.sendall(json.dumps({'plugin': plugin, 'argv': argv}) + '\n')
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        print "UNKNOWN - No response from plugin runner in %ss" % TIMEOUT
+        sys.exit(ST_UK)
+    except socket.error as e:
+        print "UNKNOWN - Plugin runner connection failed: %s" % e
+        sys.exit(ST_UK)
+    finally:
+        conn.close()
+    if not data:
+        # Worker killed by the runner, after the check hung
+        print "UNKNOWN - Plugin runner closed the connection without a result"
+        sys.exit(ST_UK)
+    try:
+        response = json.loads(data)
+    except ValueError:
+        print "UNKNOWN - Invalid response from plugin runner"
+        sys.exit(ST_UK)
+    sys.stdout.write(response['stdout'].encode('utf-8'))
+    sys.stderr.write(response['stderr'].encode('utf-8'))
+    sys.exit(response['exit_status'])
+
+
+if __name__ == '__main__':
+    run()
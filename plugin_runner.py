@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+#
+# Resident runner for the python NRPE plugins. Pre-imports heavy libraries
+# (requests, docker-py, boto, jinja2) & precompiles plugins once, then runs
+# each check requested by plugin_client.py in a forked worker. Workers start
+# from the pre-imported state & exit after one check, so plugin globals never
+# leak between checks. Output & exit status match running the script.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import stat
+import time
+import errno
+import select
+import signal
+import socket
+import optparse
+import traceback
+import StringIO
+import logging
+import logging.handlers
+
+
+__version__ = 0.1
+VERSION = """Version: %s, Author: Rohit Gupta - @rohit01""" % __version__
+DESCRIPTION = """Resident runner for the python NRPE plugins"""
+OPTIONS = {
+    "socket": "Unix socket path to listen on. Its directory is created" \
+        " 0750 if missing & must be owned by the runner's user. Default:" \
+        " /var/run/nrpe-plugin-runner/nrpe_plugin_runner.sock",
+    "max_workers": "Max checks run in parallel. Default: 32",
+    "timeout": "Seconds after which a check is killed & reported as" \
+        " UNKNOWN. Default: 60",
+}
+DEFAULTS = {
+    "socket": "/var/run/nrpe-plugin-runner/nrpe_plugin_runner.sock",
+    "max_workers": 32,
+    "timeout": 60,
+}
+USAGE = "%s [options]"  % os.path.basename(__file__)
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGINS = ['aws_ses_email.py', 'docker_container_status.py', 'elb_health.py',
+           'kafka_lag.py', 'url_test.py']
+# Imported once in the runner, shared by all workers
+PRELOAD_MODULES = ['requests', 'docker', 'boto', 'boto.ec2.elb', 'boto.ses',
+                   'jinja2', 'json', 'optparse', 'logging.handlers']
+# Socket directory & socket modes: only the runner's user & group, which
+# should be nrpe's, may connect
+SOCKET_DIR_MODE = 0750
+SOCKET_MODE = 0660
+# Seconds between reaping finished workers while no check is requested, &
+# while all max_workers are busy
+REAP_INTERVAL = 1
+WORKERS_BUSY_INTERVAL = 0.05
+# Seconds a client has to send its request
+REQUEST_TIMEOUT = 5
+# Workers still running KILL_GRACE seconds after the check timed out, &
+# their request timeout, are killed. The alarm can't interrupt a plugin
+# blocked in Thread.join() or Queue.get() without timeout
+KILL_GRACE = 5
+ST_UK = 3
+
+logger = logging.getLogger("NRPE plugin runner")
+logger.setLevel(logging.INFO)
+# Logging in syslog (/var/log/syslog)
+handler = logging.handlers.SysLogHandler(address='/dev/log')
+logger.addHandler(handler)
+
+
+class PluginTimeout(BaseException):
+    """Not an Exception, so plugins' exception handlers don't catch it"""
+
+
+def parse_options(options, description=None, usage=None, version=None,
+        defaults=None):
+    parser = optparse.OptionParser(description=description, usage=usage,
+                                   version=version)
+    for keyname, description in options.items():
+        longopt = '--%s' % keyname
+        parser.add_option(longopt, dest=keyname, help=description)
+    option_args, _ = parser.parse_args()
+    arguments = {}
+    for keyname in options.keys():
+        arguments[keyname] = eval("option_args.%s" % keyname)
+    if defaults:
+        for k, v in arguments.items():
+            if (not v) and (k in defaults):
+                arguments[k] = defaults[k]
+    return arguments
+
+
+def validate_arguments(arguments):
+    for key in 'max_workers', 'timeout':
+        try:
+            arguments[key] = int(arguments[key])
+            if arguments[key] <= 0:
+                raise ValueError()
+        except ValueError:
+            print "Option --%s invalid. Value %s must be a positive integer" \
+                % (key, arguments[key])
+            sys.exit(ST_UK)
+
+
+def preload_modules():
+    for module_name in PRELOAD_MODULES:
+        try:
+            __import__(module_name)
+        except ImportError as e:
+            logger.warning("NRPE plugin runner: Preloading %s failed: %s"
+                           % (module_name, e))
+
+
+class PluginCode(object):
+    """Compiled plugin scripts, recompiled when the script changes"""
+    def __init__(self):
+        self.code = {}
+
+    def get(self, plugin):
+        path = os.path.join(PLUGIN_DIR, plugin)
+        mtime = os.path.getmtime(path)
+        cached = self.code.get(plugin)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'r') as f:
+                cached = (mtime, compile(f.read(), path, 'exec'))
+            self.code[plugin] = cached
+        return cached[1]
+
+
+def plugin_name(name):
+    name = os.path.basename(name)
+    if not name.endswith('.py'):
+        name = "%s.py" % name
+    if name not in PLUGINS:
+        return None
+    return name
+
+
+def exit_code(code):
+    """Exit status of SystemExit(code), the way the interpreter sets it"""
+    if code is None:
+        return 0
+    if isinstance(code, (int, long)):
+        return code
+    sys.stderr.write("%s\n" % code)
+    return 1
+
+
+def run_plugin(code, plugin, argv, timeout):
+    """
+    Run a plugin the way the interpreter runs a script: as __main__, with
+    sys.argv set, capturing stdout & stderr.
+    Returns a tuple: (exit status, stdout, stderr)
+    """
+    path = os.path.join(PLUGIN_DIR, plugin)
+    stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+    sys.stdout, sys.stderr = stdout, stderr
+    sys.argv = [path] + argv
+
+    def on_timeout(signum, frame):
+        raise PluginTimeout()
+    signal.signal(signal.SIGALRM, on_timeout)
+    signal.alarm(timeout)
+    status = 0
+    try:
+        exec code in {'__name__': '__main__', '__file__': path,
+                      '__builtins__': __builtins__}
+    except SystemExit as e:
+        status = exit_code(e.code)
+    except PluginTimeout:
+        stdout.write("UNKNOWN - %s timed out after %ss\n" % (plugin, timeout))
+        status = ST_UK
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        signal.alarm(0)
+        try:
+            sys.stdout.flush()
+        except Exception:
+            pass
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    return (status, stdout.getvalue(), stderr.getvalue())
+
+
+def to_text(value):
+    """Plugin output as unicode, undecodable bytes replaced"""
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def read_request(conn):
+    data = ''
+    while not data.endswith('\n'):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data)
+
+
+def handle_connection(conn, plugin_code, timeout):
+    """Runs in the forked worker"""
+    try:
+        # A client connecting without sending anything doesn't pin a worker
+        conn.settimeout(REQUEST_TIMEOUT)
+        request = read_request(conn)
+        plugin = plugin_name(request.get('plugin', ''))
+        if plugin is None:
+            response = {'exit_status': ST_UK, 'stderr': '',
+                        'stdout': "UNKNOWN - Plugin not served by runner: %s\n"
+                                  % request.get('plugin')}
+        else:
+            status, stdout, stderr = run_plugin(
+                plugin_code.get(plugin), plugin,
+                [str(arg) for arg in request.get('argv', [])], timeout)
+            response = {'exit_status': status, 'stdout': to_text(stdout),
+                        'stderr': to_text(stderr)}
+        data = json.dumps(response)
+    except Exception as e:
+        data = json.dumps({'exit_status': ST_UK, 'stderr': '',
+                           'stdout': "UNKNOWN - Plugin runner failed: %s\n"
+                                     % to_text(str(e))})
+    try:
+        conn.sendall(data + '\n')
+    except socket.error as e:
+        logger.warning("NRPE plugin runner: Sending response failed: %s" % e)
+
+
+def reap_workers(workers):
+    """Forget finished workers, workers is a dict of pid to start time"""
+    while workers:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            break
+        if pid == 0:
+            break
+        workers.pop(pid, None)
+
+
+def kill_stuck_workers(workers, timeout):
+    """SIGKILL workers running for more than timeout seconds"""
+    now = time.time()
+    for pid, start_time in workers.items():
+        if now - start_time <= timeout:
+            continue
+        try:
+            os.kill(pid, signal.SIGKILL)
+            logger.warning("NRPE plugin runner: Killed worker %s, running"
+                           " for %ds" % (pid, now - start_time))
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+        # Reaped by reap_workers() once dead, never killed twice
+        workers[pid] = float('inf')
+
+
+def secure_socket_dir(path):
+    """
+    Create the socket directory 0750 if missing. Refuse a directory of
+    another user or writable by others, where the socket could be replaced
+    """
+    try:
+        os.mkdir(path, SOCKET_DIR_MODE)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    dir_stat = os.lstat(path)
+    if not stat.S_ISDIR(dir_stat.st_mode) or \
+            dir_stat.st_uid != os.getuid() or \
+            dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise OSError(errno.EPERM, "Socket directory %s must be owned by uid"
+                      " %s & not writable by group or others"
+                      % (path, os.getuid()))
+
+
+def listen(path):
+    secure_socket_dir(os.path.dirname(os.path.abspath(path)))
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Created with SOCKET_MODE, not connectable by others even before chmod
+    old_umask = os.umask(0777 & ~SOCKET_MODE)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    os.chmod(path, SOCKET_MODE)
+    server.listen(128)
+    return server
+
+
+def serve(arguments):
+    server = listen(arguments['socket'])
+    plugin_code = PluginCode()
+    for plugin in PLUGINS:
+        plugin_code.get(plugin)
+    workers = {}
+    kill_timeout = arguments['timeout'] + REQUEST_TIMEOUT + KILL_GRACE
+    logger.info("NRPE plugin runner: Listening on %s" % arguments['socket'])
+    # Workers are reaped only here, never in a signal handler, so a worker
+    # can't be reaped before its pid is added to workers
+    while True:
+        reap_workers(workers)
+        kill_stuck_workers(workers, kill_timeout)
+        if len(workers) >= arguments['max_workers']:
+            time.sleep(WORKERS_BUSY_INTERVAL)
+            continue
+        try:
+            readable, _, _ = select.select([server], [], [], REAP_INTERVAL)
+            if not readable:
+                continue
+            conn, _ = server.accept()
+        except (select.error, socket.error) as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        try:
+            pid = os.fork()
+        except OSError as e:
+            logger.critical("NRPE plugin runner: fork failed: %s" % e)
+            conn.close()
+            continue
+        if pid == 0:
+            server.close()
+            try:
+                handle_connection(conn, plugin_code, arguments['timeout'])
+            finally:
+                os._exit(0)
+        conn.close()
+        workers[pid] = time.time()
+
+
+def run():
+    arguments = parse_options(OPTIONS, DESCRIPTION, USAGE, VERSION, DEFAULTS)
+    validate_arguments(arguments)
+    sys.path.insert(0, PLUGIN_DIR)
+    preload_modules()
+    try:
+        serve(arguments)
+    except (OSError, socket.error) as e:
+        logger.critical("NRPE plugin runner: Listening on %s failed: %s"
+                        % (arguments['socket'], e))
+        print "Listening on %s failed: %s" % (arguments['socket'], e)
+        sys.exit(ST_UK)
+
+
+if __name__ == '__main__':
+    run()
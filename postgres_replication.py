@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+#
+# Nagios NRPE plugin for monitoring replication lag between master and slave
+# postgres servers, deployed in both with high frequency. On the master, it
+# updates a heartbeat row every interval for timeout seconds over a single
+# connection, using a prepared statement. On a slave, heartbeat age, receive &
+# replay positions are read in one query & reported as lag in seconds & bytes.
+# Author: Rohit Gupta - @rohit01
+#
+
+import sys
+import time
+import psycopg2
+from optparse import OptionParser
+
+
+__version__ = 1.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+OPTIONS = {
+    'd': "database;Database to be use for this test. Mandatory option",
+    'H': "host;Postgres host. Default: 127.0.0.1",
+    'p': "port;Postgres port. Default: 5432",
+    'U': "user;Postgres user. Default: postgres",
+    'w': "warning;Replication delay warning level in seconds. Default: 100",
+    'c': "critical;Replication delay critical level in seconds." \
+         " Default: 500",
+    'W': "bytes_warning;Replay lag warning level in bytes (received but" \
+         " not replayed WAL). Default: not checked",
+    'C': "bytes_critical;Replay lag critical level in bytes. Default: not" \
+         " checked",
+    't': "timeout;Add data in master db for given seconds. (Applicable only" \
+         " for master db). Default: 59",
+    'i': "interval;Seconds between heartbeats in master db. Default: 1",
+}
+DEFAULTS = {
+    'host': '127.0.0.1',
+    'port': '5432',
+    'user': 'postgres',
+    'warning': '100',
+    'critical': '500',
+    'bytes_warning': None,
+    'bytes_critical': None,
+    'timeout': '59',
+    'interval': '1',
+}
+
+CREATE_TABLE = "CREATE TABLE IF NOT EXISTS repl_monitor (last_monitor_time" \
+    " TIMESTAMP WITHOUT TIME ZONE NOT NULL)"
+# A single heartbeat row, updated in place
+RESET_HEARTBEAT = "DELETE FROM repl_monitor; INSERT INTO repl_monitor VALUES" \
+    " (now())"
+PREPARE_HEARTBEAT = "PREPARE repl_heartbeat AS UPDATE repl_monitor SET" \
+    " last_monitor_time = now()"
+EXECUTE_HEARTBEAT = "EXECUTE repl_heartbeat"
+# Heartbeat age, computed in server local time like the heartbeat itself,
+# with the WAL positions of the slave. Functions were renamed in postgres 10
+REPLICA_QUERY = "SELECT pg_is_in_recovery(), extract(epoch FROM" \
+    " now()::timestamp - (SELECT max(last_monitor_time) FROM repl_monitor))," \
+    " extract(epoch FROM now()), %(receive)s(), %(replay)s()"
+WAL_FUNCTIONS = {
+    'receive': 'pg_last_xlog_receive_location',
+    'replay': 'pg_last_xlog_replay_location',
+}
+WAL_FUNCTIONS_10 = {
+    'receive': 'pg_last_wal_receive_lsn',
+    'replay': 'pg_last_wal_replay_lsn',
+}
+UNDEFINED_TABLE = '42P01'
+
+# Nagios exit status values
+ST_OK = 0
+ST_WR = 1
+ST_CR = 2
+ST_UK = 3
+
+
+def parse_options():
+    parser = OptionParser(version=VERSION)
+    for option, description in OPTIONS.items():
+        shortopt = '-%s' % (option)
+        longopt = '--%s' % (description.split(';')[0])
+        keyname = description.split(';')[0]
+        help = ''
+        if len(description.split(';')) > 1:
+            help = description.split(';')[1]
+        parser.add_option(shortopt, longopt, dest=keyname, help=help)
+    (options, args) = parser.parse_args()
+    arguments = {}
+    for keyname, default in DEFAULTS.items():
+        value = getattr(options, keyname)
+        if value is None or value.strip() == '':
+            value = default
+        arguments[keyname] = value
+    arguments['database'] = options.database
+    return arguments
+
+
+def exit_formalalities(message, exit_status):
+    print message
+    sys.exit(exit_status)
+
+
+def validate_arguments(arguments):
+    if not arguments['database']:
+        raise ValueError("Mandatory option -d/--database not specified")
+    for keyname in ('port', 'warning', 'critical', 'bytes_warning',
+                    'bytes_critical'):
+        if arguments[keyname] is None:
+            continue
+        if not arguments[keyname].isdigit():
+            raise ValueError("Invalid value: '%s' for %s. Possible value:"
+                             " Positive integer" % (arguments[keyname],
+                                                    keyname))
+        arguments[keyname] = int(arguments[keyname])
+    for keyname in 'timeout', 'interval':
+        try:
+            arguments[keyname] = float(arguments[keyname])
+            # A zero interval would write heartbeats in a busy loop
+            if arguments[keyname] < 0 or \
+                    (keyname == 'interval' and arguments[keyname] == 0):
+                raise ValueError()
+        except ValueError:
+            raise ValueError("Invalid value: '%s' for %s. Possible value:"
+                             " Positive number" % (arguments[keyname],
+                                                   keyname))
+    for prefix in '', 'bytes_':
+        warning = arguments['%swarning' % prefix]
+        critical = arguments['%scritical' % prefix]
+        if (warning is None) != (critical is None):
+            raise ValueError("Please set both %swarning & %scritical when you"
+                             " want to use warning/critical thresholds!"
+                             % (prefix, prefix))
+        if warning is not None and warning > critical:
+            raise ValueError("Please adjust your %swarning/critical"
+                             " thresholds. The warning must be lower than"
+                             " the critical level." % prefix)
+
+
+def connect(arguments):
+    connection = psycopg2.connect(host=arguments['host'],
+                                  port=arguments['port'],
+                                  user=arguments['user'],
+                                  database=arguments['database'])
+    connection.autocommit = True
+    return connection
+
+
+def wal_position(location):
+    """Byte position of a WAL location like '16/B374D848'"""
+    high, low = location.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def read_replica_status(connection):
+    """
+    Recovery status, heartbeat age in seconds, current epoch & WAL receive &
+    replay locations, in one round trip. Heartbeat age is None if the
+    heartbeat table or row is missing
+    """
+    if connection.server_version >= 100000:
+        query = REPLICA_QUERY % WAL_FUNCTIONS_10
+    else:
+        query = REPLICA_QUERY % WAL_FUNCTIONS
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query)
+        return cursor.fetchone()
+    except psycopg2.ProgrammingError as e:
+        if e.pgcode != UNDEFINED_TABLE:
+            raise
+        # Master before its first heartbeat
+        cursor.execute("SELECT pg_is_in_recovery(), NULL, extract(epoch FROM"
+                       " now()), NULL, NULL")
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def prepare_heartbeat(connection):
+    cursor = connection.cursor()
+    cursor.execute(CREATE_TABLE)
+    cursor.execute(RESET_HEARTBEAT)
+    cursor.execute(PREPARE_HEARTBEAT)
+    return cursor
+
+
+def write_heartbeats(connection, arguments):
+    """
+    Update the heartbeat every interval seconds for timeout seconds,
+    reconnecting after connection failures.
+    Returns a tuple: (heartbeats written, failures)
+    """
+    start_time = time.time()
+    end_time = start_time + arguments['timeout']
+    heartbeats = 0
+    failures = 0
+    cursor = None
+    while True:
+        try:
+            if connection is None:
+                connection = connect(arguments)
+            if cursor is None:
+                cursor = prepare_heartbeat(connection)
+            else:
+                cursor.execute(EXECUTE_HEARTBEAT)
+            heartbeats += 1
+        except psycopg2.Error:
+            failures += 1
+            try:
+                if connection is not None:
+                    connection.close()
+            except psycopg2.Error:
+                pass
+            connection = None
+            cursor = None
+        next_time = start_time + (heartbeats + failures) * \
+            arguments['interval']
+        # Bounded by the clock as well, a slow reconnect or update must not
+        # keep writing past timeout
+        if next_time > end_time or time.time() >= end_time:
+            break
+        time.sleep(max(next_time - time.time(), 0))
+    if connection is not None:
+        connection.close()
+    return (heartbeats, failures)
+
+
+def check_replica(status, arguments):
+    in_recovery, time_lag, current_epoch, receive, replay = status
+    if time_lag is None:
+        exit_formalalities("UNKNOWN - No heartbeat found in repl_monitor."
+                           " Is the check running in master db?", ST_UK)
+    time_lag = int(time_lag)
+    exit_status = ST_OK
+    if time_lag >= arguments['critical']:
+        exit_status = ST_CR
+    elif time_lag >= arguments['warning']:
+        exit_status = ST_WR
+    output = "Time lag:%s Current time:%d Last monitor time:%d" % (
+        time_lag, current_epoch, current_epoch - time_lag)
+    perf_data = "time_lag=%ss;%s;%s;0" % (time_lag, arguments['warning'],
+                                         arguments['critical'])
+    if receive and replay:
+        replay_lag = max(wal_position(receive) - wal_position(replay), 0)
+        output = "%s Replay lag:%sB" % (output, replay_lag)
+        if arguments['bytes_critical'] is not None:
+            if replay_lag >= arguments['bytes_critical']:
+                exit_status = ST_CR
+            elif replay_lag >= arguments['bytes_warning'] and \
+                    exit_status == ST_OK:
+                exit_status = ST_WR
+            perf_data = "%s replay_lag=%sB;%s;%s;0" % (
+                perf_data, replay_lag, arguments['bytes_warning'],
+                arguments['bytes_critical'])
+        else:
+            perf_data = "%s replay_lag=%sB;;;0" % (perf_data, replay_lag)
+    status_text = {ST_OK: 'OK', ST_WR: 'WARNING', ST_CR: 'CRITICAL'}
+    exit_formalalities("%s - %s | %s" % (status_text[exit_status], output,
+                                         perf_data), exit_status)
+
+
+def run():
+    arguments = parse_options()
+    try:
+        validate_arguments(arguments)
+    except ValueError as e:
+        exit_formalalities("UNKNOWN - %s" % e, ST_UK)
+    try:
+        connection = connect(arguments)
+        status = read_replica_status(connection)
+    except psycopg2.Error as e:
+        exit_formalalities("CRITICAL - Postgres query failed: %s"
+                           % str(e).strip(), ST_CR)
+    if status[0]:
+        connection.close()
+        check_replica(status, arguments)
+    # Master Postgres DB
+    heartbeats, failures = write_heartbeats(connection, arguments)
+    perf_data = "heartbeats=%s;;;0 heartbeat_failures=%s;;;0" % (heartbeats,
+                                                                failures)
+    if not heartbeats:
+        exit_formalalities("CRITICAL - Heartbeat insertion failed | %s"
+                           % perf_data, ST_CR)
+    if failures:
+        exit_formalalities("WARNING - Value inserted in db, %s of %s"
+                           " heartbeats failed | %s" % (
+                               failures, heartbeats + failures, perf_data),
+                           ST_WR)
+    exit_formalalities("OK - Value inserted successfully in db | %s"
+                       % perf_data, ST_OK)
+
+
+if __name__ == '__main__':
+    run()
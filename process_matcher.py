@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+#
+# Nagios NRPE plugin to monitor unusual activities in system processes by
+# matching strings in process command lines & alerting based on the number
+# of matching processes. /proc/*/cmdline is scanned once & all strings of all
+# rules are compiled into one matcher, so many named rules (a rules file) are
+# evaluated in one pass. With --cache_ttl, checks of different rules of one
+# rules file share a scan.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import ConfigParser
+from optparse import OptionParser
+
+
+__version__ = 1.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+OPTIONS = {
+    'm': "mandatory;Comma separated strings which must all be present in" \
+         " the process command line",
+    'o': "optional;Comma separated strings of which at least one must be" \
+         " present in the process command line",
+    'i': "casesensitive;Strings are matched case insensitive if this" \
+         " argument is passed. Default: case sensitive",
+    'w': "warning;Warning level for no of matching processes. Default: 1",
+    'c': "critical;Critical level for no of matching processes. Default: 5",
+    't': "greptype;Possible values: less/more. Default: less. less: less" \
+         " matching processes is better (ok < warning < critical). more:" \
+         " more matching processes is better (critical < warning < ok)",
+    'f': "rules_file;INI file of named rules, one section per rule with" \
+         " keys: mandatory, optional, ignorecase, warning, critical &" \
+         " greptype. All rules are checked, unless --rule is passed",
+    'r': "rule;Check only this rule of rules_file",
+    'T': "cache_ttl;Seconds for which the match counts of all rules of" \
+         " rules_file are cached & shared by checks of other rules." \
+         " Default: 0 (disabled)",
+    'C': "cache_file;Cache file. Default:" \
+         " /var/tmp/process_matcher_cache.json",
+    'e': "each;Comma separated strings, each matched as its own rule." \
+         " Used with --list by scripts",
+    'x': "exclude;Comma separated strings. Processes whose command line" \
+         " contains any of them are not counted",
+    'l': "list;Print '<rule>\\t<count>\\t<pids>' per rule instead of a check" \
+         " result",
+}
+FLAG_OPTIONS = ['casesensitive', 'list']
+DEFAULTS = {
+    'warning': '1',
+    'critical': '5',
+    'greptype': 'less',
+    'cache_ttl': '0',
+    'cache_file': '/var/tmp/process_matcher_cache.json',
+}
+DEFAULT_RULE = 'processes'
+# Command lines of running checks, never counted. They contain the strings
+# searched for, like the 'grep -v' of the ps | grep pipeline did
+CHECK_SCRIPTS = ['process_matcher.py', 'ps_grep_count_monitoring.sh']
+
+# Nagios exit status values
+ST_OK = 0
+ST_WR = 1
+ST_CR = 2
+ST_UK = 3
+STATUS_TEXT = {ST_OK: 'OK', ST_WR: 'WARNING', ST_CR: 'CRITICAL',
+               ST_UK: 'UNKNOWN'}
+
+
+def parse_options():
+    parser = OptionParser(version=VERSION)
+    for option, description in OPTIONS.items():
+        shortopt = '-%s' % (option)
+        longopt = '--%s' % (description.split(';')[0])
+        keyname = description.split(';')[0]
+        help = ''
+        if len(description.split(';')) > 1:
+            help = description.split(';')[1]
+        if keyname in FLAG_OPTIONS:
+            action = 'store_true'
+        else:
+            action = 'store'
+        parser.add_option(shortopt, longopt, dest=keyname, action=action,
+                          help=help)
+    (options, args) = parser.parse_args()
+    return options
+
+
+def exit_formalalities(message, exit_status):
+    print message
+    sys.exit(exit_status)
+
+
+def split_strings(value):
+    return [s.strip() for s in (value or '').split(',') if s.strip()]
+
+
+class ProcessRule(object):
+    """
+    Processes whose command line contains all mandatory strings & at least
+    one optional string (if any), checked against warning & critical counts
+    """
+    def __init__(self, name, mandatory=None, optional=None,
+                 ignore_case=False, warning=1, critical=5, greptype='less'):
+        self.name = name
+        self.ignore_case = ignore_case
+        if ignore_case:
+            mandatory = [s.lower() for s in mandatory or []]
+            optional = [s.lower() for s in optional or []]
+        self.mandatory = mandatory or []
+        self.optional = optional or []
+        self.warning = warning
+        self.critical = critical
+        self.greptype = greptype
+
+    def strings(self):
+        return self.mandatory + self.optional
+
+    def matches(self, cmdline):
+        for s in self.mandatory:
+            if s not in cmdline:
+                return False
+        if not self.optional:
+            return True
+        for s in self.optional:
+            if s in cmdline:
+                return True
+        return False
+
+    def status(self, count):
+        """Returns a tuple: (exit status, message)"""
+        if self.greptype == 'less':
+            sign = '>='
+            reached = lambda level: count >= level
+        else:
+            sign = '<='
+            reached = lambda level: count <= level
+        if reached(self.critical):
+            return (ST_CR, "CRITICAL - No of matching process: %s (%s %s %s"
+                    " CR)" % (count, count, sign, self.critical))
+        if reached(self.warning):
+            return (ST_WR, "WARNING - No of matching process: %s (%s %s %s"
+                    " WR)" % (count, count, sign, self.warning))
+        return (ST_OK, "OK - No of matching process: %s" % count)
+
+    def perf_data(self, count):
+        return "'%s'=%s;%s;%s;0" % (self.name, count, self.warning,
+                                    self.critical)
+
+
+def make_rule(name, mandatory, optional, ignore_case, warning, critical,
+              greptype):
+    """ProcessRule from option/rules file values, or ValueError"""
+    mandatory = split_strings(mandatory)
+    optional = split_strings(optional)
+    if not mandatory and not optional:
+        raise ValueError("At least one among mandatory/optional should be"
+                         " specified")
+    for keyname, value in ('warning', warning), ('critical', critical):
+        if not re.match(r'^[0-9]+$', str(value).strip()):
+            raise ValueError("Invalid value: '%s' for %s. Possible value:"
+                             " Positive integer" % (value, keyname))
+    warning, critical = int(warning), int(critical)
+    if greptype not in ('less', 'more'):
+        raise ValueError("Invalid value: '%s' for greptype. Possible value:"
+                         " less,more" % greptype)
+    if greptype == 'less' and warning > critical:
+        raise ValueError("Parameter Error: warning: '%s' must be greater"
+                         " than critical: '%s'" % (warning, critical))
+    if greptype == 'more' and warning < critical:
+        raise ValueError("Parameter Error: warning: '%s' must be less than"
+                         " critical: '%s'" % (warning, critical))
+    return ProcessRule(name, mandatory, optional, ignore_case, warning,
+                       critical, greptype)
+
+
+def load_rules(path):
+    """Rules of an INI rules file, in file order"""
+    parser = ConfigParser.RawConfigParser()
+    if not parser.read(path):
+        raise ValueError("Rules file '%s' not readable" % path)
+    rules = []
+    for name in parser.sections():
+        def get(key, default=None):
+            if parser.has_option(name, key):
+                return parser.get(name, key)
+            return default
+        ignore_case = get('ignorecase', 'false').lower() in ('true', 'yes',
+                                                             'y', '1')
+        try:
+            rules.append(make_rule(
+                name, get('mandatory'), get('optional'), ignore_case,
+                get('warning', DEFAULTS['warning']),
+                get('critical', DEFAULTS['critical']),
+                get('greptype', DEFAULTS['greptype'])))
+        except ValueError as e:
+            raise ValueError("Rule [%s]: %s" % (name, e))
+    return rules
+
+
+class ProcessMatcher(object):
+    """
+    Strings of all rules compiled into one regex per case mode. A command
+    line is only checked rule by rule if the regex finds any string in it,
+    which most command lines fail at once
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        self.regex = self.compile(rules, False)
+        self.regex_ignore_case = self.compile(rules, True)
+
+    def compile(self, rules, ignore_case):
+        strings = set()
+        for rule in rules:
+            if rule.ignore_case == ignore_case:
+                strings.update(rule.strings())
+        if not strings:
+            return None
+        # Longest first, so a string is not shadowed by its prefix
+        return re.compile('|'.join(re.escape(s) for s in sorted(
+            strings, key=len, reverse=True)))
+
+    def match(self, cmdline):
+        """Names of the rules matching cmdline"""
+        lower_cmdline = None
+        if self.regex_ignore_case is not None:
+            lower_cmdline = cmdline.lower()
+            if not self.regex_ignore_case.search(lower_cmdline):
+                lower_cmdline = None
+        if lower_cmdline is None and (self.regex is None or
+                                      not self.regex.search(cmdline)):
+            return []
+        names = []
+        for rule in self.rules:
+            if rule.ignore_case:
+                if lower_cmdline is not None and rule.matches(lower_cmdline):
+                    names.append(rule.name)
+            elif rule.matches(cmdline):
+                names.append(rule.name)
+        return names
+
+
+def own_pids():
+    """This process & its ancestors, e.g. the shell running this check"""
+    pids = set()
+    pid = os.getpid()
+    while pid > 1 and pid not in pids:
+        pids.add(pid)
+        try:
+            with open('/proc/%s/stat' % pid, 'r') as f:
+                # Process name may contain spaces, ppid follows its ')'
+                pid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, IndexError, ValueError):
+            break
+    return pids
+
+
+def scan_processes():
+    """
+    Yields (pid, command line) of all processes, with arguments separated by
+    space like ps. Kernel threads have no command line & are named [comm]
+    """
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/cmdline' % entry, 'rb') as f:
+                cmdline = f.read().replace('\0', ' ').strip()
+            if not cmdline:
+                with open('/proc/%s/comm' % entry, 'r') as f:
+                    cmdline = '[%s]' % f.read().strip()
+        except IOError:
+            # Process exited while scanning
+            continue
+        yield (int(entry), cmdline)
+
+
+def match_processes(rules, exclude=None):
+    """
+    Scan processes once for all rules, skipping this check, other running
+    instances of it & processes containing any of the exclude strings.
+    Returns a dict of rule name to list of matching pids
+    """
+    matcher = ProcessMatcher(rules)
+    excluded = own_pids()
+    matches = dict((rule.name, []) for rule in rules)
+    for pid, cmdline in scan_processes():
+        if pid in excluded:
+            continue
+        if any(s in cmdline for s in CHECK_SCRIPTS):
+            continue
+        if exclude and any(s in cmdline for s in exclude):
+            continue
+        for name in matcher.match(cmdline):
+            matches[name].append(pid)
+    return matches
+
+
+def read_cache(cache_file):
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+        if isinstance(cache, dict):
+            return cache
+    except (IOError, ValueError):
+        pass
+    return {}
+
+
+def cached_match_processes(rules, rules_file, cache_file, cache_ttl,
+                           exclude=None):
+    """
+    match_processes() of all rules of a rules file, shared by all checks
+    using it for cache_ttl seconds. Only one check scans at a time, the
+    others wait on its lock & read its result
+    """
+    if cache_ttl <= 0:
+        return match_processes(rules, exclude)
+    key = "%s:%s:%s" % (os.path.abspath(rules_file),
+                        os.path.getmtime(rules_file), ','.join(exclude or []))
+
+    def fresh(entry):
+        return isinstance(entry, dict) and \
+            time.time() - entry.get('time', 0) < cache_ttl
+
+    entry = read_cache(cache_file).get(key)
+    if fresh(entry):
+        return entry['matches']
+    with open('%s.lock' % cache_file, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Another check may have scanned while we waited
+            cache = read_cache(cache_file)
+            if fresh(cache.get(key)):
+                return cache[key]['matches']
+            matches = match_processes(rules, exclude)
+            # Keep fresh entries of other rules files
+            cache = dict((k, v) for k, v in cache.items() if fresh(v))
+            cache[key] = {'time': time.time(), 'matches': matches}
+            temp_file = "%s.%s.tmp" % (cache_file, os.getpid())
+            with open(temp_file, 'w') as f:
+                json.dump(cache, f)
+            os.rename(temp_file, cache_file)
+            return matches
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_rules(options):
+    """Rules to check & all rules to scan for, from options"""
+    ignore_case = bool(options.casesensitive)
+    if options.rules_file:
+        all_rules = load_rules(options.rules_file)
+        if not options.rule:
+            return (all_rules, all_rules)
+        rules = [rule for rule in all_rules if rule.name == options.rule]
+        if not rules:
+            raise ValueError("Rule '%s' not found in %s" % (
+                options.rule, options.rules_file))
+        return (rules, all_rules)
+    if options.each:
+        rules = [make_rule(s, s, None, ignore_case, DEFAULTS['warning'],
+                           DEFAULTS['critical'], DEFAULTS['greptype'])
+                 for s in split_strings(options.each)]
+        if not rules:
+            raise ValueError("Invalid value: '%s' for option -e/--each"
+                             % options.each)
+        return (rules, rules)
+    if not split_strings(options.mandatory) and \
+            not split_strings(options.optional):
+        raise ValueError("At least one argument among --mandatory/--optional"
+                         " should be specified. Use option -h for more"
+                         " details")
+    rule = make_rule(DEFAULT_RULE, options.mandatory, options.optional,
+                     ignore_case, options.warning or DEFAULTS['warning'],
+                     options.critical or DEFAULTS['critical'],
+                     options.greptype or DEFAULTS['greptype'])
+    return ([rule], [rule])
+
+
+def run():
+    options = parse_options()
+    try:
+        rules, all_rules = get_rules(options)
+        cache_ttl = float(options.cache_ttl or DEFAULTS['cache_ttl'])
+    except (ValueError, ConfigParser.Error) as e:
+        exit_formalalities("UNKNOWN - %s" % e, ST_UK)
+    exclude = split_strings(options.exclude)
+    try:
+        if options.rules_file:
+            matches = cached_match_processes(
+                all_rules, options.rules_file,
+                options.cache_file or DEFAULTS['cache_file'], cache_ttl,
+                exclude)
+        else:
+            matches = match_processes(all_rules, exclude)
+    except (IOError, OSError) as e:
+        exit_formalalities("CRITICAL - Reading process list failed: %s" % e,
+                           ST_CR)
+    if options.list:
+        for rule in rules:
+            pids = matches.get(rule.name, [])
+            print "%s\t%s\t%s" % (rule.name, len(pids),
+                                  ','.join(str(pid) for pid in pids))
+        sys.exit(ST_OK)
+    if len(rules) == 1:
+        count = len(matches.get(rules[0].name, []))
+        exit_status, message = rules[0].status(count)
+        exit_formalalities("%s | %s" % (message, rules[0].perf_data(count)),
+                           exit_status)
+    # All rules of a rules file: summary, then one line per rule
+    exit_status = ST_OK
+    status_count = dict((status, 0) for status in STATUS_TEXT)
+    perf_data = []
+    details = []
+    for rule in rules:
+        count = len(matches.get(rule.name, []))
+        status, message = rule.status(count)
+        status_count[status] += 1
+        if status == ST_CR or (status == ST_WR and exit_status != ST_CR):
+            exit_status = status
+        perf_data.append(rule.perf_data(count))
+        details.append("%s: %s" % (rule.name, message))
+    summary = ', '.join("%s %s" % (status_count[status], STATUS_TEXT[status])
+                        for status in (ST_OK, ST_WR, ST_CR)
+                        if status_count[status])
+    exit_formalalities("%s - Process rules: %s checked, %s | %s\n%s" % (
+        STATUS_TEXT[exit_status], len(rules), summary, ' '.join(perf_data),
+        '\n'.join(details)), exit_status)
+
+
+if __name__ == '__main__':
+    run()
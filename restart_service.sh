@@ -11,6 +11,7 @@ ST_UK=3
 
 AUTHOR="Rohit Gupta - @rohit01"
 PROGNAME=`basename $0`
+PROGDIR=`dirname $0`
 VERSION="Version 1.0,"
 
 print_version() {
@@ -206,95 +207,69 @@ fi
 # Add current timestamp in lockfile
 date +%s > $LOCK_FILENAME
 
-## Set port type filter ##
-if [ "X${connectiontype}" = 'Xtcp' ]; then
-    type_filter='t'
-elif [ "X${connectiontype}" = 'Xudp' ]; then
-    type_filter='u'
-elif [ "X${connectiontype}" = 'Xtcp,udp' ]; then
-    type_filter='tu'
-else
-    type_filter='tu'
-fi
+inspect_ports() {
+    # socket_inspector.py for the ports, with any extra arguments passed.
+    # 'anyport' is any listening port of the service processes
+    if [ "X${ports}" = "Xanyport" ]; then
+        python "${PROGDIR}/socket_inspector.py" -p "${ports}" \
+            -t "${connectiontype}" -g "${grepnames}" -x "${PROGNAME}" "$@"
+    else
+        python "${PROGDIR}/socket_inspector.py" -p "${ports}" \
+            -t "${connectiontype}" "$@"
+    fi
+}
 
 
 check_port() {
-    if [ "X${ports}" = "Xanyport" ]; then
-        netstat -ln${type_filter} | grep "^.*${ports}.*$" >/dev/null
-        if [ $? -ne 0 ]; then
-            echo "${NOT_LISTENING}"
-        else
-            echo "${LISTENING}"
-        fi
+    if echo "${ports}" | grep "^\s*$" >/dev/null; then
+        echo "${NOT_CONFIGURED}"
+        return
+    fi
+    # Listening status of all ports, in one read of /proc/net
+    states=$(inspect_ports -l | cut -f 2)
+    listening=$(echo "${states}" | grep -c "^LISTEN$")
+    not_listening=$(echo "${states}" | grep -c "^NOT LISTENING$")
+    if [ ${listening} -eq 0 ] && [ ${not_listening} -eq 0 ]; then
+        echo "${NOT_CONFIGURED}"
+    elif [ ${not_listening} -eq 0 ]; then
+        echo "${LISTENING}"
+    elif [ ${listening} -eq 0 ]; then
+        echo "${NOT_LISTENING}"
     else
-        TEMP_PORT_CHECK_FILE="/tmp/._restart_service_${servicename}_${RANDOM}.port"
-        echo '' > ${TEMP_PORT_CHECK_FILE}
-        echo ${ports} | tr ',' '\n' | while read port_no; do
-            if [ "X${port_no}" = "X" ]; then
-                continue
-            fi
-            message=$(cat ${TEMP_PORT_CHECK_FILE} | sed 's/^ *//g' | sed 's/ *$//g')
+        echo "${PARTIALLY_LISTENING}"
+    fi
+}
 
-            netstat -ln${type_filter} | tr -s " " | cut -d " " -f 4 \
-                | grep ":$port_no$" >/dev/null
-            if [ $? -ne 0 ]; then
-                if [ "X${message}" = "X" ]; then
-                    echo ${NOT_LISTENING} > ${TEMP_PORT_CHECK_FILE}
-                elif [ "X${message}" = "X${LISTENING}" ]; then
-                    echo ${PARTIALLY_LISTENING} > ${TEMP_PORT_CHECK_FILE}
-                fi
-            else
-                if [ "X${message}" = "X" ]; then
-                    echo ${LISTENING} > ${TEMP_PORT_CHECK_FILE}
-                elif [ "X${message}" = "X${NOT_LISTENING}" ]; then
-                    echo ${PARTIALLY_LISTENING} > ${TEMP_PORT_CHECK_FILE}
-                fi
-            fi
-        done
-        message=$(cat ${TEMP_PORT_CHECK_FILE} | sed 's/^ *//g' | sed 's/ *$//g')
-        if [ "X${message}" = "X" ]; then
-            echo "${NOT_CONFIGURED}"
-        else
-            echo "${message}"
-        fi
-        rm -f ${TEMP_PORT_CHECK_FILE}
+
+wait_for_service() {
+    # Return as soon as all ports are listening, waiting at most waitforport
+    # seconds. Without ports, wait the full time for the service to start
+    if echo "${ports}" | grep "^\s*$" >/dev/null; then
+        sleep "${waitforport}"
+    else
+        inspect_ports -W -d "${waitforport}" >/dev/null || true
     fi
 }
 
 
 check_process() {
-    TEMP_PROCESS_CHECK_FILE="/tmp/._restart_service_${servicename}_${RANDOM}.process"
-    echo '' > ${TEMP_PROCESS_CHECK_FILE}
-    echo ${grepnames} | tr ',' '\n' | while read grep_string; do
-        if [ "X${grep_string}" = "X" ]; then
-            continue
-        fi
-        message=$(cat ${TEMP_PROCESS_CHECK_FILE} | sed 's/^ *//g' | sed 's/ *$//g')
-        ps aux | grep "${grep_string}" | grep -v grep | grep -v ${PROGNAME} \
-            >/dev/null
-        if [ $? -ne 0 ]; then
-            if [ "X${message}" = "X" ]; then
-                echo ${NOT_RUNNING} > ${TEMP_PROCESS_CHECK_FILE}
-            elif [ "X${message}" = "X${RUNNING}" ]; then
-                echo ${PARTIALLY_RUNNING} > ${TEMP_PROCESS_CHECK_FILE}
-            fi
-        else
-            if [ "X${message}" = "X" ]; then
-                echo ${RUNNING} > ${TEMP_PROCESS_CHECK_FILE}
-            elif [ "X${message}" = "X${NOT_RUNNING}" ]; then
-                echo ${PARTIALLY_RUNNING} > ${TEMP_PROCESS_CHECK_FILE}
-            fi
-        fi
-    done
-    message=$(cat ${TEMP_PROCESS_CHECK_FILE} | sed 's/^ *//g' | sed 's/ *$//g')
-    if [ "X${message}" = "X" ]; then
+    # Process counts of all grep strings, in one scan of /proc
+    counts=$(python "${PROGDIR}/process_matcher.py" -e "${grepnames}" \
+             -x "${PROGNAME}" -l | cut -f 2)
+    if [ "X${counts}" = "X" ]; then
         echo "UNKNOWN - invalid grepnames argument: '${grepnames}'. Script" \
              " error"
         exit ${ST_UK}
+    fi
+    running=$(echo "${counts}" | grep -v -c "^0$")
+    not_running=$(echo "${counts}" | grep -c "^0$")
+    if [ ${not_running} -eq 0 ]; then
+        echo ${RUNNING}
+    elif [ ${running} -eq 0 ]; then
+        echo ${NOT_RUNNING}
     else
-        echo "${message}"
+        echo ${PARTIALLY_RUNNING}
     fi
-    rm -f ${TEMP_PROCESS_CHECK_FILE}
 }
 
 
@@ -302,9 +277,9 @@ kill_running_service() {
     TEMP_KILL_SERVICE_FILE="/tmp/._restart_service_${servicename}_${RANDOM}.kill.service"
     echo '' > ${TEMP_KILL_SERVICE_FILE}
     if echo "${servicename}" | grep -v "^\s*$" >/dev/null; then
-        ps aux | grep "${servicename}" | grep -v grep | grep -v ${PROGNAME} \
-        | tr -s " " | cut -d " " -f 2 | while read pid
-        do
+        for pid in $(python "${PROGDIR}/process_matcher.py" \
+                -e "${servicename}" -x "${PROGNAME}" -l | cut -f 3 \
+                | tr ',' ' '); do
             kill -9 ${pid} >/dev/null || true
             echo '[Killed service]' > ${TEMP_KILL_SERVICE_FILE}
         done
@@ -318,18 +293,14 @@ kill_running_service() {
 
 kill_running_process_in_port() {
     TEMP_PORT_KILL_FILE="/tmp/._restart_service_${servicename}_${RANDOM}.kill.port"
-    echo "${ports}" | tr ',' '\n' | while read port_no; do
-        if [ "X${port_no}" = "X" ]; then
-            continue
-        fi
-        netstat -lnp${type_filter} | grep -v grep | grep -v ${PROGNAME} \
-        | tr -s " " | cut -d " " -f 4,7 | grep ":${port_no} .*$" \
-        | cut -d" " -f 2 | cut -d"/" -f 1 | while read pid
-        do
+    echo '' > ${TEMP_PORT_KILL_FILE}
+    if [ "X${ports}" != "Xanyport" ] \
+            && echo "${ports}" | grep -v "^\s*$" >/dev/null; then
+        for pid in $(inspect_ports -l | cut -f 3 | tr ',' ' '); do
             kill -9 ${pid} >/dev/null || true
             echo '[Killed process in Port]' > ${TEMP_PORT_KILL_FILE}
         done
-    done
+    fi
     if [ "X${port_kill_message}" = 'X' ]; then
         port_kill_message=$(cat ${TEMP_PORT_KILL_FILE} | sed 's/^ *//g' | sed 's/ *$//g')
     fi
@@ -348,7 +319,7 @@ restart_service() {
             | grep -e "^true$" -e "^yes$" -e "^y$" >/dev/null; then
         ${restart_command} >/dev/null || true
         executed_restart_command='true'
-        sleep "${waitforport}"
+        wait_for_service
     fi
     exit_status=${ST_CR}
     for i in $(seq ${nretry}); do
@@ -370,7 +341,7 @@ restart_service() {
         fi
         ${restart_command} >/dev/null || true
         executed_restart_command='true'
-        sleep "${waitforport}"
+        wait_for_service
     done
 }
 
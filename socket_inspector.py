@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+#
+# Nagios NRPE plugin to check weather the given ports are listening to
+# TCP/UDP connections, by parsing /proc/net/tcp, tcp6, udp & udp6 once for
+# all ports instead of running netstat. With --wait, polls with backoff until
+# all ports are listening or the deadline passes, for use after a service
+# restart.
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+
+__version__ = 1.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+OPTIONS = {
+    'p': "ports;Port numbers separated by comma. Pass 'anyport' to check" \
+         " for any listening port, of the --owner processes if passed",
+    't': "connectiontype;Port type on which service listens. Possible" \
+         " values: tcp, udp, {tcp,udp}. Default: tcp,udp",
+    'g': "owner;Comma separated strings. Only count sockets of processes" \
+         " whose command line contains any of them",
+    'x': "exclude;Comma separated strings. Owner processes whose command" \
+         " line contains any of them are not counted",
+    'W': "wait;Wait until all ports are listening, up to --deadline seconds",
+    'd': "deadline;Seconds to wait for with --wait. Default: 10",
+    'l': "list;Print '<port>\\t<LISTEN|NOT LISTENING>\\t<pids>' per port" \
+         " instead of a check result",
+}
+FLAG_OPTIONS = ['wait', 'list']
+DEFAULTS = {
+    'connectiontype': 'tcp,udp',
+    'deadline': '10',
+}
+ANY_PORT = 'anyport'
+
+# Settings
+PROC_NET_FILES = {
+    'tcp': ['/proc/net/tcp', '/proc/net/tcp6'],
+    'udp': ['/proc/net/udp', '/proc/net/udp6'],
+}
+# Socket states in /proc/net/*. UDP sockets bound & not connected are in
+# state CLOSE, these are the sockets netstat -lu lists
+LISTEN_STATE = {
+    'tcp': '0A',
+    'udp': '07',
+}
+# Fields of a socket line in /proc/net/*
+LOCAL_ADDRESS = 1
+STATE = 3
+INODE = 9
+# Polling intervals of --wait, doubled after every poll
+WAIT_INTERVAL_START = 0.05
+WAIT_INTERVAL_MAX = 1.0
+
+# Nagios exit status values
+ST_OK = 0
+ST_WR = 1
+ST_CR = 2
+ST_UK = 3
+
+
+def parse_options():
+    parser = OptionParser(version=VERSION)
+    for option, description in OPTIONS.items():
+        shortopt = '-%s' % (option)
+        longopt = '--%s' % (description.split(';')[0])
+        keyname = description.split(';')[0]
+        help = ''
+        if len(description.split(';')) > 1:
+            help = description.split(';')[1]
+        if keyname in FLAG_OPTIONS:
+            action = 'store_true'
+        else:
+            action = 'store'
+        parser.add_option(shortopt, longopt, dest=keyname, action=action,
+                          help=help)
+    (options, args) = parser.parse_args()
+    return options
+
+
+def exit_formalalities(message, exit_status):
+    print message
+    sys.exit(exit_status)
+
+
+def split_strings(value):
+    return [s.strip() for s in (value or '').split(',') if s.strip()]
+
+
+def validate_options(options):
+    ports = split_strings(options.ports)
+    if not ports:
+        raise ValueError("Mandatory option -p/--ports not specified")
+    if ports != [ANY_PORT]:
+        if not all(p.isdigit() for p in ports):
+            raise ValueError("Invalid value: '%s' for option -p/--ports."
+                             " Possible values: integer separated by comma"
+                             % options.ports)
+        ports = [int(p) for p in ports]
+    options.ports = ports
+    connectiontype = options.connectiontype or DEFAULTS['connectiontype']
+    options.connectiontype = split_strings(connectiontype)
+    if not options.connectiontype or \
+            any(t not in PROC_NET_FILES for t in options.connectiontype):
+        raise ValueError("Invalid value: '%s' for option -t/--connectiontype."
+                         " Possible values: tcp, udp, {tcp,udp}. Default:"
+                         " tcp,udp" % connectiontype)
+    options.deadline = float(options.deadline or DEFAULTS['deadline'])
+    options.owner = split_strings(options.owner)
+    options.exclude = split_strings(options.exclude)
+
+
+def listening_sockets(connectiontypes):
+    """
+    Listening sockets of the given connection types, parsed in one pass over
+    each /proc/net file.
+    Returns a dict of port to set of socket inodes
+    """
+    sockets = {}
+    for connectiontype in connectiontypes:
+        listen_state = LISTEN_STATE[connectiontype]
+        for path in PROC_NET_FILES[connectiontype]:
+            try:
+                f = open(path, 'r')
+            except IOError:
+                # No IPv6 support
+                continue
+            with f:
+                f.readline()
+                for line in f:
+                    fields = line.split()
+                    if len(fields) <= INODE or fields[STATE] != listen_state:
+                        continue
+                    port = int(fields[LOCAL_ADDRESS].rsplit(':', 1)[1], 16)
+                    sockets.setdefault(port, set()).add(fields[INODE])
+    return sockets
+
+
+def socket_owners(inodes, pids=None):
+    """
+    Processes having any of the socket inodes open, looking at pids only if
+    passed. Processes of other users are skipped unless run as root.
+    Returns a dict of inode to set of pids
+    """
+    owners = {}
+    if not inodes:
+        return owners
+    targets = set("socket:[%s]" % inode for inode in inodes)
+    if pids is None:
+        pids = [int(entry) for entry in os.listdir('/proc') if entry.isdigit()]
+    for pid in pids:
+        fd_dir = '/proc/%s/fd' % pid
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            # Exited or not permitted
+            continue
+        for fd in fds:
+            try:
+                link = os.readlink('%s/%s' % (fd_dir, fd))
+            except OSError:
+                continue
+            if link in targets:
+                owners.setdefault(link[8:-1], set()).add(pid)
+    return owners
+
+
+def owner_pids(owner, exclude):
+    """Pids of processes whose command line contains any owner string"""
+    import process_matcher
+    rules = [process_matcher.make_rule(s, s, None, False, 0, 0, 'less')
+             for s in owner]
+    matches = process_matcher.match_processes(rules, exclude)
+    pids = set()
+    for rule_pids in matches.values():
+        pids.update(rule_pids)
+    return pids
+
+
+def check_ports(options, with_pids=False):
+    """
+    Returns a list of (port, listening, pids) for the ports passed, pids
+    being resolved only if with_pids or owner strings are passed
+    """
+    sockets = listening_sockets(options.connectiontype)
+    if options.ports == [ANY_PORT]:
+        ports = [(ANY_PORT, set().union(*sockets.values()))]
+    else:
+        ports = [(port, sockets.get(port, set())) for port in options.ports]
+    owners = {}
+    if with_pids or options.owner:
+        pids = None
+        if options.owner:
+            pids = owner_pids(options.owner, options.exclude)
+        owners = socket_owners(set().union(*[i for p, i in ports]), pids)
+    result = []
+    for port, inodes in ports:
+        if options.owner:
+            # Only sockets opened by the owner processes
+            inodes = [inode for inode in inodes if inode in owners]
+        port_pids = set()
+        for inode in inodes:
+            port_pids.update(owners.get(inode, ()))
+        result.append((port, bool(inodes), sorted(port_pids)))
+    return result
+
+
+def wait_for_ports(options, with_pids=False):
+    """
+    Check ports until all are listening or options.deadline seconds passed,
+    sleeping with exponential backoff between checks.
+    Returns a tuple: (result of the last check, seconds waited)
+    """
+    start_time = time.time()
+    deadline = start_time + options.deadline
+    interval = WAIT_INTERVAL_START
+    while True:
+        result = check_ports(options, with_pids)
+        now = time.time()
+        if all(listening for port, listening, pids in result) or \
+                now >= deadline:
+            return (result, now - start_time)
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * 2, WAIT_INTERVAL_MAX)
+
+
+def run():
+    options = parse_options()
+    try:
+        validate_options(options)
+    except ValueError as e:
+        exit_formalalities("UNKNOWN - %s" % e, ST_UK)
+    waited = None
+    try:
+        if options.wait:
+            result, waited = wait_for_ports(options, options.list)
+        else:
+            result = check_ports(options, options.list)
+    except (IOError, OSError) as e:
+        exit_formalalities("UNKNOWN - Reading sockets failed: %s" % e, ST_UK)
+    if options.list:
+        for port, listening, pids in result:
+            print "%s\t%s\t%s" % (port, 'LISTEN' if listening else
+                                  'NOT LISTENING',
+                                  ','.join(str(pid) for pid in pids))
+        sys.exit(ST_OK)
+    exit_status = ST_OK
+    message = []
+    for port, listening, pids in result:
+        if listening:
+            message.append("Port: %s - LISTEN" % port)
+        else:
+            message.append("Port: %s - NOT LISTENING" % port)
+            exit_status = ST_CR
+    perf_data = "'listening_ports'=%s;;;0;%s" % (
+        len([r for r in result if r[1]]), len(result))
+    if waited is not None:
+        message.append("Waited %.2fs" % waited)
+        perf_data = "%s 'wait_time'=%.3fs;;;0;%g" % (perf_data, waited,
+                                                     options.deadline)
+    exit_formalalities("%s - %s | %s" % (
+        'OK' if exit_status == ST_OK else 'CRITICAL', '; '.join(message),
+        perf_data), exit_status)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+# Tests of SES region selection, failover & hedged sends of aws_ses_email.py
+# against the fake SES connections of benchmarks/standins.py
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, 'benchmarks')]
+import standins
+import boto.exception
+import aws_ses_email
+
+
+class RecordingSESConnection(standins.FakeSESConnection):
+    """Fake SES connection recording the threads of its sends"""
+    def __init__(self, latency=0, error=None):
+        standins.FakeSESConnection.__init__(self, latency)
+        self.error = error
+        self.threads = []
+
+    def send_email(self, *args, **kwargs):
+        self.threads.append(threading.current_thread().name)
+        if self.error is not None:
+            time.sleep(self.latency)
+            raise self.error
+        return standins.FakeSESConnection.send_email(self, *args, **kwargs)
+
+
+def rejected(error_code):
+    error = boto.exception.BotoServerError(400, 'Bad Request')
+    error.error_code = error_code
+    return error
+
+
+class LogRecorder(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class SendEmailTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.stats_file = os.path.join(self.work_dir, 'region_stats.json')
+        self.log = LogRecorder()
+        aws_ses_email.logger.addHandler(self.log)
+
+    def tearDown(self):
+        aws_ses_email.logger.removeHandler(self.log)
+        shutil.rmtree(self.work_dir)
+
+    def arguments(self, regions, **kwargs):
+        arguments = {
+            'aws_region': regions,
+            'aws_access_key_id': 'key',
+            'aws_secret_access_key': 'secret',
+            'from_address': 'nagios@example.com',
+            'to': 'ops@example.com',
+            'region_stats_file': self.stats_file,
+        }
+        arguments.update(kwargs)
+        aws_ses_email.validate_arguments(arguments)
+        return arguments
+
+    def prefer(self, *regions):
+        """Stats making regions the likely picks, in order"""
+        now = time.time()
+        stats = dict((region, {'latency': 0.001 * 100 ** i,
+                               'error_rate': 0.0, 'updated': now})
+                     for i, region in enumerate(regions))
+        with open(self.stats_file, 'w') as f:
+            json.dump(stats, f)
+
+    def read_stats(self):
+        with open(self.stats_file, 'r') as f:
+            return json.load(f)
+
+    def test_stats_saved_after_send(self):
+        connections = {'us-east-1': RecordingSESConnection(0.05)}
+        aws_ses_email.send_email(self.arguments('us-east-1'), 'subject',
+                                 'body', connections=connections)
+        entry = self.read_stats()['us-east-1']
+        self.assertGreaterEqual(entry['latency'], 0.05)
+        self.assertEqual(entry['error_rate'], 0.0)
+
+    def test_select_region_prefers_fast_regions(self):
+        now = time.time()
+        stats = {'fast': {'latency': 0.01, 'error_rate': 0.0, 'updated': now},
+                 'slow': {'latency': 1.0, 'error_rate': 0.0, 'updated': now}}
+        picks = [aws_ses_email.select_region('slow,fast', stats=stats)
+                 for i in xrange(1000)]
+        self.assertGreater(picks.count('fast'), 950)
+        # Regions without recent stats get the best weight, that of fast
+        picks = [aws_ses_email.select_region('slow,fast,new', stats=stats)
+                 for i in xrange(1000)]
+        self.assertLess(picks.count('slow'), 50)
+        self.assertGreater(picks.count('new'), 350)
+
+    def test_failover_records_region_error(self):
+        self.prefer('bad', 'good')
+        connections = {'bad': RecordingSESConnection(error=IOError('down')),
+                       'good': RecordingSESConnection()}
+        aws_ses_email.send_email(self.arguments('bad,good'), 'subject',
+                                 'body', connections=connections)
+        self.assertEqual(len(connections['good'].threads), 1)
+        stats = self.read_stats()
+        self.assertGreater(stats['bad']['error_rate'], 0)
+        self.assertEqual(stats['good']['error_rate'], 0)
+
+    def test_all_regions_failing(self):
+        connections = {'us-east-1': RecordingSESConnection(
+            error=IOError('down'))}
+        self.assertRaises(Exception, aws_ses_email.send_email,
+                          self.arguments('us-east-1'), 'subject', 'body',
+                          connections=connections)
+
+    def test_rejected_email_is_not_failed_over(self):
+        self.prefer('first', 'second')
+        connections = {
+            'first': RecordingSESConnection(error=rejected('MessageRejected')),
+            'second': RecordingSESConnection(),
+        }
+        self.assertRaises(aws_ses_email.PermanentSendError,
+                          aws_ses_email.send_email,
+                          self.arguments('first,second'), 'subject', 'body',
+                          connections=connections)
+        self.assertEqual(connections['second'].threads, [])
+        # Not a fault of the region
+        self.assertEqual(self.read_stats()['first']['error_rate'], 0)
+
+    def test_missing_destination_is_permanent(self):
+        arguments = self.arguments('us-east-1', to='')
+        self.assertRaises(aws_ses_email.PermanentSendError,
+                          aws_ses_email.send_email, arguments, 'subject',
+                          'body', connections={})
+
+    def test_hedged_send_uses_second_region(self):
+        self.prefer('slow', 'fast')
+        connections = {'slow': RecordingSESConnection(1.0),
+                       'fast': RecordingSESConnection()}
+        start_time = time.time()
+        aws_ses_email.send_email(
+            self.arguments('slow,fast', hedge_after='0.05'), 'subject',
+            'body', connections=connections)
+        self.assertLess(time.time() - start_time, 0.5)
+        self.assertEqual(len(connections['slow'].threads), 1)
+        self.assertEqual(len(connections['fast'].threads), 1)
+        self.assertEqual(len([m for m in self.log.messages
+                              if 'hedging' in m]), 1)
+
+    def test_no_hedging_without_another_region(self):
+        connections = {'us-east-1': RecordingSESConnection(0.3)}
+        aws_ses_email.send_email(
+            self.arguments('us-east-1', hedge_after='0.05'), 'subject',
+            'body', connections=connections)
+        self.assertEqual([m for m in self.log.messages if 'hedging' in m],
+                         [])
+
+    def test_sent_in_calling_thread_without_hedging(self):
+        connections = {'us-east-1': RecordingSESConnection()}
+        aws_ses_email.send_email(self.arguments('us-east-1'), 'subject',
+                                 'body', connections=connections)
+        self.assertEqual(connections['us-east-1'].threads,
+                         [threading.current_thread().name])
+
+    def test_invalid_hedge_after(self):
+        for value in '0', '-1', 'soon':
+            self.assertRaises(ValueError, self.arguments, 'us-east-1',
+                              hedge_after=value)
+        self.assertEqual(self.arguments('us-east-1',
+                                        hedge_after='0.5')['hedge_after'], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
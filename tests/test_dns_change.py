@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+#
+# Tests of DNS message decoding & change detection of dns_change.py against
+# the stub nameserver of benchmarks/standins.py
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import shutil
+import socket
+import struct
+import tempfile
+import unittest
+from StringIO import StringIO
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, 'benchmarks')]
+import standins
+import dns_change
+
+RECORDS = {
+    'www.example.com': (['10.0.0.1', '10.0.0.2', '10.0.0.3'], 120),
+    'api.example.com': (['10.0.1.1'], 30),
+}
+SERVICE_SCRIPT = """#!/bin/sh
+echo "$0 $1" >> "$(dirname "$0")/actions.log"
+"""
+
+
+class PatchedModule(object):
+    """Sets attributes of dns_change, restored by restore()"""
+    def patch(self, **kwargs):
+        self.saved = getattr(self, 'saved', {})
+        for name, value in kwargs.items():
+            self.saved.setdefault(name, getattr(dns_change, name))
+            setattr(dns_change, name, value)
+
+    def restore(self):
+        for name, value in getattr(self, 'saved', {}).items():
+            setattr(dns_change, name, value)
+
+
+class DecodeResponseTest(unittest.TestCase):
+    def query(self, name):
+        return dns_change.encode_query(0x1234, name)
+
+    def test_query(self):
+        query = self.query('www.example.com.')
+        self.assertEqual(query[12:], '\x03www\x07example\x03com\x00'
+                         '\x00\x01\x00\x01')
+        # No answer section
+        self.assertEqual(dns_change.decode_response(query),
+                         (0x1234, 0, [], dns_change.NEGATIVE_TTL))
+
+    def test_compressed_a_records(self):
+        response = standins.dns_response(self.query('www.example.com'),
+                                         ['10.0.0.2', '10.0.0.1'], 120)
+        self.assertEqual(dns_change.decode_response(response),
+                         (0x1234, 0, ['10.0.0.1', '10.0.0.2'], 120))
+
+    def test_lowest_a_record_ttl(self):
+        query = self.query('www.example.com')
+        cname = dns_change.encode_query(0, 'lb.example.com')[12:-4]
+        # CNAME record is skipped, its TTL ignored
+        records = [(5, 10, cname), (1, 300, socket.inet_aton('10.0.0.1')),
+                   (1, 60, socket.inet_aton('10.0.0.2'))]
+        response = struct.pack('!HHHHHH', 0x1234, 0x8180, 1, 3, 0, 0) + \
+            query[12:] + ''.join(
+                '\xc0\x0c' + struct.pack('!HHIH', rtype, 1, ttl, len(rdata)) +
+                rdata for rtype, ttl, rdata in records)
+        self.assertEqual(dns_change.decode_response(response),
+                         (0x1234, 0, ['10.0.0.1', '10.0.0.2'], 60))
+
+    def test_nxdomain_negative_ttl(self):
+        response = standins.dns_response(self.query('gone.example.com'),
+                                         None, None)
+        self.assertEqual(dns_change.decode_response(response),
+                         (0x1234, dns_change.RCODE_NXDOMAIN, [],
+                          min(standins.DNS_SOA_TTL,
+                              standins.DNS_SOA_MINIMUM)))
+
+    def test_truncated_response(self):
+        response = standins.dns_response(self.query('www.example.com'),
+                                         ['10.0.0.1'], 120)
+        self.assertRaises((struct.error, IndexError, socket.error),
+                          dns_change.decode_response, response[:-6])
+
+
+class ResolveTest(unittest.TestCase, PatchedModule):
+    def setUp(self):
+        self.server = standins.StubDNSServer(
+            RECORDS, drop={'api.example.com': 1})
+        self.server.start()
+        self.patch(DNS_PORT=self.server.port, RETRY_INTERVAL=0.1,
+                   NO_OF_RETRY=2)
+
+    def tearDown(self):
+        self.restore()
+        self.server.stop()
+
+    def test_names_resolved_at_once(self):
+        answers = dns_change.resolve(['www.example.com', 'api.example.com',
+                                      'gone.example.com'], '127.0.0.1')
+        self.assertEqual(answers, {
+            'www.example.com': (['10.0.0.1', '10.0.0.2', '10.0.0.3'], 120),
+            # Answered after a retry
+            'api.example.com': (['10.0.1.1'], 30),
+            'gone.example.com': ([dns_change.NOT_FOUND_TEXT],
+                                 standins.DNS_SOA_MINIMUM),
+        })
+        # Only the dropped query is sent again
+        queries = self.server.queries()
+        self.assertEqual(queries.count('api.example.com'), 2)
+        self.assertEqual(queries.count('www.example.com'), 1)
+
+    def test_unanswered_names_missing(self):
+        self.server.server.drop['www.example.com'] = 10
+        answers = dns_change.resolve(['www.example.com', 'api.example.com'],
+                                     '127.0.0.1')
+        self.assertEqual(answers.keys(), ['api.example.com'])
+        self.assertEqual(self.server.queries().count('www.example.com'),
+                         dns_change.NO_OF_RETRY + 1)
+
+
+class ChangeTest(unittest.TestCase, PatchedModule):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        init_dir = os.path.join(self.work_dir, 'init.d')
+        os.mkdir(init_dir)
+        with open(os.path.join(init_dir, 'web'), 'w') as f:
+            f.write(SERVICE_SCRIPT)
+        os.chmod(os.path.join(init_dir, 'web'), 0755)
+        self.actions_log = os.path.join(init_dir, 'actions.log')
+        self.track_file = os.path.join(self.work_dir, 'track.json')
+        self.server = standins.StubDNSServer(RECORDS)
+        self.server.start()
+        self.patch(DNS_PORT=self.server.port, RETRY_INTERVAL=0.1,
+                   NO_OF_RETRY=2, INIT_DIR=init_dir + '/',
+                   KEEP_TRACK_FILE=self.track_file,
+                   LOCK_FILENAME=os.path.join(self.work_dir, 'lock'))
+
+    def tearDown(self):
+        self.restore()
+        self.server.stop()
+        shutil.rmtree(self.work_dir)
+
+    def check(self):
+        argv, stdout = sys.argv, sys.stdout
+        sys.argv = ['dns_change.py', '-d', 'www.example.com,api.example.com',
+                    '-n', '127.0.0.1', '-s', 'web']
+        sys.stdout = StringIO()
+        try:
+            dns_change.run()
+        except SystemExit as e:
+            return (e.code, sys.stdout.getvalue())
+        finally:
+            sys.argv, sys.stdout = argv, stdout
+        self.fail("dns_change.run did not exit")
+
+    def expire(self):
+        with open(self.track_file, 'r') as f:
+            track = json.load(f)
+        for entry in track['names'].values():
+            entry['expires'] = 0
+        with open(self.track_file, 'w') as f:
+            json.dump(track, f)
+
+    def actions(self):
+        if not os.path.exists(self.actions_log):
+            return []
+        with open(self.actions_log, 'r') as f:
+            return [os.path.basename(line.strip()) for line in f]
+
+    def test_first_run_tracks_answers(self):
+        self.assertEqual(self.check()[0], dns_change.ST_UK)
+        with open(self.track_file, 'r') as f:
+            names = json.load(f)['names']
+        self.assertEqual(sorted(names), ['api.example.com', 'www.example.com'])
+
+    def test_unexpired_answers_not_queried(self):
+        self.check()
+        queries = len(self.server.queries())
+        self.assertEqual(self.check()[0], dns_change.ST_OK)
+        self.assertEqual(len(self.server.queries()), queries)
+
+    def test_round_robin_is_not_a_change(self):
+        self.check()
+        for i in xrange(3):
+            self.expire()
+            self.assertEqual(self.check()[0], dns_change.ST_OK)
+        self.assertEqual(self.actions(), [])
+
+    def test_change_reloads_services(self):
+        self.check()
+        self.expire()
+        self.server.server.records['api.example.com'] = (['10.0.1.2'], 30)
+        status, output = self.check()
+        self.assertEqual(status, dns_change.ST_WR)
+        self.assertIn("DNS Changed (api.example.com)", output)
+        self.assertEqual(self.actions(), ['web reload'])
+        self.expire()
+        self.assertEqual(self.check()[0], dns_change.ST_OK)
+
+    def test_track_file_writable_by_others_ignored(self):
+        self.check()
+        os.chmod(self.track_file, 0666)
+        status, output = self.check()
+        self.assertEqual(status, dns_change.ST_UK)
+        self.assertIn("OLD dns details not found", output)
+        # Replaced by a private track file
+        self.assertEqual(os.stat(self.track_file).st_mode & 0777, 0600)
+
+    def test_save_failure_is_unknown(self):
+        self.patch(KEEP_TRACK_FILE=os.path.join(self.work_dir, 'missing',
+                                                'track.json'))
+        status, output = self.check()
+        self.assertEqual(status, dns_change.ST_UK)
+        self.assertIn("Saving DNS details failed", output)
+
+
+if __name__ == '__main__':
+    unittest.main()
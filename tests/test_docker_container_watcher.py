@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# Tests of docker_container_watcher.py against the fake docker API & event
+# stream of benchmarks/standins.py, served on a local unix socket. Skipped
+# without docker-py
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import stat
+import time
+import shutil
+import tempfile
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, 'benchmarks')]
+import standins
+try:
+    import docker
+    import docker_container_watcher as watcher
+except ImportError:
+    docker = None
+
+
+def container_id(index):
+    return '%064x' % (index + 1)
+
+
+@unittest.skipIf(docker is None, "docker-py not installed")
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.api = standins.FakeDockerAPI(
+            os.path.join(self.work_dir, 'docker.sock'), 3)
+        self.api.start()
+        self.dclient = docker.Client(base_url="unix://%s"
+                                     % self.api.socket_path)
+        self.snapshot_file = os.path.join(self.work_dir, 'snapshot.json')
+        self.snapshot = watcher.ContainerSnapshot(self.snapshot_file)
+
+    def tearDown(self):
+        self.api.stop()
+        shutil.rmtree(self.work_dir)
+
+    def read_snapshot(self):
+        with open(self.snapshot_file, 'r') as f:
+            return json.load(f)
+
+    def running(self):
+        images = self.read_snapshot()['images']
+        return sorted(images.get(standins.BENCH_TAG, {}))
+
+    def stream_events(self):
+        for event in self.dclient.events(since=0):
+            watcher.handle_event(self.dclient, self.snapshot, event)
+
+    def test_sync_writes_running_containers(self):
+        watcher.sync_containers(self.dclient, self.snapshot)
+        data = self.read_snapshot()
+        self.assertLessEqual(time.time() - data['updated'], 2)
+        containers = data['images'][standins.BENCH_TAG]
+        self.assertEqual(sorted(containers),
+                         [container_id(i) for i in xrange(3)])
+        for index, container in enumerate(self.api.server.containers):
+            created, started = containers[container['Id']]
+            self.assertEqual(created, container['Created'])
+            self.assertEqual(started, container['Created'] + 1)
+        mode = stat.S_IMODE(os.stat(self.snapshot_file).st_mode)
+        self.assertEqual(mode, 0644)
+
+    def test_nothing_written_before_sync(self):
+        self.api.add_event('die', 0)
+        self.stream_events()
+        self.assertFalse(os.path.exists(self.snapshot_file))
+
+    def test_only_die_and_destroy_remove_containers(self):
+        watcher.sync_containers(self.dclient, self.snapshot)
+        self.api.add_event('kill', 0)
+        self.api.add_event('oom', 1)
+        self.api.add_event('die', 2)
+        self.stream_events()
+        self.assertEqual(self.running(), [container_id(0), container_id(1)])
+        self.api.add_event('destroy', 0)
+        self.stream_events()
+        self.assertEqual(self.running(), [container_id(1)])
+
+    def test_start_event_adds_container(self):
+        watcher.sync_containers(self.dclient, self.snapshot)
+        self.api.set_containers(4)
+        self.api.add_event('start', 3)
+        self.stream_events()
+        self.assertEqual(self.running(),
+                         [container_id(i) for i in xrange(4)])
+
+    def test_start_of_removed_container_is_skipped(self):
+        watcher.sync_containers(self.dclient, self.snapshot)
+        # Inspect answers 404 for containers the daemon doesn't have
+        self.api.add_event('start', 5)
+        self.stream_events()
+        self.assertEqual(self.running(),
+                         [container_id(i) for i in xrange(3)])
+
+    def test_event_stream_keeps_snapshot_fresh(self):
+        watcher.sync_containers(self.dclient, self.snapshot)
+        data = self.read_snapshot()
+        data['updated'] -= 60
+        with open(self.snapshot_file, 'w') as f:
+            json.dump(data, f)
+        self.api.add_event('exec_create', 0)
+        self.stream_events()
+        self.assertLessEqual(time.time() - self.read_snapshot()['updated'], 2)
+
+    def test_events_during_resync_listing_are_kept(self):
+        watcher.sync_containers(self.dclient, self.snapshot)
+        test = self
+
+        class RacingClient(object):
+            """Events handled while the resync lists containers"""
+            def containers(self):
+                listing = test.dclient.containers()
+                test.api.set_containers(4)
+                for status, cid in ('die', container_id(0)), \
+                        ('start', container_id(3)):
+                    watcher.handle_event(test.dclient, test.snapshot, {
+                        'Type': 'container', 'status': status, 'id': cid})
+                return listing
+
+            def inspect_container(self, cid):
+                return test.dclient.inspect_container(cid)
+        watcher.sync_containers(RacingClient(), self.snapshot)
+        self.assertEqual(self.running(), [container_id(i) for i in 1, 2, 3])
+
+    def test_invalidated_snapshot_is_not_written(self):
+        watcher.sync_containers(self.dclient, self.snapshot)
+        os.remove(self.snapshot_file)
+        self.snapshot.invalidate()
+        self.api.add_event('die', 0)
+        self.stream_events()
+        self.assertFalse(os.path.exists(self.snapshot_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
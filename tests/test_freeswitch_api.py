@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+#
+# Tests of the event socket client & snapshot reading of freeswitch_api.py,
+# against the fake FreeSWITCH event socket of benchmarks/standins.py &
+# snapshots written by freeswitch_collector.py
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, 'benchmarks')]
+import standins
+import freeswitch_api
+import freeswitch_collector
+
+# Snapshots hold unicode outputs
+STATUS = u'UP \u2713'
+
+
+class ChunkedSocket(object):
+    """Socket returning data in chunks of size bytes, then end of stream"""
+    def __init__(self, data, size):
+        self.chunks = [data[i:i + size] for i in xrange(0, len(data), size)]
+
+    def recv(self, size):
+        if not self.chunks:
+            return ''
+        return self.chunks.pop(0)
+
+    def sendall(self, data):
+        pass
+
+
+def connection(data, size=1):
+    """ESLConnection reading data, without connecting"""
+    esl = freeswitch_api.ESLConnection.__new__(freeswitch_api.ESLConnection)
+    esl.sock = ChunkedSocket(data, size)
+    esl.buffer = ''
+    return esl
+
+
+class ReceiveTest(unittest.TestCase):
+    def test_headers(self):
+        esl = connection("Content-Type: command/reply\nReply-Text: +OK"
+                         " accepted\n\n")
+        self.assertEqual(esl.receive(), ({'Content-Type': 'command/reply',
+                                          'Reply-Text': '+OK accepted'}, ''))
+
+    def test_body_of_content_length(self):
+        body = "line 1\n\nline 2\n"
+        for size in 1, 7, 65536:
+            esl = connection("Content-Type: api/response\nContent-Length:"
+                             " %s\n\n%sContent-Type: command/reply\n\n"
+                             % (len(body), body), size)
+            headers, received = esl.receive()
+            self.assertEqual(received, body)
+            self.assertEqual(esl.receive(),
+                             ({'Content-Type': 'command/reply'}, ''))
+
+    def test_closed_mid_message(self):
+        esl = connection("Content-Type: api/response\nContent-Length: 10\n\n"
+                         "short", 4)
+        self.assertRaises(freeswitch_api.ESLError, esl.receive)
+        esl = connection("Content-Type: api/resp", 4)
+        self.assertRaises(freeswitch_api.ESLError, esl.receive)
+
+    def test_command_skips_other_messages(self):
+        esl = connection("Content-Type: log/data\nContent-Length: 3\n\nlog"
+                         "Content-Type: api/response\nContent-Length: 2\n\n"
+                         "OK", 5)
+        self.assertEqual(esl.api('status'), 'OK')
+
+    def test_disconnect_notice(self):
+        esl = connection("Content-Type: text/disconnect-notice\n"
+                         "Content-Length: 3\n\nbye")
+        self.assertRaises(freeswitch_api.ESLError, esl.api, 'status')
+
+
+class ESLServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = standins.FakeESLServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_api_outputs(self):
+        esl = freeswitch_api.ESLConnection('127.0.0.1', self.server.port,
+                                           'ClueCon', 2)
+        try:
+            for command, output in standins.FREESWITCH_OUTPUTS.items():
+                self.assertEqual(esl.api(command), output)
+            self.assertTrue(esl.api('bogus').startswith('-ERR'))
+        finally:
+            esl.close()
+
+    def test_wrong_password(self):
+        self.assertRaises(freeswitch_api.ESLError,
+                          freeswitch_api.ESLConnection, '127.0.0.1',
+                          self.server.port, 'secret', 2)
+
+    def run_api(self, command, snapshot_file):
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT_DIR, 'freeswitch_api.py'),
+             '-P', str(self.server.port), '-x', command, '-s', snapshot_file],
+            stdout=subprocess.PIPE)
+        output = process.communicate()[0]
+        return (process.returncode, output)
+
+    def test_command_without_snapshot(self):
+        status, output = self.run_api('show calls count', '/nonexistent')
+        self.assertEqual(status, 0)
+        self.assertEqual(output, "%s\n"
+                         % standins.FREESWITCH_OUTPUTS['show calls count'])
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        os.chmod(self.work_dir, 0755)
+        self.snapshot_file = os.path.join(self.work_dir, 'snapshot.json')
+        freeswitch_collector.write_snapshot(self.snapshot_file,
+                                            {'status': STATUS})
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def read(self, command='status', max_age=30):
+        return freeswitch_api.read_snapshot(self.snapshot_file, command,
+                                            max_age)
+
+    def set_updated(self, updated):
+        with open(self.snapshot_file, 'r') as f:
+            snapshot = json.load(f)
+        snapshot['updated'] = updated
+        with open(self.snapshot_file, 'w') as f:
+            json.dump(snapshot, f)
+
+    def test_trusted_snapshot(self):
+        self.assertEqual(self.read(), STATUS.encode('utf-8'))
+
+    def test_missing_command(self):
+        self.assertEqual(self.read('show channels'), None)
+
+    def test_stale_snapshot(self):
+        self.set_updated(time.time() - 60)
+        self.assertEqual(self.read(), None)
+        self.assertEqual(self.read(max_age=120), STATUS.encode('utf-8'))
+
+    def test_snapshot_from_the_future(self):
+        self.set_updated(time.time() + 60)
+        self.assertEqual(self.read(), None)
+
+    def test_writable_by_others(self):
+        os.chmod(self.snapshot_file, 0664)
+        self.assertEqual(self.read(), None)
+        os.chmod(self.snapshot_file, 0644)
+        os.chmod(self.work_dir, 0777)
+        self.assertEqual(self.read(), None)
+
+    def test_symlink(self):
+        link = os.path.join(self.work_dir, 'link.json')
+        os.symlink(self.snapshot_file, link)
+        self.assertEqual(freeswitch_api.read_snapshot(link, 'status', 30),
+                         None)
+
+    def test_invalid_snapshot(self):
+        with open(self.snapshot_file, 'w') as f:
+            f.write('{"updated": ')
+        self.assertEqual(self.read(), None)
+
+    def test_command_served_from_snapshot(self):
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT_DIR, 'freeswitch_api.py'),
+             '-P', '1', '-x', 'status', '-s', self.snapshot_file],
+            stdout=subprocess.PIPE)
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(output, (STATUS + u'\n').encode('utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
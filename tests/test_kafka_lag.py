@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# Tests of the kafka protocol decoding & lag checks of kafka_lag.py against
+# the fake kafka broker of benchmarks/standins.py, including brokers before
+# kafka 0.10.2 without OffsetFetch v2
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import struct
+import subprocess
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, 'benchmarks')]
+import standins
+import kafka_lag
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class ClosingKafkaHandler(standins.KafkaHandler):
+    """Closes the connection on OffsetFetch v2, like kafka before 0.10.2"""
+    def handle(self):
+        try:
+            standins.KafkaHandler.handle(self)
+        except ConnectionClosed:
+            pass
+
+    def api_9(self, request, api_version):
+        if api_version >= 2:
+            raise ConnectionClosed()
+        return standins.KafkaHandler.api_9(self, request, api_version)
+
+
+class UnsupportedKafkaHandler(standins.KafkaHandler):
+    """Answers OffsetFetch v2 with UNSUPPORTED_VERSION"""
+    def api_9(self, request, api_version):
+        if api_version >= 2:
+            request.string()
+            return standins.kafka_array([], None) + struct.pack(
+                '>h', kafka_lag.UNSUPPORTED_VERSION)
+        return standins.KafkaHandler.api_9(self, request, api_version)
+
+
+def topic(index):
+    return "%s_%s" % (standins.BENCH_TOPIC, index)
+
+
+class ReaderTest(unittest.TestCase):
+    def test_primitives(self):
+        data = struct.pack('>hiq', -2, 7, 2 ** 40) + \
+            kafka_lag.encode_string('lag') + kafka_lag.encode_string(None) + \
+            kafka_lag.encode_array([1, 2], lambda i: struct.pack('>i', i)) + \
+            kafka_lag.encode_array(None, None)
+        reader = kafka_lag.Reader(data)
+        self.assertEqual(reader.int16(), -2)
+        self.assertEqual(reader.int32(), 7)
+        self.assertEqual(reader.int64(), 2 ** 40)
+        self.assertEqual(reader.string(), 'lag')
+        self.assertEqual(reader.string(), None)
+        self.assertEqual(reader.array(reader.int32), [1, 2])
+        # Null array
+        self.assertEqual(reader.array(reader.int32), [])
+        self.assertEqual(reader.offset, len(data))
+
+    def test_truncated_response(self):
+        reader = kafka_lag.Reader(struct.pack('>i', 2) + struct.pack('>i', 1))
+        self.assertRaises(kafka_lag.KafkaError, reader.array, reader.int32)
+
+    def test_encode_topics(self):
+        reader = kafka_lag.Reader(kafka_lag.encode_topics(
+            {'b': [1, 0], 'a': [2]}, lambda p: struct.pack('>i', p)))
+        self.assertEqual(reader.array(lambda: (reader.string(),
+                                               reader.array(reader.int32))),
+                         [('a', [2]), ('b', [0, 1])])
+
+    def test_read_committed_offsets(self):
+        def partition(p, offset, error=0):
+            return struct.pack('>iq', p, offset) + \
+                kafka_lag.encode_string('') + struct.pack('>h', error)
+        body = kafka_lag.encode_array([(0, 5), (1, -1)],
+                                      lambda p: partition(*p))
+        data = kafka_lag.encode_string('t') + body
+        reader = kafka_lag.Reader(struct.pack('>i', 1) + data +
+                                  struct.pack('>h', 0))
+        self.assertEqual(kafka_lag.read_committed_offsets(reader, 2),
+                         {('t', 0): 5})
+        reader = kafka_lag.Reader(struct.pack('>i', 0) + struct.pack('>h', 16))
+        try:
+            kafka_lag.read_committed_offsets(reader, 2)
+        except kafka_lag.KafkaError as e:
+            self.assertEqual(e.args, ('NOT_COORDINATOR_FOR_GROUP', 16))
+        else:
+            self.fail("KafkaError not raised")
+
+
+class GroupLagsTest(unittest.TestCase):
+    handler = standins.KafkaHandler
+
+    def setUp(self):
+        self.broker = standins.FakeKafkaBroker(2, topics=2, partitions=3,
+                                               lag=100)
+        self.broker.server.RequestHandlerClass = self.handler
+        self.broker.start()
+        self.groups = standins.FakeKafkaBroker.group_names(2)
+        self.pool = kafka_lag.BrokerPool([self.broker.address()], 5)
+
+    def tearDown(self):
+        self.pool.close()
+        self.broker.stop()
+
+    def expected(self, topics):
+        return dict(((t, p), 100) for t in topics for p in xrange(3))
+
+    def test_lags_of_all_topics(self):
+        lags = kafka_lag.fetch_group_lags(self.pool, self.groups)
+        for group in self.groups:
+            self.assertEqual(lags[group], self.expected([topic(0), topic(1)]))
+
+    def test_lags_of_given_topics(self):
+        lags = kafka_lag.fetch_group_lags(self.pool, self.groups, [topic(1)])
+        for group in self.groups:
+            self.assertEqual(lags[group], self.expected([topic(1)]))
+
+    def test_group_without_offsets(self):
+        lags = kafka_lag.fetch_group_lags(self.pool, ['idle-group'])
+        self.assertEqual(lags['idle-group'], {})
+
+
+class ClosingBrokerLagsTest(GroupLagsTest):
+    handler = ClosingKafkaHandler
+
+
+class UnsupportedBrokerLagsTest(GroupLagsTest):
+    handler = UnsupportedKafkaHandler
+
+
+class CheckTest(unittest.TestCase):
+    def setUp(self):
+        self.broker = standins.FakeKafkaBroker(2, topics=1, partitions=3,
+                                               lag=100)
+        self.broker.start()
+
+    def tearDown(self):
+        self.broker.stop()
+
+    def check(self, *args, **kwargs):
+        brokers = kwargs.get('brokers', self.broker.address())
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT_DIR, 'kafka_lag.py'), '-b',
+             brokers] + list(args), stdout=subprocess.PIPE)
+        output = process.communicate()[0]
+        return (process.returncode, output)
+
+    def test_ok(self):
+        status, output = self.check('-g', 'bench-group_0')
+        self.assertEqual(status, kafka_lag.ST_OK)
+        self.assertTrue(output.startswith(
+            "OK- kafka consumer lag is 300, group 'bench-group_0' |"))
+        self.assertIn("'lag_bench-group_0'=300;50000;150000;0", output)
+        self.assertIn("'lag_bench-group_0_%s_2'=100;;;0" % topic(0), output)
+
+    def test_thresholds_of_many_groups(self):
+        status, output = self.check('-g', 'bench-group_0,bench-group_1',
+                                    '-t', topic(0), '-w', '200', '-c', '300')
+        self.assertEqual(status, kafka_lag.ST_CR)
+        self.assertTrue(output.startswith(
+            "CRITICAL- kafka consumer lag of 2 groups checked |"))
+
+    def test_group_without_offsets(self):
+        status, output = self.check('-g', 'idle-group', '-w', '200')
+        self.assertEqual(status, kafka_lag.ST_WR)
+        self.assertIn("no numeric lag value found", output)
+
+    def test_invalid_thresholds(self):
+        status, output = self.check('-g', 'bench-group_0', '-w', '20',
+                                    '-c', '10')
+        self.assertEqual(status, kafka_lag.ST_UK)
+
+    def test_unreachable_broker(self):
+        status, output = self.check('-g', 'bench-group_0', '-T', '1',
+                                    brokers='127.0.0.1:1')
+        self.assertEqual(status, kafka_lag.ST_CR)
+        self.assertIn("No broker reachable", output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+#
+# Tests of postgres_replication.py. Heartbeats & the check itself run against
+# a local postgres master, given by PGHOST, PGPORT, PGUSER & PGDATABASE
+# (Default: 127.0.0.1, 5432, postgres, postgres), & are skipped if it is not
+# reachable. Skipped without psycopg2
+# Author: Rohit Gupta - @rohit01
+#
+
+import os
+import sys
+import time
+import subprocess
+import unittest
+from StringIO import StringIO
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT_DIR]
+try:
+    import psycopg2
+    import postgres_replication
+except ImportError:
+    psycopg2 = None
+
+LOCAL_MASTER = {
+    'host': os.environ.get('PGHOST', '127.0.0.1'),
+    'port': os.environ.get('PGPORT', '5432'),
+    'user': os.environ.get('PGUSER', 'postgres'),
+    'database': os.environ.get('PGDATABASE', 'postgres'),
+}
+
+
+def arguments(**kwargs):
+    values = dict(postgres_replication.DEFAULTS)
+    values.update(LOCAL_MASTER)
+    values.update(kwargs)
+    postgres_replication.validate_arguments(values)
+    return values
+
+
+def local_master():
+    """Error of connecting to the local master, None if reachable"""
+    if psycopg2 is None:
+        return "psycopg2 not installed"
+    try:
+        postgres_replication.connect(arguments()).close()
+    except psycopg2.Error as e:
+        return "Local postgres not reachable: %s" % str(e).strip()
+    return None
+
+LOCAL_MASTER_ERROR = local_master()
+
+
+@unittest.skipIf(psycopg2 is None, "psycopg2 not installed")
+class ArgumentsTest(unittest.TestCase):
+    def test_defaults(self):
+        values = arguments()
+        self.assertEqual(values['port'], 5432)
+        self.assertEqual(values['interval'], 1.0)
+        self.assertEqual(values['bytes_critical'], None)
+
+    def test_invalid_values(self):
+        for keyname, value in [('database', None), ('interval', '0'),
+                               ('interval', '-1'), ('timeout', '-1'),
+                               ('warning', 'x'), ('bytes_warning', '10')]:
+            self.assertRaises(ValueError, arguments, **{keyname: value})
+
+    def test_wal_position(self):
+        self.assertEqual(postgres_replication.wal_position('16/B374D848'),
+                         (0x16 << 32) + 0xB374D848)
+
+
+@unittest.skipIf(psycopg2 is None, "psycopg2 not installed")
+class CheckReplicaTest(unittest.TestCase):
+    def check(self, status, **kwargs):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            postgres_replication.check_replica(status, arguments(**kwargs))
+        except SystemExit as e:
+            return e.code
+        finally:
+            sys.stdout = stdout
+        self.fail("check_replica did not exit")
+
+    def test_time_lag(self):
+        now = time.time()
+        self.assertEqual(self.check((True, 5.2, now, None, None)),
+                         postgres_replication.ST_OK)
+        self.assertEqual(self.check((True, 100, now, None, None)),
+                         postgres_replication.ST_WR)
+        self.assertEqual(self.check((True, 500, now, None, None)),
+                         postgres_replication.ST_CR)
+
+    def test_missing_heartbeat(self):
+        self.assertEqual(self.check((True, None, time.time(), None, None)),
+                         postgres_replication.ST_UK)
+
+    def test_replay_lag(self):
+        status = (True, 1, time.time(), '1/00001000', '1/00000000')
+        self.assertEqual(self.check(status), postgres_replication.ST_OK)
+        self.assertEqual(self.check(status, bytes_warning='4096',
+                                    bytes_critical='8192'),
+                         postgres_replication.ST_WR)
+        self.assertEqual(self.check(status, bytes_warning='1024',
+                                    bytes_critical='4096'),
+                         postgres_replication.ST_CR)
+
+
+@unittest.skipIf(psycopg2 is None, "psycopg2 not installed")
+class UnreachableHeartbeatTest(unittest.TestCase):
+    def setUp(self):
+        self.connect = postgres_replication.connect
+
+    def tearDown(self):
+        postgres_replication.connect = self.connect
+
+    def failing_connect(self, delay):
+        def connect(arguments):
+            time.sleep(delay)
+            raise psycopg2.OperationalError("could not connect to server")
+        return connect
+
+    def test_failures_counted(self):
+        postgres_replication.connect = self.failing_connect(0)
+        heartbeats, failures = postgres_replication.write_heartbeats(
+            None, arguments(timeout='0.3', interval='0.1'))
+        self.assertEqual(heartbeats, 0)
+        self.assertIn(failures, (3, 4))
+
+    def test_slow_failures_bounded_by_timeout(self):
+        postgres_replication.connect = self.failing_connect(0.25)
+        start_time = time.time()
+        heartbeats, failures = postgres_replication.write_heartbeats(
+            None, arguments(timeout='0.3', interval='0.1'))
+        self.assertEqual(failures, 2)
+        self.assertLess(time.time() - start_time, 0.7)
+
+
+@unittest.skipIf(LOCAL_MASTER_ERROR is not None, LOCAL_MASTER_ERROR)
+class LocalMasterTest(unittest.TestCase):
+    def test_heartbeats_written_every_interval(self):
+        values = arguments(timeout='0.5', interval='0.1')
+        connection = postgres_replication.connect(values)
+        start_time = time.time()
+        heartbeats, failures = postgres_replication.write_heartbeats(
+            connection, values)
+        self.assertLess(time.time() - start_time, 1)
+        self.assertEqual(failures, 0)
+        self.assertIn(heartbeats, (5, 6))
+        connection = postgres_replication.connect(values)
+        try:
+            in_recovery, time_lag, current_epoch, receive, replay = \
+                postgres_replication.read_replica_status(connection)
+        finally:
+            connection.close()
+        self.assertFalse(in_recovery)
+        self.assertLess(time_lag, 1)
+        self.assertLess(abs(current_epoch - time.time()), 5)
+
+    def test_check_on_master(self):
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT_DIR, 'postgres_replication.py'),
+             '-H', LOCAL_MASTER['host'], '-p', LOCAL_MASTER['port'], '-U',
+             LOCAL_MASTER['user'], '-d', LOCAL_MASTER['database'], '-t', '0.3',
+             '-i', '0.1'], stdout=subprocess.PIPE)
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, postgres_replication.ST_OK)
+        self.assertTrue(output.startswith("OK - Value inserted successfully"))
+        self.assertIn("heartbeat_failures=0;;;0", output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+#
+# Nagios NRPE plugin for traceroute checks (max hop + delay). Unlike
+# 'traceroute -U', which waits for one hop after another, UDP probes for all
+# TTLs of all given hosts are sent at once & ICMP replies are matched back to
+# their probe: the source port identifies the host & the UDP length the TTL,
+# both quoted in the ICMP error. A check takes at most --timeout seconds,
+# whatever the hop count. This needs a raw ICMP socket, i.e. root or
+# CAP_NET_RAW. Without it, 'traceroute -U' is run for all hosts concurrently,
+# as the check did before.
+# Only ICMP replies are matched, so probes go to the unused port 33434 like
+# classic traceroute by default, not to port 53 like 'traceroute -U': a host
+# serving the port answers or drops the probes instead of reporting port
+# unreachable, & its path would never end.
+# Author: Rohit Gupta - @rohit01
+#
+
+import sys
+import time
+import errno
+import select
+import socket
+import struct
+import subprocess
+from optparse import OptionParser
+
+
+__version__ = 1.1
+VERSION = "Version: %s, Author: Rohit Gupta - @rohit01" % __version__
+OPTIONS = {
+    'H': "hostname;Comma separated FQDNs or IPv4 addresses for which" \
+         " traceroute check needs to be executed, concurrently. Mandatory",
+    't': "timeout;Seconds to wait for replies of the probes. Default: 1",
+    'm': "maxhops;Max hops (TTL) to probe. Default: 50",
+    'p': "port;Destination UDP port of the probes. Must be a port the hosts" \
+         " don't serve. Default: 33434, or 53 when falling back to" \
+         " traceroute -U",
+    'w': "warning;Hop count warning level. Default: 15",
+    'c': "critical;Hop count critical level. Default: 30",
+    'a': "averagedelaywarning;Average delay warning level in ms." \
+         " Default: 200",
+    'A': "averagedelaycritical;Average delay critical level in ms." \
+         " Default: 1000",
+    'd': "lasthopdelaywarning;Last hop delay warning level in ms." \
+         " Default: 300",
+    'D': "lasthopdelaycritical;Last hop delay critical level in ms." \
+         " Default: 2000",
+}
+DEFAULTS = {
+    'timeout': '1',
+    'maxhops': '50',
+    'port': None,
+    'warning': '15',
+    'critical': '30',
+    'averagedelaywarning': '200',
+    'averagedelaycritical': '1000',
+    'lasthopdelaywarning': '300',
+    'lasthopdelaycritical': '2000',
+}
+MAX_TTL = 255
+# Default destination ports of the probes & of 'traceroute -U'
+PROBE_PORT = 33434
+TRACEROUTE_PORT = 53
+TRACEROUTE_COMMAND = "traceroute -w %(timeout)s -q 1 -m %(maxhops)s -U" \
+    " -p %(port)s %(hostname)s"
+
+# ICMP types
+ICMP_DEST_UNREACH = 3
+ICMP_TIME_EXCEEDED = 11
+IPPROTO_UDP = 17
+
+# Nagios exit status values
+ST_OK = 0
+ST_WR = 1
+ST_CR = 2
+ST_UK = 3
+STATUS_TEXT = {
+    ST_OK: 'OK',
+    ST_WR: 'WARNING',
+    ST_CR: 'CRITICAL',
+    ST_UK: 'UNKNOWN',
+}
+
+
+def parse_options():
+    parser = OptionParser(version=VERSION)
+    for option, description in OPTIONS.items():
+        shortopt = '-%s' % (option)
+        longopt = '--%s' % (description.split(';')[0])
+        keyname = description.split(';')[0]
+        help = ''
+        if len(description.split(';')) > 1:
+            help = description.split(';')[1]
+        parser.add_option(shortopt, longopt, dest=keyname, help=help)
+    (options, args) = parser.parse_args()
+    arguments = {}
+    for keyname, default in DEFAULTS.items():
+        value = getattr(options, keyname)
+        if value is None or value.strip() == '':
+            value = default
+        arguments[keyname] = value
+    arguments['hostname'] = options.hostname
+    return arguments
+
+
+def exit_formalalities(message, exit_status):
+    print message
+    sys.exit(exit_status)
+
+
+def validate_arguments(arguments):
+    arguments['hostname'] = [h.strip() for h in
+                             (arguments['hostname'] or '').split(',')
+                             if h.strip()]
+    if not arguments['hostname']:
+        raise ValueError("Mandatory option -H/--hostname not specified")
+    for keyname in DEFAULTS.keys():
+        if keyname == 'port' and arguments[keyname] is None:
+            continue
+        if not arguments[keyname].isdigit():
+            raise ValueError("Invalid value: '%s' for option --%s. Possible"
+                             " value: Positive integer" % (arguments[keyname],
+                                                           keyname))
+        arguments[keyname] = int(arguments[keyname])
+    if not 0 < arguments['maxhops'] <= MAX_TTL:
+        raise ValueError("Invalid value: '%s' for option -m/--maxhops."
+                         " Possible values: 1 to %s" % (arguments['maxhops'],
+                                                        MAX_TTL))
+    if arguments['port'] is not None and not 0 < arguments['port'] < 65536:
+        raise ValueError("Invalid value: '%s' for option -p/--port"
+                         % arguments['port'])
+
+
+class PathProbe(object):
+    """
+    UDP probes with TTLs 1 to maxhops to one host, from a socket of its own,
+    whose port identifies the host in ICMP replies. The TTL of a probe is its
+    payload length, so its UDP length is 8 + TTL
+    """
+    def __init__(self, hostname, port, maxhops):
+        self.hostname = hostname
+        self.address = socket.gethostbyname(hostname)
+        self.port = port
+        self.maxhops = maxhops
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('', 0))
+        self.source_port = self.sock.getsockname()[1]
+        self.sent = {}
+        self.rtts = {}
+        # TTL of the reply ending the path: from the host or unreachable
+        self.last_ttl = None
+        self.error = None
+
+    def send(self):
+        for ttl in xrange(1, self.maxhops + 1):
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+            self.sent[ttl] = time.time()
+            self.sock.sendto('\0' * ttl, (self.address, self.port))
+
+    def reply(self, ttl, icmp_type, received):
+        if ttl not in self.sent or ttl in self.rtts:
+            return
+        self.rtts[ttl] = (received - self.sent[ttl]) * 1000
+        # Port unreachable from the host, or any other unreachable on the
+        # way, ends the path like in traceroute
+        if icmp_type == ICMP_DEST_UNREACH:
+            if self.last_ttl is None or ttl < self.last_ttl:
+                self.last_ttl = ttl
+
+    def complete(self):
+        """True once the path ends & every hop before has replied"""
+        if self.last_ttl is None:
+            return False
+        return all(ttl in self.rtts for ttl in xrange(1, self.last_ttl))
+
+    def hops(self):
+        """RTT in ms or None per hop, like the lines of traceroute"""
+        hop_count = self.last_ttl or self.maxhops
+        return [self.rtts.get(ttl) for ttl in xrange(1, hop_count + 1)]
+
+    def close(self):
+        self.sock.close()
+
+
+def traceroute_command(hostname, arguments):
+    return TRACEROUTE_COMMAND % dict(
+        arguments, hostname=hostname,
+        port=arguments['port'] or TRACEROUTE_PORT)
+
+
+class TracerouteCommand(object):
+    """
+    'traceroute -U' to one host, for unprivileged runs. Same interface as
+    PathProbe once finished
+    """
+    def __init__(self, hostname, arguments):
+        self.hostname = hostname
+        self.error = None
+        self.output = ''
+        self.command = traceroute_command(hostname, arguments)
+        self.process = subprocess.Popen(self.command.split(),
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+
+    def wait(self):
+        self.output, _ = self.process.communicate()
+        if self.process.returncode != 0:
+            self.error = "'%s' command failed" % self.command
+
+    def hops(self):
+        """RTT in ms or None per hop line, like traceroute_udp.sh parsed"""
+        hops = []
+        for line in self.output.splitlines():
+            fields = line.split()
+            if not fields or not fields[0].isdigit():
+                continue
+            try:
+                hops.append(float(fields[3]))
+            except (IndexError, ValueError):
+                hops.append(None)
+        return hops or [None]
+
+    def close(self):
+        pass
+
+
+def run_traceroute(hostnames, arguments):
+    """Run traceroute for all hosts concurrently"""
+    commands = []
+    for hostname in hostnames:
+        try:
+            commands.append(TracerouteCommand(hostname, arguments))
+        except OSError as e:
+            exit_formalalities("CRITICAL - '%s' command failed: %s"
+                               % (traceroute_command(hostname, arguments),
+                                  e), ST_CR)
+    for command in commands:
+        command.wait()
+    return commands
+
+
+def parse_icmp(packet):
+    """
+    Returns a tuple: (icmp type, probe destination, probe source port, probe
+    destination port, probe UDP length) of an ICMP error about a UDP packet,
+    else None
+    """
+    header_length = (ord(packet[0]) & 0x0f) * 4
+    if len(packet) < header_length + 8:
+        return None
+    icmp_type = ord(packet[header_length])
+    if icmp_type not in (ICMP_DEST_UNREACH, ICMP_TIME_EXCEEDED):
+        return None
+    quoted = packet[header_length + 8:]
+    if len(quoted) < 20:
+        return None
+    quoted_length = (ord(quoted[0]) & 0x0f) * 4
+    if ord(quoted[9]) != IPPROTO_UDP or len(quoted) < quoted_length + 8:
+        return None
+    destination = socket.inet_ntoa(quoted[16:20])
+    source_port, destination_port, udp_length = struct.unpack(
+        '!HHH', quoted[quoted_length:quoted_length + 6])
+    return (icmp_type, destination, source_port, destination_port,
+            udp_length)
+
+
+def trace(probes, timeout):
+    """Send all probes at once & collect replies for up to timeout seconds"""
+    icmp_sock = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                              socket.IPPROTO_ICMP)
+    try:
+        by_source_port = {}
+        pending = set()
+        for probe in probes:
+            try:
+                probe.send()
+            except socket.error as e:
+                probe.error = e
+                continue
+            by_source_port[probe.source_port] = probe
+            pending.add(probe)
+        deadline = time.time() + timeout
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                readable, _, _ = select.select([icmp_sock], [], [], remaining)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not readable:
+                break
+            packet, _ = icmp_sock.recvfrom(65536)
+            received = time.time()
+            reply = parse_icmp(packet)
+            if reply is None:
+                continue
+            icmp_type, destination, source_port, destination_port, \
+                udp_length = reply
+            probe = by_source_port.get(source_port)
+            if probe is None or destination != probe.address or \
+                    destination_port != probe.port:
+                continue
+            probe.reply(udp_length - 8, icmp_type, received)
+            if probe.complete():
+                pending.discard(probe)
+    finally:
+        icmp_sock.close()
+
+
+def round_of(value):
+    return int(value + 0.5)
+
+
+def path_status(probe, arguments):
+    """
+    Returns a tuple: (exit status, message, perf data) of a traced path,
+    with the thresholds of traceroute_udp.sh
+    """
+    if probe.error is not None:
+        return (ST_CR, "%s: traceroute failed. %s" % (probe.hostname,
+                                                       probe.error), '')
+    hops = probe.hops()
+    hop_count = len(hops)
+    rtts = [rtt for rtt in hops if rtt is not None]
+    star_hop_count = hop_count - len(rtts)
+    last_hop_delay = hops[-1]
+    avg_hop_delay = None
+    if rtts:
+        avg_hop_delay = round_of(sum(rtts) / len(rtts))
+    if last_hop_delay is not None:
+        last_hop_delay = round_of(last_hop_delay)
+    exit_status = ST_OK
+    reasons = []
+    if hop_count >= arguments['critical']:
+        reasons.append("Hop Count >= %s(CR)" % arguments['critical'])
+        exit_status = ST_CR
+    elif hop_count >= arguments['warning']:
+        reasons.append("Hop Count >= %s(WR)" % arguments['warning'])
+        exit_status = ST_WR
+    if last_hop_delay is None:
+        reasons.append("Packet LOST(CR)")
+        exit_status = ST_CR
+    elif last_hop_delay >= arguments['lasthopdelaycritical']:
+        reasons.append("Last hop delay >= %s(CR)"
+                       % arguments['lasthopdelaycritical'])
+        exit_status = ST_CR
+    elif last_hop_delay >= arguments['lasthopdelaywarning']:
+        reasons.append("Last hop delay >= %s(WR)"
+                       % arguments['lasthopdelaywarning'])
+        exit_status = max(exit_status, ST_WR)
+    if avg_hop_delay is None:
+        exit_status = ST_CR
+    elif avg_hop_delay >= arguments['averagedelaycritical']:
+        reasons.append("Avg. hop delay >= %s(CR)"
+                       % arguments['averagedelaycritical'])
+        exit_status = ST_CR
+    elif avg_hop_delay >= arguments['averagedelaywarning']:
+        reasons.append("Avg. hop delay >= %s(WR)"
+                       % arguments['averagedelaywarning'])
+        exit_status = max(exit_status, ST_WR)
+    message = "Hop count: %s; * hops: %s" % (hop_count, star_hop_count)
+    if last_hop_delay is not None:
+        message = "%s; Last hop delay: %s ms" % (message, last_hop_delay)
+    if avg_hop_delay is not None:
+        message = "%s; Avg hop delay: %s ms" % (message, avg_hop_delay)
+    if reasons:
+        message = "%s. Reason: %s" % (message, '; '.join(reasons))
+    prefix = ''
+    if len(arguments['hostname']) > 1:
+        prefix = "%s_" % probe.hostname
+        message = "%s: %s" % (probe.hostname, message)
+    perf_data = ["'%shops'=%s;%s;%s;0" % (prefix, hop_count,
+                                          arguments['warning'],
+                                          arguments['critical'])]
+    if last_hop_delay is not None:
+        perf_data.append("'%stotal_rtt'=%.3fms;%s;%s;0" % (
+            prefix, hops[-1], arguments['lasthopdelaywarning'],
+            arguments['lasthopdelaycritical']))
+    if avg_hop_delay is not None:
+        perf_data.append("'%savg_rtt'=%.3fms;%s;%s;0" % (
+            prefix, sum(rtts) / len(rtts), arguments['averagedelaywarning'],
+            arguments['averagedelaycritical']))
+    for ttl, rtt in enumerate(hops, 1):
+        if rtt is not None:
+            perf_data.append("'%shop_%s_rtt'=%.3fms;;;0" % (prefix, ttl, rtt))
+    return (exit_status, message, ' '.join(perf_data))
+
+
+def run():
+    arguments = parse_options()
+    try:
+        validate_arguments(arguments)
+    except ValueError as e:
+        exit_formalalities("UNKNOWN - %s" % e, ST_UK)
+    probes = []
+    results = {}
+    for hostname in arguments['hostname']:
+        try:
+            probes.append(PathProbe(hostname,
+                                    arguments['port'] or PROBE_PORT,
+                                    arguments['maxhops']))
+        except socket.error as e:
+            results[hostname] = (ST_CR, "%s: traceroute failed. %s"
+                                 % (hostname, e), '')
+    try:
+        trace(probes, arguments['timeout'])
+    except socket.error as e:
+        if e.errno not in (errno.EPERM, errno.EACCES):
+            exit_formalalities("CRITICAL - traceroute failed. %s" % e, ST_CR)
+        # Not privileged for a raw socket
+        probes = run_traceroute([probe.hostname for probe in probes],
+                                arguments)
+    finally:
+        for probe in probes:
+            probe.close()
+    for probe in probes:
+        results[probe.hostname] = path_status(probe, arguments)
+    results = [results[hostname] for hostname in arguments['hostname']]
+    exit_status = max(status for status, _, _ in results)
+    perf_data = ' '.join(data for _, _, data in results if data)
+    if perf_data:
+        perf_data = " | %s" % perf_data
+    if len(results) == 1:
+        exit_formalalities("%s - %s%s" % (STATUS_TEXT[exit_status],
+                                          results[0][1], perf_data),
+                           exit_status)
+    details = ["%s - %s" % (STATUS_TEXT[status], message)
+               for status, message, _ in results]
+    exit_formalalities("%s - traceroute of %s hosts checked%s\n%s"
+                       % (STATUS_TEXT[exit_status], len(results), perf_data,
+                          '\n'.join(details)), exit_status)
+
+
+if __name__ == '__main__':
+    run()
@@ -4,11 +4,22 @@
 # python requests library
 #
 
-import requests
+import instrumentation
+with instrumentation.phase('import'):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.exceptions import HTTPError
+    from requests.packages.urllib3 import connectionpool
+    from requests.packages.urllib3.util import connection as urllib3_connection
+import json
+import re
+import socket
 import sys
 import time
+import threading
+import urlparse
+import Queue
 from optparse import OptionParser
-from requests.exceptions import HTTPError
 
 # Nagios exit status values
 ST_OK = 0
@@ -18,30 +29,140 @@ ST_UK = 3
 # Global variables
 exit_status = ST_OK
 reason_for_service_down_list = None
+reason_for_warning_list = None
 MAX_RETRIES = 1
 exception_occured = False
+url_timings = []
+# Pooled keep-alive sessions, one per scheme & host
+sessions = {}
+sessions_lock = threading.Lock()
+session_pool_size = 1
+# Latency phases measured for every URL
+PHASES = ['dns', 'connect', 'tls', 'ttfb', 'total']
+# Per thread phase times & exceptions of the URL being tested
+phase_timer = threading.local()
+phase_warning = {}
+phase_critical = {}
+# Response body assertions, evaluated while streaming the body in chunks
+CHUNK_SIZE = 16384
+REGEX_OVERLAP = 4096
+DEFAULT_MAX_BYTES = 1048576
+body_assertions = {
+    'match': [],
+    'no_match': [],
+    'min_size': None,
+    'max_size': None,
+    'json_key': None,
+    'max_bytes': DEFAULT_MAX_BYTES,
+}
+MULTIPLE_VALUE_OPTIONS = ['match', 'no_match']
+# Options without value
+FLAG_OPTIONS = ['profile']
 
 OPTIONS = {
     'H': "hostnames;URLs separated by comma to be tested",
     't': "timeout;Timeout for http connection in seconds. Default: 5",
+    'w': "workers;Number of URLs to be tested in parallel. Default: 1",
+    'd': "deadline;Overall deadline for testing all URLs in seconds." \
+         " Default: no deadline",
+    'W': "phase_warning;Latency warning levels in seconds per phase." \
+         " Phases: dns, connect, tls, ttfb & total. Example: ttfb=1,total=2",
+    'C': "phase_critical;Latency critical levels in seconds per phase." \
+         " Same format as phase_warning",
+    'm': "match;Regex which must match the response body. Can be repeated",
+    'n': "no_match;Regex which must not match the response body. Can be" \
+         " repeated",
+    's': "min_size;Minimum response body size in bytes",
+    'S': "max_size;Maximum response body size in bytes",
+    'j': "json_key;Dot separated key path which must exist in the JSON" \
+         " response body. Example: data.status",
+    'b': "max_bytes;Maximum response body bytes read per URL. Assertions" \
+         " are evaluated on these bytes. Default: 1048576",
+    'p': "profile;Write a cProfile dump & JSON phase timing report of this" \
+         " run in profile_dir",
+    'P': "profile_dir;Directory for profiles. Default:" \
+         " /var/tmp/nrpe_plugin_profiles",
 }
 
 
+class PhaseTimingMixin(object):
+    """
+    urllib3 connection mixin recording DNS lookup and TCP connect time of new
+    connections in phase_timer. Reused keep-alive connections record nothing.
+    """
+    def _new_conn(self):
+        host = getattr(self, '_dns_host', self.host)
+        extra_kw = {}
+        if self.source_address:
+            extra_kw['source_address'] = self.source_address
+        if getattr(self, 'socket_options', None):
+            extra_kw['socket_options'] = self.socket_options
+        start_time = time.time()
+        addr_info = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+        resolved_time = time.time()
+        conn = None
+        error = None
+        for family, socktype, proto, canonname, sockaddr in addr_info:
+            try:
+                conn = urllib3_connection.create_connection(
+                    (sockaddr[0], self.port), self.timeout, **extra_kw)
+                break
+            except socket.error as e:
+                error = e
+        if conn is None:
+            raise error
+        times = getattr(phase_timer, 'times', None)
+        if times is not None:
+            times['dns'] = resolved_time - start_time
+            times['connect'] = time.time() - resolved_time
+        return conn
+
+
+class TimedHTTPConnection(PhaseTimingMixin,
+                          connectionpool.HTTPConnectionPool.ConnectionCls):
+    pass
+
+
+class TimedHTTPSConnection(PhaseTimingMixin,
+                           connectionpool.HTTPSConnectionPool.ConnectionCls):
+    def connect(self):
+        start_time = time.time()
+        connectionpool.HTTPSConnectionPool.ConnectionCls.connect(self)
+        times = getattr(phase_timer, 'times', None)
+        if times is not None:
+            times['tls'] = max(0.0, time.time() - start_time - times['dns']
+                               - times['connect'])
+
+
+class TimedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
 def retry_for_network_exceptions(function, max_retries=MAX_RETRIES):
     def handled_function(*args, **kwargs):
-        global exception_occured
-        global exit_status
         result = None
         for i in xrange(max_retries):
             try:
                 result = function(*args, **kwargs)
                 break
             except Exception:
-                # Not sure about exact exception
-                exception_occured = True
-                if exit_status == ST_OK:
-                    exit_status = ST_WR
-                time.sleep(1)
+                # Not sure about exact exception. Recorded by test_urls()
+                phase_timer.exception = True
+                if i < max_retries - 1:
+                    time.sleep(1)
         return result
     return handled_function
 
@@ -55,48 +176,328 @@ def parse_options():
         help = ''
         if len(description.split(';')) > 1:
             help = description.split(';')[1]
-        parser.add_option(shortopt, longopt, dest=keyname, help=help)
+        if keyname in MULTIPLE_VALUE_OPTIONS:
+            action = 'append'
+        elif keyname in FLAG_OPTIONS:
+            action = 'store_true'
+        else:
+            action = 'store'
+        parser.add_option(shortopt, longopt, dest=keyname, action=action,
+                          help=help)
     (options, args) = parser.parse_args()
     return options
 
 
 def exit_formalalities(message, exit_status):
     print message
+    instrumentation.stop_profile()
     sys.exit(exit_status)
 
 
-def test_url(name, url, timeout=None):
+def parse_phase_thresholds(value):
+    thresholds = {}
+    if not value:
+        return thresholds
+    for item in value.split(','):
+        if item.strip() == '':
+            continue
+        phase, _, level = item.partition('=')
+        phase = phase.strip()
+        if phase not in PHASES:
+            raise ValueError()
+        thresholds[phase] = float(level)
+    return thresholds
+
+
+def get_session(url):
+    scheme, netloc = urlparse.urlsplit(url)[:2]
+    key = (scheme, netloc)
+    with sessions_lock:
+        session = sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = TimedHTTPAdapter(pool_connections=1,
+                                       pool_maxsize=session_pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            sessions[key] = session
+    return session
+
+
+@instrumentation.timed
+def fetch_url(url, timeout=None):
+    phase_timer.times = dict((phase, 0.0) for phase in PHASES)
+    start_time = time.time()
+    response = get_session(url).get(url, timeout=timeout, stream=True)
+    phase_timer.times['ttfb'] = time.time() - start_time
+    return response
+
+
+def lookup_json_key(document, key_path):
+    for key in key_path.split('.'):
+        if isinstance(document, list):
+            document = document[int(key)]
+        else:
+            document = document[key]
+    return document
+
+
+@instrumentation.timed
+def check_body(response, name, url):
+    """
+    Stream the response body in chunks and evaluate body_assertions. Reading
+    stops as soon as every assertion is decided or max_bytes are read.
+    Regex matches spanning more than REGEX_OVERLAP bytes across chunk
+    boundaries are not detected.
+    Returns a tuple: (failure message or None, body bytes read)
+    """
+    pending_match = list(body_assertions['match'])
+    no_match = body_assertions['no_match']
+    json_key = body_assertions['json_key']
+    min_size = body_assertions['min_size']
+    max_size = body_assertions['max_size']
+    max_bytes = body_assertions['max_bytes']
+    has_assertions = pending_match or no_match or json_key \
+        or min_size is not None or max_size is not None
+    # Use content length, if available, to decide size assertions upfront
+    size_known = False
+    if not response.headers.get('content-encoding'):
+        try:
+            content_length = int(response.headers.get('content-length'))
+            size_known = True
+        except (TypeError, ValueError):
+            pass
+    if size_known:
+        if max_size is not None and content_length > max_size:
+            return ('Body size %s bytes > %s bytes for URL: %s (%s)'
+                    % (content_length, max_size, url, name), 0)
+        if min_size is not None and content_length < min_size:
+            return ('Body size %s bytes < %s bytes for URL: %s (%s)'
+                    % (content_length, min_size, url, name), 0)
+        if has_assertions and not (pending_match or no_match or json_key):
+            return (None, 0)
+    bytes_read = 0
+    truncated = False
+    tail = ''
+    json_chunks = []
+    for chunk in response.iter_content(CHUNK_SIZE):
+        if bytes_read + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - bytes_read]
+            truncated = True
+        bytes_read += len(chunk)
+        window = tail + chunk
+        for regex in list(pending_match):
+            if regex.search(window):
+                pending_match.remove(regex)
+        for regex in no_match:
+            if regex.search(window):
+                return ('Body matches %s for URL: %s (%s)'
+                        % (regex.pattern, url, name), bytes_read)
+        tail = window[-REGEX_OVERLAP:]
+        if json_key:
+            json_chunks.append(chunk)
+        if max_size is not None and bytes_read > max_size:
+            return ('Body size > %s bytes for URL: %s (%s)'
+                    % (max_size, url, name), bytes_read)
+        # Truncated only if the body has bytes beyond max_bytes. A body of
+        # exactly max_bytes ends on the next read
+        if truncated:
+            break
+        if has_assertions and not (pending_match or no_match or json_key):
+            size_pending = (not size_known) and (
+                max_size is not None or
+                (min_size is not None and bytes_read < min_size))
+            if not size_pending:
+                break
+    if pending_match:
+        return ('Body does not match %s within %s bytes for URL: %s (%s)'
+                % (pending_match[0].pattern, bytes_read, url, name),
+                bytes_read)
+    if min_size is not None and bytes_read < min_size and not size_known:
+        return ('Body size %s bytes < %s bytes for URL: %s (%s)'
+                % (bytes_read, min_size, url, name), bytes_read)
+    if json_key:
+        if truncated:
+            return ('JSON body larger than %s bytes for URL: %s (%s)'
+                    % (max_bytes, url, name), bytes_read)
+        try:
+            lookup_json_key(json.loads(''.join(json_chunks)), json_key)
+        except ValueError:
+            return ('Invalid JSON body for URL: %s (%s)' % (url, name),
+                    bytes_read)
+        except (KeyError, IndexError, TypeError):
+            return ('JSON key %s missing for URL: %s (%s)'
+                    % (json_key, url, name), bytes_read)
+    return (None, bytes_read)
+
+
+def record_exception():
+    global exception_occured
+    global exit_status
+    exception_occured = True
+    if exit_status == ST_OK:
+        exit_status = ST_WR
+
+
+def record_warning(message):
+    global exit_status
+    global reason_for_warning_list
+    if exit_status == ST_OK:
+        exit_status = ST_WR
+    if reason_for_warning_list is None:
+        reason_for_warning_list = []
+    reason_for_warning_list.append(message)
+
+
+def record_failure(message):
     global exit_status
     global reason_for_service_down_list
+    exit_status = ST_CR
+    if reason_for_service_down_list is None:
+        reason_for_service_down_list = []
+    reason_for_service_down_list.append(message)
+
+
+def test_url(name, url, timeout=None):
+    """
+    Test an URL, without recording anything, as workers may still be
+    running after the deadline.
+    Returns a tuple: (phase times, failure messages, warning messages,
+    whether an exception occured)
+    """
     message = None
-    response = requests.get(url, timeout=timeout)
+    failures = []
+    warnings = []
+    phase_timer.exception = False
+    start_time = time.time()
+    response = fetch_url(url, timeout=timeout)
+    times = dict(getattr(phase_timer, 'times', {}))
     if response is None:
         message = 'Exception occured: %s (%s)' % (url, name)
-        exit_status = ST_CR
     elif response.status_code != 200:
         message = 'Response status code: %s for URL: %s (%s)' \
             % (response.status_code, url, name)
-        exit_status = ST_CR
     elif response.ok is not True:
         message = 'Response not ok for URL: %s (%s)' % (url, name)
-        exit_status = ST_CR
     else:
         try:
             response.raise_for_status()
         except HTTPError:
             message = 'HTTPError occured for URL: %s (%s)' % (url, name)
-            exit_status = ST_CR
+    if message is None:
+        try:
+            message, times['bytes'] = check_body(response, name, url)
+        except Exception as e:
+            message = 'Exception occured while reading body: %s (%s). %s' \
+                % (url, name, e)
+    if response is not None:
+        # Unread connections are dropped, fully read ones go back to the pool
+        response.close()
+    times['total'] = time.time() - start_time
     if message is not None:
-        if reason_for_service_down_list is None:
-            reason_for_service_down_list = []
-        reason_for_service_down_list.append(message)
+        failures.append(message)
+        return (times, failures, warnings, phase_timer.exception)
+    for phase in PHASES:
+        value = times.get(phase, 0.0)
+        if phase in phase_critical and value > phase_critical[phase]:
+            failures.append('%s time %.3fs > %ss for URL: %s (%s)'
+                            % (phase, value, phase_critical[phase], url, name))
+        elif phase in phase_warning and value > phase_warning[phase]:
+            warnings.append('%s time %.3fs > %ss for URL: %s (%s)'
+                            % (phase, value, phase_warning[phase], url, name))
+    return (times, failures, warnings, phase_timer.exception)
+
+
+@instrumentation.timed
+def test_urls(url_list, timeout=None, workers=1, deadline=None):
+    """
+    Test (name, url) pairs using a bounded pool of worker threads. URLs not
+    tested within the overall deadline (in seconds) are reported as failed.
+    Per URL phase times are collected in url_timings.
+    Workers only queue their results. They are recorded by this thread, so
+    workers still running past the deadline change nothing
+    """
+    pending = Queue.Queue()
+    for index, (name, url) in enumerate(url_list):
+        pending.put((index, name, url))
+    finished = Queue.Queue()
+
+    def worker():
+        while True:
+            try:
+                index, name, url = pending.get_nowait()
+            except Queue.Empty:
+                return
+            finished.put((index, test_url(name, url, timeout=timeout)))
+
+    if not url_list:
+        return
+    threads = []
+    for i in xrange(min(workers, len(url_list))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    results = {}
+    end_time = None
+    if deadline is not None:
+        end_time = time.time() + deadline
+    while len(results) < len(url_list):
+        wait = None
+        if end_time is not None:
+            wait = end_time - time.time()
+            if wait <= 0:
+                break
+        try:
+            index, result = finished.get(timeout=wait)
+        except Queue.Empty:
+            break
+        results[index] = result
+    if len(results) == len(url_list):
+        # Workers are only left with an empty queue, let them exit cleanly
+        for thread in threads:
+            thread.join()
+    for index, (name, url) in enumerate(url_list):
+        if index not in results:
+            record_failure('Deadline of %ss exceeded for URL: %s (%s)'
+                           % (deadline, url, name))
+            continue
+        times, failures, warnings, exception = results[index]
+        url_timings.append((name, times))
+        if exception:
+            record_exception()
+        for message in failures:
+            record_failure(message)
+        for message in warnings:
+            record_warning(message)
+
+
+def calc_perf_data(timeout=None):
+    data = []
+    names_used = {}
+    for name, times in url_timings:
+        names_used[name] = names_used.get(name, 0) + 1
+        if names_used[name] > 1:
+            name = '%s_%s' % (name, names_used[name])
+        for phase in PHASES:
+            if phase == 'total':
+                label = 'time_%s' % name
+            else:
+                label = '%s_%s' % (phase, name)
+            data.append("'%s'=%.6fs;%s;%s;0;%s" % (
+                label, times.get(phase, 0.0), phase_warning.get(phase, ''),
+                phase_critical.get(phase, ''), timeout or ''))
+        if 'bytes' in times:
+            data.append("'bytes_%s'=%sB;;;0;%s" % (
+                name, times['bytes'], body_assertions['max_bytes']))
+    return ' '.join(data)
 
 ######################################################
 ################## Execute the Test ##################
 ######################################################
 
 if __name__ == '__main__':
-    requests.get = retry_for_network_exceptions(requests.get)
+    fetch_url = retry_for_network_exceptions(fetch_url)
     # Adding exception handling descriptor
     arguments_passed = parse_options()
     hostnames = arguments_passed.hostnames
@@ -112,8 +513,62 @@ if __name__ == '__main__':
         except ValueError:
             print 'UNKNOWN - Invalid value passed for timeout'
             sys.exit(ST_UK)
+    workers = arguments_passed.workers
+    if workers is None:
+        workers = 1
+    else:
+        try:
+            workers = int(workers)
+            if workers < 1:
+                raise ValueError()
+        except ValueError:
+            print 'UNKNOWN - Invalid value passed for workers'
+            sys.exit(ST_UK)
+    deadline = arguments_passed.deadline
+    if deadline is not None:
+        try:
+            deadline = float(deadline)
+            if deadline <= 0:
+                raise ValueError()
+        except ValueError:
+            print 'UNKNOWN - Invalid value passed for deadline'
+            sys.exit(ST_UK)
+    try:
+        phase_warning = parse_phase_thresholds(arguments_passed.phase_warning)
+        phase_critical = parse_phase_thresholds(
+            arguments_passed.phase_critical)
+    except ValueError:
+        print 'UNKNOWN - Invalid value passed for phase_warning/phase_critical'
+        sys.exit(ST_UK)
+    session_pool_size = workers
+    try:
+        body_assertions['match'] = [re.compile(regex) for regex in
+                                    arguments_passed.match or []]
+        body_assertions['no_match'] = [re.compile(regex) for regex in
+                                       arguments_passed.no_match or []]
+    except re.error:
+        print 'UNKNOWN - Invalid regex passed for match/no_match'
+        sys.exit(ST_UK)
+    body_assertions['json_key'] = arguments_passed.json_key
+    for keyname in 'min_size', 'max_size', 'max_bytes':
+        value = getattr(arguments_passed, keyname)
+        if value is None:
+            continue
+        try:
+            body_assertions[keyname] = int(value)
+            if body_assertions[keyname] < 0:
+                raise ValueError()
+        except ValueError:
+            print 'UNKNOWN - Invalid value passed for %s' % keyname
+            sys.exit(ST_UK)
+    max_bytes = body_assertions['max_bytes']
+    if (body_assertions['min_size'] or 0) > max_bytes or \
+            (body_assertions['max_size'] or 0) >= max_bytes:
+        print 'UNKNOWN - min_size/max_size must be less than max_bytes'
+        sys.exit(ST_UK)
 
     name_list = []
+    url_list = []
     for url in hostnames.split(','):
         url = url.strip()
         if url == '':
@@ -123,10 +578,14 @@ if __name__ == '__main__':
         name = name.replace('https://', '')
         name = name.split('/')[0]
         name_list.append(name)
-        test_url(name, url, timeout=timeout)
+        url_list.append((name, url))
+    if arguments_passed.profile:
+        instrumentation.start_profile('url_test', arguments_passed.profile_dir)
+    test_urls(url_list, timeout=timeout, workers=workers, deadline=deadline)
+    perf_data = instrumentation.perf_data(calc_perf_data(timeout=timeout))
     if reason_for_service_down_list is not None:
         message = '; '.join(reason_for_service_down_list)
-        message = 'CRITICAL - %s' % message
+        message = 'CRITICAL - %s | %s' % (message, perf_data)
         exit_formalalities(message, exit_status=exit_status)
 
     if exception_occured is True:
@@ -141,6 +600,9 @@ if __name__ == '__main__':
     elif exit_status == ST_WR:
         message = 'WARNING - %s%s tested successfully with warnings' \
                   % (exception_message, ', '.join(name_list))
+        if reason_for_warning_list is not None:
+            message = '%s. Reason: %s' % (message,
+                                          '; '.join(reason_for_warning_list))
     elif exit_status == ST_CR:
         message = 'CRITICAL - %s%s test Failed' % (exception_message,
                                                    ', '.join(name_list))
@@ -148,4 +610,5 @@ if __name__ == '__main__':
         message = 'UNKNOWN - %s%s test unknown result' % (exception_message,
                                                           ', '.join(name_list))
 
+    message = '%s | %s' % (message, perf_data)
     exit_formalalities(message, exit_status=exit_status)